@@ -0,0 +1,33 @@
+"""Add bedGraph file format
+
+Revision ID: 1f7a3c9e4d2b
+Revises: 5d2c8e1f3a6b
+Create Date: 2026-10-16 22:03:51.218460
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f7a3c9e4d2b'
+down_revision = '5d2c8e1f3a6b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # See the migration adding the CSV file format.
+    context = op.get_context()
+    if context.bind.dialect.name == 'postgresql':
+        if context.bind.dialect.server_version_info >= (9, 3):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE IF NOT EXISTS 'bedgraph'")
+            return
+        if context.bind.dialect.server_version_info >= (9, 1):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE 'bedgraph'")
+            return
+    raise Exception('Sorry, only PostgreSQL >= 9.1 is supported by this migration')
+
+
+def downgrade():
+    pass
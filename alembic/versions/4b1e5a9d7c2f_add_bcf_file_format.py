@@ -0,0 +1,33 @@
+"""Add BCF file format
+
+Revision ID: 4b1e5a9d7c2f
+Revises: 3c9ae2b54f1d
+Create Date: 2026-10-16 19:52:08.127344
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b1e5a9d7c2f'
+down_revision = '3c9ae2b54f1d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # See the migration adding the CSV file format.
+    context = op.get_context()
+    if context.bind.dialect.name == 'postgresql':
+        if context.bind.dialect.server_version_info >= (9, 3):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE IF NOT EXISTS 'bcf'")
+            return
+        if context.bind.dialect.server_version_info >= (9, 1):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE 'bcf'")
+            return
+    raise Exception('Sorry, only PostgreSQL >= 9.1 is supported by this migration')
+
+
+def downgrade():
+    pass
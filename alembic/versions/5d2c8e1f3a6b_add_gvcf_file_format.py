@@ -0,0 +1,33 @@
+"""Add gVCF file format
+
+Revision ID: 5d2c8e1f3a6b
+Revises: 4b1e5a9d7c2f
+Create Date: 2026-10-16 21:14:37.502318
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d2c8e1f3a6b'
+down_revision = '4b1e5a9d7c2f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # See the migration adding the CSV file format.
+    context = op.get_context()
+    if context.bind.dialect.name == 'postgresql':
+        if context.bind.dialect.server_version_info >= (9, 3):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE IF NOT EXISTS 'gvcf'")
+            return
+        if context.bind.dialect.server_version_info >= (9, 1):
+            op.execute('COMMIT')
+            op.execute("ALTER TYPE filetype ADD VALUE 'gvcf'")
+            return
+    raise Exception('Sorry, only PostgreSQL >= 9.1 is supported by this migration')
+
+
+def downgrade():
+    pass
@@ -0,0 +1,12 @@
+"""
+Benchmarks for importing and annotating data.
+
+Synthetic data is generated against a reference genome (by default the one
+bundled with the unit tests) and run through the import and annotation
+pipeline. Results are written as JSON, so they can be compared across
+commits. See :mod:`benchmarks.run` for usage.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
@@ -0,0 +1,312 @@
+"""
+Run import and annotation benchmarks on synthetic data.
+
+Example usage::
+
+    $ python -m benchmarks.run --records 20000 --samples 10 \\
+        --database sqlite:// --database postgresql://localhost/varda_bench \\
+        --output results.json
+
+For every database, all tables are dropped and recreated, so never point
+this at a database with data you want to keep.
+
+Reading and importing observations is measured for the first VCF file in
+both VCF and BCF format.
+
+For each stage, the result has the number of records processed, wall and
+CPU time, records per second, the number of SQL statements executed (and
+per record), and the peak resident set size of the process so far.
+
+.. note:: Rows written with PostgreSQL ``COPY`` (see :mod:`varda.bulk`) do
+    not go through SQLAlchemy and are not counted as queries.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from __future__ import division
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyfasta import Fasta
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+
+from varda import celery, create_app, db, tasks
+from varda.models import Coverage, DataSource, Sample, User, Variation
+
+from .synthetic import generate_bed, generate_vcf, write_bcf
+
+
+DEFAULT_GENOME = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), os.pardir, 'tests', 'data', 'hg19.fa'))
+
+
+class QueryCounter(object):
+    """
+    Count the SQL statements executed on an engine.
+    """
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+@contextmanager
+def measure(results, stage, records, database=None, queries=None):
+    """
+    Measure the wall and CPU time of a stage and add the result to
+    `results`.
+    """
+    start_queries = queries.count if queries is not None else 0
+    start_cpu = time.clock()
+    start = time.time()
+    yield
+    seconds = time.time() - start
+    cpu_seconds = time.clock() - start_cpu
+    query_count = (queries.count - start_queries
+                   if queries is not None else 0)
+
+    # On Linux, ru_maxrss is in kilobytes.
+    results.append({'stage': stage,
+                    'database': database,
+                    'records': records,
+                    'seconds': seconds,
+                    'cpu_seconds': cpu_seconds,
+                    'records_per_second': records / seconds if seconds else None,
+                    'queries': query_count,
+                    'queries_per_record': query_count / records if records else None,
+                    'peak_rss_kb': resource.getrusage(
+                        resource.RUSAGE_SELF).ru_maxrss})
+    sys.stderr.write('%s%s: %d records in %.2f seconds\n' % (
+        stage, ' (%s)' % database if database else '', records, seconds))
+
+
+def git_revision():
+    """
+    Current commit of the working directory, or `None` if unknown.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(__file__), stderr=open(os.devnull, 'w')
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_database(uri, work_dir, genome, vcf_files, bcf_file, bed_file,
+                       records, regions, sort_observations=False):
+    """
+    Import the synthetic data in a database and annotate the first VCF file.
+    Finally, the first VCF file is imported again from `bcf_file` (in BCF
+    format).
+
+    :return: List of results.
+    :rtype: list(dict)
+    """
+    database = make_url(uri).drivername
+    data_dir = tempfile.mkdtemp(dir=work_dir)
+    settings = {'DATA_DIR': data_dir,
+                'SECONDARY_DATA_DIR': work_dir,
+                'GENOME': genome,
+                'REFERENCE_MISMATCH_ABORT': True,
+                'SQLALCHEMY_DATABASE_URI': uri,
+                'BROKER_URL': 'memory://',
+                'CELERY_RESULT_BACKEND': 'cache',
+                'CELERY_CACHE_BACKEND': 'memory',
+                'CELERY_ALWAYS_EAGER': True,
+                'CELERY_EAGER_PROPAGATES_EXCEPTIONS': True}
+    results = []
+
+    app = create_app(settings)
+    celery.conf['IMPORT_SORT_OBSERVATIONS'] = sort_observations
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        queries = QueryCounter(db.engine)
+
+        user = User('Benchmark', 'benchmark', password='benchmark')
+        db.session.add(user)
+
+        coverage_source = DataSource(user, 'Coverage', 'bed',
+                                     local_file=os.path.basename(bed_file))
+        coverage = Coverage(Sample(user, 'Sample 1', group=[]),
+                            coverage_source)
+        db.session.add(coverage)
+        db.session.commit()
+
+        with measure(results, 'import_coverage', regions, database,
+                     queries):
+            tasks.import_coverage.delay(coverage.id)
+
+        # Every VCF file is imported in its own sample, the first one in the
+        # sample that also has coverage.
+        variations = []
+        for i, vcf_file in enumerate(vcf_files):
+            sample = coverage.sample if i == 0 else Sample(
+                user, 'Sample %d' % (i + 1), coverage_profile=False,
+                group=[])
+            data_source = DataSource(user, 'Variation %d' % (i + 1), 'vcf',
+                                     local_file=os.path.basename(vcf_file))
+            variation = Variation(sample, data_source)
+            db.session.add(variation)
+            variations.append(variation)
+        db.session.commit()
+
+        with measure(results, 'import_variation', records * len(vcf_files),
+                     database, queries):
+            for variation in variations:
+                tasks.import_variation.delay(variation.id)
+
+        for variation in variations:
+            variation.sample.active = True
+        db.session.commit()
+
+        with open(vcf_files[0]) as original:
+            with open(os.devnull, 'w') as annotated:
+                with measure(results, 'annotate_variants', records, database,
+                             queries):
+                    tasks.annotate_variants(original, annotated,
+                                            original_records=records,
+                                            group_query=[])
+
+        data_source = DataSource(user, 'Variation (BCF)', 'bcf',
+                                 local_file=os.path.basename(bcf_file))
+        variation = Variation(Sample(user, 'Sample (BCF)',
+                                     coverage_profile=False, group=[]),
+                              data_source)
+        db.session.add(variation)
+        db.session.commit()
+
+        with measure(results, 'import_variation_bcf', records, database,
+                     queries):
+            tasks.import_variation.delay(variation.id)
+
+        db.session.remove()
+        db.drop_all()
+
+    shutil.rmtree(data_dir)
+    return results
+
+
+def main():
+    """
+    Run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', metavar='URI', dest='databases',
+                        action='append', help='database to benchmark, can '
+                        'be given more than once, all data in it is deleted '
+                        '(default: sqlite://)')
+    parser.add_argument('--genome', default=DEFAULT_GENOME,
+                        help='reference genome Fasta file (default: the '
+                        'genome bundled with the unit tests)')
+    parser.add_argument('--chromosome', help='chromosome to place variants '
+                        'and regions on (default: the first in the genome)')
+    parser.add_argument('--records', type=int, default=10000,
+                        help='number of records per VCF file (default: '
+                        '10000)')
+    parser.add_argument('--samples', type=int, default=1,
+                        help='number of samples per VCF file (default: 1)')
+    parser.add_argument('--imports', type=int, default=1,
+                        help='number of VCF files to import, each in their '
+                        'own sample (default: 1)')
+    parser.add_argument('--multiallelic-rate', type=float, default=0.05,
+                        dest='multiallelic_rate', help='fraction of '
+                        'multi-allelic records (default: 0.05)')
+    parser.add_argument('--indel-rate', type=float, default=0.1,
+                        dest='indel_rate', help='fraction of insertion and '
+                        'deletion records (default: 0.1)')
+    parser.add_argument('--regions', type=int, default=1000,
+                        help='number of regions in the BED file (default: '
+                        '1000)')
+    parser.add_argument('--sort-observations', action='store_true',
+                        dest='sort_observations', help='sort observations '
+                        'on import (see IMPORT_SORT_OBSERVATIONS)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        default=sys.stdout, help='file to write JSON '
+                        'results to (default: standard output)')
+    args = parser.parse_args()
+
+    genome_path = os.path.abspath(args.genome)
+    genome = Fasta(genome_path)
+    chromosome = args.chromosome or sorted(genome.keys())[0]
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        vcf_files = []
+        for i in range(args.imports):
+            vcf_file = os.path.join(work_dir, 'variation%d.vcf' % (i + 1))
+            with open(vcf_file, 'w') as handle:
+                records = generate_vcf(
+                    handle, genome, chromosome, args.records,
+                    samples=args.samples,
+                    multiallelic_rate=args.multiallelic_rate,
+                    indel_rate=args.indel_rate, seed=args.seed + i)
+            vcf_files.append(vcf_file)
+
+        bcf_file = os.path.join(work_dir, 'variation1.bcf')
+        with open(vcf_files[0]) as vcf, open(bcf_file, 'wb') as handle:
+            write_bcf(vcf, handle)
+
+        bed_file = os.path.join(work_dir, 'coverage.bed')
+        with open(bed_file, 'w') as handle:
+            regions = generate_bed(handle, genome, chromosome, args.regions,
+                                   seed=args.seed)
+
+        results = []
+
+        # Reading observations does not need a database, but it does need
+        # the configuration (for the reference genome).
+        with create_app({'GENOME': genome_path}).app_context():
+            with open(vcf_files[0]) as observations:
+                with measure(results, 'read_observations', records):
+                    for _ in tasks.read_observations(observations):
+                        pass
+            with open(bcf_file, 'rb') as observations:
+                with measure(results, 'read_observations_bcf', records):
+                    for _ in tasks.read_observations(observations,
+                                                     filetype='bcf'):
+                        pass
+
+        for uri in args.databases or ['sqlite://']:
+            results.extend(benchmark_database(
+                uri, work_dir, genome_path, vcf_files, bcf_file, bed_file,
+                records, regions, sort_observations=args.sort_observations))
+    finally:
+        shutil.rmtree(work_dir)
+
+    parameters = dict(vars(args))
+    del parameters['output']
+    parameters['databases'] = [make_url(uri).drivername for uri in
+                               args.databases or ['sqlite://']]
+
+    json.dump({'revision': git_revision(),
+               'date': datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'parameters': parameters,
+               'results': results}, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
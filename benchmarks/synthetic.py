@@ -0,0 +1,219 @@
+"""
+Generators for synthetic VCF, BCF and BED files.
+
+All variants and regions are placed on the given reference genome, so the
+generated data passes reference checks on import.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import random
+import struct
+
+
+NUCLEOTIDES = 'ACGT'
+
+VCF_HEADER = """##fileformat=VCFv4.1
+##source=varda-benchmarks
+##contig=<ID={chromosome},length={length}>
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{samples}
+"""
+
+
+def _alleles(rng, sequence, position, multiallelic_rate, indel_rate):
+    """
+    Choose reference and alternate alleles for a variant at `position`
+    (one-based).
+    """
+    reference = sequence[position - 1]
+
+    if rng.random() < indel_rate:
+        if rng.random() < 0.5:
+            # Deletion of up to 5 bases, including the padding base.
+            length = rng.randint(1, 5)
+            return (sequence[position - 1:position + length],
+                    [reference])
+        inserted = ''.join(rng.choice(NUCLEOTIDES)
+                           for _ in range(rng.randint(1, 5)))
+        return reference, [reference + inserted]
+
+    alternates = [n for n in NUCLEOTIDES if n != reference]
+    rng.shuffle(alternates)
+    if rng.random() < multiallelic_rate:
+        return reference, alternates[:2]
+    return reference, alternates[:1]
+
+
+def _genotype(rng, alleles):
+    """
+    Choose a diploid genotype, mostly reference.
+    """
+    if rng.random() < 0.6:
+        return '0/0'
+    first = rng.randint(0, alleles)
+    second = rng.randint(max(first, 1), alleles)
+    return '%d/%d' % (first, second)
+
+
+def generate_vcf(handle, genome, chromosome, records, samples=1,
+                 multiallelic_rate=0.05, indel_rate=0.1, seed=None):
+    """
+    Write a synthetic VCF file.
+
+    :arg handle: Open handle to write to.
+    :type handle: file-like object
+    :arg genome: Reference genome.
+    :type genome: pyfasta.Fasta
+    :arg chromosome: Chromosome to place variants on.
+    :type chromosome: str
+    :arg records: Number of records.
+    :type records: int
+    :kwarg samples: Number of samples (genotype columns).
+    :type samples: int
+    :kwarg multiallelic_rate: Fraction of SNV records with two alternate
+        alleles.
+    :type multiallelic_rate: float
+    :kwarg indel_rate: Fraction of records that are insertions or
+        deletions.
+    :type indel_rate: float
+    :kwarg seed: Seed for the random number generator.
+    :type seed: int
+
+    :return: Number of records written.
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    sequence = str(genome[chromosome]).upper()
+    length = len(sequence)
+
+    # Leave room for deletions at the end of the chromosome. Positions with
+    # an unknown reference base are skipped, so we might write fewer records
+    # than requested.
+    positions = [p for p in sorted(rng.sample(xrange(1, length - 5),
+                                              min(records, length - 6)))
+                 if sequence[p - 1] in NUCLEOTIDES]
+
+    handle.write(VCF_HEADER.format(
+        chromosome=chromosome, length=length,
+        samples='\t'.join('sample%d' % i for i in range(1, samples + 1))))
+
+    for position in positions:
+        reference, alternates = _alleles(rng, sequence, position,
+                                         multiallelic_rate, indel_rate)
+        calls = '\t'.join('%s:%d' % (_genotype(rng, len(alternates)),
+                                     rng.randint(5, 60))
+                          for _ in range(samples))
+        handle.write('%s\t%d\t.\t%s\t%s\t%d\tPASS\t.\tGT:DP\t%s\n' % (
+            chromosome, position, reference, ','.join(alternates),
+            rng.randint(20, 1000), calls))
+
+    return len(positions)
+
+
+def _typed_string(value):
+    """
+    Encode a string as BCF typed value.
+    """
+    if len(value) < 15:
+        return chr(len(value) << 4 | 7) + value
+    return '\xf7' + _typed_int(len(value)) + value
+
+
+def _typed_int(value):
+    """
+    Encode a small integer as BCF typed value.
+    """
+    if value < 0x80:
+        return '\x11' + struct.pack('<b', value)
+    return '\x13' + struct.pack('<i', value)
+
+
+def write_bcf(vcf, handle):
+    """
+    Write a VCF file generated by :func:`generate_vcf` in the (uncompressed)
+    BCF2 format.
+
+    Only what :func:`generate_vcf` writes is supported: a single contig, no
+    INFO values, and GT and DP as FORMAT fields.
+
+    :arg vcf: Open handle to the VCF file.
+    :type vcf: file-like object
+    :arg handle: Open handle to write to.
+    :type handle: file-like object
+
+    :return: Number of records written.
+    :rtype: int
+    """
+    header = []
+    for line in vcf:
+        header.append(line)
+        if line.startswith('#CHROM'):
+            break
+    # The dictionary of strings has PASS first, the FORMAT fields follow in
+    # order of appearance (GT, DP).
+    header.insert(1, '##FILTER=<ID=PASS,Description="All filters passed">\n')
+    text = ''.join(header) + '\0'
+    handle.write('BCF\x02\x02' + struct.pack('<I', len(text)) + text)
+
+    records = 0
+    for line in vcf:
+        fields = line.rstrip('\n').split('\t')
+        alleles = [fields[3]] + fields[4].split(',')
+        calls = [call.split(':') for call in fields[9:]]
+        shared = (struct.pack('<iiifII', 0, int(fields[1]) - 1,
+                              len(fields[3]), float(fields[5]),
+                              len(alleles) << 16, 2 << 24 | len(calls)) +
+                  _typed_string('') +
+                  ''.join(_typed_string(allele) for allele in alleles) +
+                  _typed_int(0))
+        indiv = _typed_int(1) + '\x21'
+        for genotype, _ in calls:
+            indiv += ''.join(struct.pack('<b', (int(allele) + 1) << 1)
+                             for allele in genotype.split('/'))
+        indiv += _typed_int(2) + '\x11'
+        indiv += ''.join(struct.pack('<b', int(depth)) for _, depth in calls)
+        handle.write(struct.pack('<II', len(shared), len(indiv)) + shared +
+                     indiv)
+        records += 1
+
+    return records
+
+
+def generate_bed(handle, genome, chromosome, regions, min_length=50,
+                 max_length=500, seed=None):
+    """
+    Write a synthetic BED file with sorted (possibly overlapping) regions.
+
+    :arg handle: Open handle to write to.
+    :type handle: file-like object
+    :arg genome: Reference genome.
+    :type genome: pyfasta.Fasta
+    :arg chromosome: Chromosome to place regions on.
+    :type chromosome: str
+    :arg regions: Number of regions.
+    :type regions: int
+    :kwarg min_length: Minimum region length.
+    :type min_length: int
+    :kwarg max_length: Maximum region length.
+    :type max_length: int
+    :kwarg seed: Seed for the random number generator.
+    :type seed: int
+
+    :return: Number of regions written.
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    length = len(genome[chromosome])
+
+    starts = sorted(rng.randint(0, length - max_length)
+                    for _ in range(regions))
+    for start in starts:
+        handle.write('%s\t%d\t%d\n' % (
+            chromosome, start, start + rng.randint(min_length, max_length)))
+
+    return regions
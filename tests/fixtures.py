@@ -42,7 +42,7 @@ def monkey_patch_fixture():
 
 
 class _EmptyUpload(object):
-    def read(self):
+    def read(self, size=-1):
         return ''
 
 
@@ -83,6 +83,21 @@ class DataSourceData(DataSet):
         name = 'Exome coverage'
         filetype = 'bed'
         local_file = 'exome.bed'
+    class exome_unsorted_coverage:
+        user = UserData.test_user
+        name = 'Exome coverage (unsorted)'
+        filetype = 'bed'
+        local_file = 'exome-unsorted.bed'
+    class exome_overlapping_coverage:
+        user = UserData.test_user
+        name = 'Exome coverage (overlapping)'
+        filetype = 'bed'
+        local_file = 'exome-overlapping.bed'
+    class exome_depth_coverage:
+        user = UserData.test_user
+        name = 'Exome depth'
+        filetype = 'bedgraph'
+        local_file = 'exome.bedgraph'
     class exome_variation:
         user = UserData.test_user
         name = 'Exome variants'
@@ -93,6 +108,16 @@ class DataSourceData(DataSet):
         name = 'Exome variants (filtered)'
         filetype = 'vcf'
         local_file = 'exome-filtered.vcf'
+    class exome_variation_bcf:
+        user = UserData.test_user
+        name = 'Exome variants (BCF)'
+        filetype = 'bcf'
+        local_file = 'exome.bcf'
+    class exome_variation_gvcf:
+        user = UserData.test_user
+        name = 'Exome variants (gVCF)'
+        filetype = 'gvcf'
+        local_file = 'exome.g.vcf'
     class exome_subset_coverage:
         user = UserData.test_user
         name = 'Exome (subset) coverage'
@@ -130,6 +155,15 @@ class CoverageData(DataSet):
     class exome_subset_coverage:
         sample = SampleData.exome_subset_sample
         data_source = DataSourceData.exome_subset_coverage
+    class exome_unsorted_coverage:
+        sample = SampleData.exome_sample
+        data_source = DataSourceData.exome_unsorted_coverage
+    class exome_overlapping_coverage:
+        sample = SampleData.exome_sample
+        data_source = DataSourceData.exome_overlapping_coverage
+    class exome_depth_coverage:
+        sample = SampleData.exome_sample
+        data_source = DataSourceData.exome_depth_coverage
 
 
 class VariationData(DataSet):
@@ -142,6 +176,12 @@ class VariationData(DataSet):
     class exome_variation_duplicate:
         sample = SampleData.exome_sample
         data_source = DataSourceData.exome_variation
+    class exome_variation_bcf:
+        sample = SampleData.exome_sample
+        data_source = DataSourceData.exome_variation_bcf
+    class exome_variation_gvcf:
+        sample = SampleData.exome_sample
+        data_source = DataSourceData.exome_variation_gvcf
     class exome_subset_variation:
         sample = SampleData.exome_subset_sample
         data_source = DataSourceData.exome_subset_variation
@@ -5,6 +5,8 @@ Todo: Look at http://packages.python.org/Flask-Testing/
 """
 
 
+import gzip
+import hashlib
 from StringIO import StringIO
 import json
 import tempfile
@@ -13,8 +15,8 @@ import time
 from nose.tools import *
 import vcf
 
-from varda import create_app, db
-from varda.models import User
+from varda import bcf_reader, create_app, db, utils
+from varda.models import DataSource, User
 
 
 TEST_SETTINGS = {
@@ -354,6 +356,111 @@ class TestApi():
         else:
             assert False
 
+    def test_upload_digest(self):
+        """
+        Calculate the digest of uploaded data sources.
+        """
+        with open('tests/data/exome.vcf') as data:
+            expected = utils.digest(data)
+        with open('tests/data/exome.vcf') as data:
+            compressed = StringIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+                f.write(data.read())
+
+        for data in ({'data': open('tests/data/exome.vcf')},
+                     {'data': (StringIO(compressed.getvalue()), 'exome.vcf.gz'),
+                      'gzipped': 'true'}):
+            data.update(name='Test observations', filetype='vcf')
+            r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header(login='trader', password='test')])
+            assert_equal(r.status_code, 201)
+            data_source = json.loads(r.data)['data_source']['uri']
+            with self.app.test_request_context():
+                data_source = DataSource.query.get(int(data_source.split('/')[-1]))
+                assert_equal((data_source.checksum, data_source.records), expected)
+
+    def test_upload_bcf(self):
+        """
+        Upload BGZF-compressed BCF data, which is stored as-is.
+        """
+        with open('tests/data/exome.bcf', 'rb') as data:
+            content = data.read()
+        with gzip.GzipFile(fileobj=StringIO(content)) as data:
+            expected = (hashlib.sha1(data.read()).hexdigest(),
+                        sum(1 for _ in bcf_reader.Reader(StringIO(content))))
+
+        data = {'name': 'Test observations', 'filetype': 'bcf',
+                'data': (StringIO(content), 'exome.bcf')}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 201)
+        data_source = json.loads(r.data)['data_source']['uri']
+
+        r = self.client.get(data_source + '/data', headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 200)
+        assert_equal(r.data, content)
+
+        with self.app.test_request_context():
+            data_source = DataSource.query.get(int(data_source.split('/')[-1]))
+            assert_equal((data_source.checksum, data_source.records), expected)
+
+    def test_upload_corrupt_gzip(self):
+        """
+        Upload corrupt gzip-compressed data.
+        """
+        with open('tests/data/exome.vcf') as data:
+            compressed = StringIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+                f.write(data.read())
+        corrupt = bytearray(compressed.getvalue())
+        corrupt[100:110] = '\xff' * 10
+
+        data = {'name': 'Test observations', 'filetype': 'vcf',
+                'data': (StringIO(str(corrupt)), 'exome.vcf.gz'),
+                'gzipped': 'true'}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 400)
+        assert_equal(json.loads(r.data)['error']['code'], 'invalid_data')
+
+    def test_chunked_upload(self):
+        """
+        Upload a data source in chunks.
+        """
+        with open('tests/data/exome.vcf') as data:
+            content = data.read()
+            data.seek(0)
+            expected = utils.digest(data)
+
+        data = {'name': 'Test observations', 'filetype': 'vcf', 'chunked': 'true'}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 201)
+        data_source = json.loads(r.data)['data_source']['uri']
+        assert_equal(json.loads(r.data)['data_source']['upload'], {'offset': 0})
+
+        data = {'offset': 0, 'data': (StringIO(content[:1000]), 'exome.vcf')}
+        r = self.client.post(data_source + '/upload', data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 200)
+
+        # Uploading the same chunk again is not allowed.
+        data = {'offset': 0, 'data': (StringIO(content[:1000]), 'exome.vcf')}
+        r = self.client.post(data_source + '/upload', data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 400)
+
+        r = self.client.get(data_source, headers=[auth_header(login='trader', password='test')])
+        assert_equal(json.loads(r.data)['data_source']['upload'], {'offset': 1000})
+
+        data = {'offset': 1000, 'done': 'true', 'data': (StringIO(content[1000:]), 'exome.vcf')}
+        r = self.client.post(data_source + '/upload', data=data, headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 200)
+        assert 'upload' not in json.loads(r.data)['data_source']
+
+        r = self.client.get(data_source + '/data', headers=[auth_header(login='trader', password='test')])
+        assert_equal(r.status_code, 200)
+        with gzip.GzipFile(fileobj=StringIO(r.data)) as data:
+            assert_equal(data.read(), content)
+
+        with self.app.test_request_context():
+            data_source = DataSource.query.get(int(data_source.split('/')[-1]))
+            assert_equal((data_source.checksum, data_source.records), expected)
+
     def test_embed(self):
         """
         Serialized variation can have data source embedded.
@@ -465,6 +572,52 @@ class TestApi():
         r = self.client.post(self.uri_annotations, data=json.dumps(data), content_type='application/json', headers=[auth_header(login='trader', password='test')])
         assert_equal(r.status_code, 201)
 
+    def test_annotate_region(self):
+        """
+        Annotate the variants in a region.
+        """
+        with open('tests/data/gonl-summary.vcf') as vcf_file:
+            positions = [int(line.split('\t')[1]) for line in vcf_file
+                         if not line.startswith('#')]
+
+        data = {'name': 'Test observations',
+                'filetype': 'vcf',
+                'data': open('tests/data/gonl-summary.vcf')}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        vcf_data_source = r.headers['Location'].replace('http://localhost', '')
+
+        # The region must be complete.
+        data = {'data_source': vcf_data_source, 'group_query': [],
+                'region': {'chromosome': '20', 'begin': positions[10]}}
+        r = self.client.post(self.uri_annotations, data=json.dumps(data), content_type='application/json', headers=[auth_header()])
+        assert_equal(r.status_code, 400)
+
+        # The region must not be inverted.
+        data = {'data_source': vcf_data_source, 'group_query': [],
+                'region': {'chromosome': '20', 'begin': positions[20],
+                           'end': positions[10]}}
+        r = self.client.post(self.uri_annotations, data=json.dumps(data), content_type='application/json', headers=[auth_header()])
+        assert_equal(r.status_code, 400)
+        assert_equal(json.loads(r.data)['error']['code'], 'bad_request')
+
+        data = {'data_source': vcf_data_source, 'group_query': [],
+                'region': {'chromosome': '20', 'begin': positions[10],
+                           'end': positions[20]}}
+        r = self.client.post(self.uri_annotations, data=json.dumps(data), content_type='application/json', headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        annotation = json.loads(r.data)['annotation']['uri']
+
+        r = self.client.get(annotation, headers=[auth_header()])
+        assert json.loads(r.data)['annotation']['task']['done']
+        annotated_data_source = json.loads(r.data)['annotation']['annotated_data_source']['uri']
+
+        r = self.client.get(annotated_data_source + '/data', headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        with gzip.GzipFile(fileobj=StringIO(r.data)) as data:
+            assert_equal([record.POS for record in vcf.Reader(data)],
+                         positions[10:21])
+
     def _annotate(self, vcf_data_source, sample_frequency=None):
         """
         Annotate observations and return the annotated data source URI.
@@ -0,0 +1,90 @@
+"""
+Test the synthetic data generators used by the benchmarks.
+"""
+
+
+import StringIO
+
+from flask.ext.testing import TestCase
+from nose.tools import *
+from pyfasta import Fasta
+
+from varda import create_app, tasks
+
+from benchmarks.synthetic import generate_bed, generate_vcf, write_bcf
+
+
+TEST_SETTINGS = {
+    'TESTING': True,
+    'GENOME': 'tests/data/hg19.fa',
+    'REFERENCE_MISMATCH_ABORT': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+}
+
+
+class TestSynthetic(TestCase):
+    """
+    Test the synthetic VCF and BED generators.
+    """
+    def create_app(self):
+        return create_app(TEST_SETTINGS)
+
+    def setUp(self):
+        self.genome = Fasta(TEST_SETTINGS['GENOME'])
+
+    def test_generate_vcf(self):
+        """
+        Generated variants match the reference genome.
+        """
+        vcf = StringIO.StringIO()
+        records = generate_vcf(vcf, self.genome, 'chr20', 500, samples=3,
+                               multiallelic_rate=0.2, indel_rate=0.3, seed=1)
+        assert_equal(len([line for line in vcf.getvalue().split('\n')
+                          if line and not line.startswith('#')]), records)
+        vcf.seek(0)
+
+        # Reading observations aborts on reference mismatches.
+        observations = list(tasks.read_observations(vcf))
+        assert observations
+        assert any(len(o[3]) != len(o[4]) for o in observations)
+
+    def test_generate_vcf_seed(self):
+        """
+        Generated variants only depend on the seed.
+        """
+        first, second = StringIO.StringIO(), StringIO.StringIO()
+        generate_vcf(first, self.genome, 'chr20', 100, seed=3)
+        generate_vcf(second, self.genome, 'chr20', 100, seed=3)
+        assert_equal(first.getvalue(), second.getvalue())
+
+    def test_write_bcf(self):
+        """
+        Generated variants in BCF format are read the same as in VCF format.
+        """
+        vcf = StringIO.StringIO()
+        records = generate_vcf(vcf, self.genome, 'chr20', 200, samples=3,
+                               multiallelic_rate=0.2, indel_rate=0.3, seed=4)
+        vcf.seek(0)
+        bcf = StringIO.StringIO()
+        assert_equal(write_bcf(vcf, bcf), records)
+        vcf.seek(0)
+        bcf.seek(0)
+
+        # Records are numbered by line in VCF and by position in BCF.
+        expected = [o[1:] for o in tasks.read_observations(vcf)]
+        assert expected
+        assert_equal([o[1:] for o in
+                      tasks.read_observations(bcf, filetype='bcf')],
+                     expected)
+
+    def test_generate_bed(self):
+        """
+        Generated regions are sorted and on the reference genome.
+        """
+        bed = StringIO.StringIO()
+        generate_bed(bed, self.genome, 'chr20', 200, seed=2)
+        bed.seek(0)
+
+        regions = list(tasks.read_regions(bed))
+        assert_equal(len(regions), 200)
+        assert_equal(regions, sorted(regions, key=lambda r: r[2]))
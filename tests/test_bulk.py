@@ -0,0 +1,65 @@
+"""
+Test bulk loading.
+"""
+
+
+from nose.tools import *
+
+from varda import bulk
+
+
+def test_row_stream():
+    """
+    Serialize rows in the PostgreSQL COPY text format.
+    """
+    stream = bulk.RowStream([(1, 'chr20', 'AT', None),
+                             (2, 'a\tb', 'c\\d', 'e\nf')])
+    assert_equal(stream.read(),
+                 '1\tchr20\tAT\t\\N\n2\ta\\tb\tc\\\\d\te\\nf\n')
+    assert_equal(stream.count, 2)
+    assert_equal(stream.read(), '')
+
+
+def test_row_stream_chunked():
+    """
+    Read serialized rows in small chunks.
+    """
+    rows = [(i, 'chr%d' % i) for i in range(100)]
+    stream = bulk.RowStream(iter(rows))
+    chunks = []
+    while True:
+        chunk = stream.read(7)
+        if not chunk:
+            break
+        assert len(chunk) <= 7
+        chunks.append(chunk)
+    assert_equal(''.join(chunks),
+                 ''.join('%d\t%s\n' % row for row in rows))
+    assert_equal(stream.count, 100)
+
+
+def test_aggregating_writer():
+    """
+    Sum the support of identical observations in a batch.
+    """
+    class ListWriter(object):
+        def __init__(self):
+            self.rows = []
+        def write(self, rows):
+            rows = list(rows)
+            self.rows.extend(rows)
+            return len(rows)
+
+    writer = ListWriter()
+    aggregating = bulk.AggregatingWriter(writer, bulk.OBSERVATION_COLUMNS,
+                                         'support')
+    rows = [(1, 'chr20', 100, 'A', '', 585, 'heterozygous', 1),
+            (1, 'chr20', 100, 'A', '', 585, 'homozygous', 1),
+            (1, 'chr20', 100, 'A', '', 585, 'heterozygous', 2),
+            (1, 'chr20', 105, 'C', 'T', 585, 'heterozygous', 1)]
+    assert_equal(aggregating.write(iter(rows)), 3)
+    assert_equal(writer.rows,
+                 [(1, 'chr20', 100, 'A', '', 585, 'heterozygous', 3),
+                  (1, 'chr20', 100, 'A', '', 585, 'homozygous', 1),
+                  (1, 'chr20', 105, 'C', 'T', 585, 'heterozygous', 1)])
+    assert_equal(aggregating.aggregated, 1)
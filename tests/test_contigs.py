@@ -0,0 +1,65 @@
+"""
+Test resolving contig names.
+"""
+
+
+from nose.tools import *
+
+from varda.contigs import ContigResolver
+
+
+ALIASES = [['M', 'MT', 'NC_012920.1', 'chrM', 'chrMT']]
+
+
+def test_resolve_ucsc():
+    """
+    Resolve names to UCSC contig names.
+    """
+    resolver = ContigResolver()
+    resolver.init(ALIASES, ['chr1', 'chr20', 'chrM', 'chr1_gl000191_random',
+                            'chrUn_gl000211'])
+    assert_equal(resolver.resolve('chr20'), 'chr20')
+    assert_equal(resolver.resolve('20'), 'chr20')
+    assert_equal(resolver.resolve('MT'), 'chrM')
+    assert_equal(resolver.resolve('NC_012920.1'), 'chrM')
+    assert_equal(resolver.resolve('GL000191.1'), 'chr1_gl000191_random')
+    assert_equal(resolver.resolve('GL000211.1'), 'chrUn_gl000211')
+    assert_equal(resolver.resolve('2'), None)
+
+
+def test_resolve_grch37():
+    """
+    Resolve names to GRCh37 contig names.
+    """
+    resolver = ContigResolver()
+    resolver.init(ALIASES, ['1', '20', 'MT', 'GL000191.1'])
+    assert_equal(resolver.resolve('chr20'), '20')
+    assert_equal(resolver.resolve('chrM'), 'MT')
+    assert_equal(resolver.resolve('M'), 'MT')
+    assert_equal(resolver.resolve('chr1_gl000191_random'), 'GL000191.1')
+    assert_equal(resolver.resolve('chrUn_gl000192'), None)
+
+
+def test_resolve_without_genome():
+    """
+    Normalize names without reference genome.
+    """
+    resolver = ContigResolver()
+    resolver.init(ALIASES)
+    assert_equal(resolver.resolve('chr20'), '20')
+    assert_equal(resolver.resolve('20'), '20')
+    assert_equal(resolver.resolve('chrMT'), 'M')
+    assert_equal(resolver.resolve('GL000191.1'), 'GL000191.1')
+
+
+def test_resolve_cached():
+    """
+    Resolved names and misses are cached.
+    """
+    resolver = ContigResolver()
+    resolver.init(ALIASES, ['chr20'])
+    resolver.resolve('20')
+    resolver.resolve('unknown')
+    assert_equal(resolver._cache['20'], 'chr20')
+    assert 'unknown' in resolver._cache
+    assert_equal(resolver._cache['unknown'], None)
@@ -0,0 +1,129 @@
+"""
+Test reference genome access.
+"""
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+import numpy as np
+
+from varda.genome import Genome
+
+
+class GenomeTests(object):
+    """
+    Tests for a genome with or without uppercase copy.
+    """
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.directory, 'genome.fa')
+        with open(self.fasta, 'w') as handle:
+            handle.write('>chr1\nACGTacgtNN\nacgtA\n>chr2\nttttGGGG\n')
+        self.genome = Genome()
+        self.genome.init(self.fasta, **self.init_kwargs())
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def init_kwargs(self):
+        return {}
+
+    def test_lengths(self):
+        """
+        Contig lengths.
+        """
+        assert_equal(self.genome.lengths, {'chr1': 15, 'chr2': 8})
+
+    def test_contig_uppercase(self):
+        """
+        Contig sequences are uppercase.
+        """
+        contig = self.genome.contig('chr1')
+        assert_equal(len(contig), 15)
+        assert_equal(contig[:], 'ACGTACGTNNACGTA')
+        assert_equal(contig[4], 'A')
+        assert_equal(contig[-1], 'A')
+        assert_equal(contig[12:20], 'GTA')
+        assert_equal(contig[20:30], '')
+        assert_equal(self.genome.contig('chr2')[2:6], 'TTGG')
+        assert_raises(IndexError, lambda: contig[15])
+
+    def test_contig_array(self):
+        """
+        NumPy array of a contig sequence.
+        """
+        contig = self.genome.contig('chr2')
+        assert_equal(contig.array().tostring(), 'TTTTGGGG')
+        assert_equal(contig.array(3, 5).tostring(), 'TG')
+
+    def test_contig_take(self):
+        """
+        Bases at given positions of a contig sequence.
+        """
+        contig = self.genome.contig('chr1')
+        assert_equal(contig.take(np.array([0, 5, 8, 14])).tolist(),
+                     ['A', 'C', 'N', 'A'])
+
+    def test_init_again(self):
+        """
+        Initializing again with the same unchanged file does nothing.
+        """
+        prepared = self.genome.prepared
+        self.genome.init(self.fasta, **self.init_kwargs())
+        assert self.genome.prepared is prepared
+
+    def test_fork(self):
+        """
+        The genome can be used in a forked process.
+        """
+        pid = os.fork()
+        if not pid:
+            ok = False
+            try:
+                self.genome.init(self.fasta, **self.init_kwargs())
+                ok = self.genome.contig('chr2')[:] == 'TTTTGGGG'
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert_equal(status, 0)
+
+
+class TestGenome(GenomeTests):
+    def test_no_uppercase_copy(self):
+        """
+        No uppercase copy is created by default.
+        """
+        assert not self.genome.contig('chr1').upper
+        assert_equal([f for f in os.listdir(self.directory)
+                      if f.endswith('.upper')], [])
+
+
+class TestGenomeUppercaseCopy(GenomeTests):
+    def init_kwargs(self):
+        return {'uppercase_dir': self.directory}
+
+    def test_uppercase_copy_reused(self):
+        """
+        The uppercase copy is created once.
+        """
+        assert self.genome.contig('chr1').upper
+        upper = self.genome.prepared.filename + '.upper'
+        assert os.path.exists(upper)
+        mtime = os.stat(upper).st_mtime
+        genome = Genome()
+        genome.init(self.fasta, **self.init_kwargs())
+        assert_equal(os.stat(upper).st_mtime, mtime)
+        assert_equal(genome.contig('chr1')[:4], 'ACGT')
+
+    def test_uppercase_copy_unavailable(self):
+        """
+        If the uppercase copy cannot be created, no copy is used.
+        """
+        genome = Genome()
+        genome.init(self.fasta,
+                    uppercase_dir=os.path.join(self.directory, 'missing'))
+        assert not genome.contig('chr1').upper
+        assert_equal(genome.contig('chr1')[:4], 'ACGT')
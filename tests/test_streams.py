@@ -0,0 +1,189 @@
+"""
+Test streaming helpers.
+"""
+
+
+import gzip
+import StringIO
+
+from nose.tools import *
+
+from varda import streams, utils
+
+
+def _gzip(data):
+    compressed = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+        f.write(data)
+    return compressed.getvalue()
+
+
+def test_digest():
+    """
+    Calculate a digest incrementally.
+    """
+    data = 'a\tb\nc\td\n\ne\n'
+    digest = streams.Digest()
+    for i in range(0, len(data), 3):
+        digest.update(data[i:i + 3])
+    assert_equal((digest.checksum, digest.records),
+                 utils.digest(StringIO.StringIO(data)))
+
+
+def test_digest_gzipped():
+    """
+    Calculate a digest incrementally over gzipped data with several members.
+    """
+    data = 'a\tb\nc\td\n\ne\n'
+    compressed = _gzip(data[:5]) + _gzip(data[5:])
+    digest = streams.Digest(gzipped=True)
+    for i in range(0, len(compressed), 7):
+        digest.update(compressed[i:i + 7])
+    assert_equal((digest.checksum, digest.records),
+                 utils.digest(StringIO.StringIO(data)))
+
+
+def test_digest_detect_gzipped():
+    """
+    Calculate a digest incrementally, detecting gzip compression.
+    """
+    data = 'a\tb\nc\td\n\ne\n'
+    for fed in (data, _gzip(data)):
+        digest = streams.Digest(gzipped=None)
+        for i in range(len(fed)):
+            digest.update(fed[i])
+        assert_equal((digest.checksum, digest.records),
+                     utils.digest(StringIO.StringIO(data)))
+
+
+def test_gunzip_chunks():
+    """
+    Decompress chunks of gzipped data with several members.
+    """
+    data = 'a\tb\nc\td\n\ne\n'
+    compressed = _gzip(data[:5]) + _gzip(data[5:9]) + _gzip(data[9:])
+    chunks = [compressed[i:i + 7] for i in range(0, len(compressed), 7)]
+    assert_equal(''.join(streams.gunzip_chunks(chunks)), data)
+
+
+def test_digest_reader():
+    """
+    Calculate a digest while reading.
+    """
+    data = 'line 1\nline 2\nline 3\n'
+    reader = streams.DigestReader(StringIO.StringIO(data))
+    assert_equal(next(iter(reader)), 'line 1\n')
+    assert_equal(reader.digest(), utils.digest(StringIO.StringIO(data)))
+
+
+def test_prefetch_reader():
+    """
+    Read lines prefetched in a background thread.
+    """
+    data = ''.join('line %d\n' % i for i in range(1000)) + 'last'
+    reader = streams.PrefetchReader(StringIO.StringIO(data), blocks=2,
+                                    block_size=100)
+    assert_equal(list(reader), list(StringIO.StringIO(data)))
+
+    reader.seek(len('line 0\n'))
+    assert_equal(reader.readline(), 'line 1\n')
+    assert_equal(reader.read(3), 'lin')
+    assert_equal(reader.read(), data[len('line 0\nline 1\nlin'):])
+    reader.close()
+
+
+def test_prefetch_reader_gzipped():
+    """
+    Read gzipped lines decompressed in a background thread.
+    """
+    data = ''.join('line %d\n' % i for i in range(1000))
+    with streams.PrefetchReader(
+            gzip.GzipFile(fileobj=StringIO.StringIO(_gzip(data))),
+            block_size=1000) as reader:
+        assert_equal(next(iter(reader)), 'line 0\n')
+        assert_equal(streams.DigestReader(reader).digest(),
+                     utils.digest(StringIO.StringIO(data[7:])))
+
+
+@raises(IOError)
+def test_prefetch_reader_error():
+    """
+    Errors while prefetching are raised when reading.
+    """
+    reader = streams.PrefetchReader(
+        gzip.GzipFile(fileobj=StringIO.StringIO('not gzipped')))
+    list(reader)
+
+
+def _bgzip(data):
+    compressed = StringIO.StringIO()
+    compressed.close = lambda: None
+    with streams.BgzfWriter(compressed) as writer:
+        for i in range(0, len(data), 1000):
+            writer.write(data[i:i + 1000])
+    return compressed.getvalue()
+
+
+def test_bgzf_writer():
+    """
+    Data compressed in the BGZF format is valid gzip.
+    """
+    data = ''.join('line %d\n' % i for i in range(20000))
+    compressed = _bgzip(data)
+    assert streams.is_bgzf(StringIO.StringIO(compressed))
+    assert not streams.is_bgzf(StringIO.StringIO(_gzip(data)))
+    assert_equal(gzip.GzipFile(fileobj=StringIO.StringIO(compressed)).read(),
+                 data)
+
+
+def test_bgzf_reader():
+    """
+    Read BGZF data decompressed in parallel.
+    """
+    data = ''.join('line %d\n' % i for i in range(20000))
+    with streams.BgzfReader(StringIO.StringIO(_bgzip(data)),
+                            threads=3) as reader:
+        assert_equal(list(reader), list(StringIO.StringIO(data)))
+
+        reader.seek(100000)
+        assert_equal(reader.read(10), data[100000:100010])
+        assert_equal(reader.tell(), 100010)
+        assert_equal(reader.readline(), data[100010:].split('\n')[0] + '\n')
+
+        reader.seek(len(data) - 5)
+        assert_equal(reader.read(), data[-5:])
+        assert_equal(reader.read(), '')
+
+
+def test_bgzf_reader_shared_pool():
+    """
+    Readers in a process share their decompression threads.
+    """
+    data = _bgzip('line\n')
+    with streams.BgzfReader(StringIO.StringIO(data), threads=2) as first:
+        with streams.BgzfReader(StringIO.StringIO(data), threads=2) as second:
+            assert first._pool is second._pool
+            assert_equal(second.read(), 'line\n')
+        assert_equal(first.read(), 'line\n')
+
+
+def test_bgzf_reader_virtual_offsets():
+    """
+    Seek to BGZF virtual offsets.
+    """
+    data = ''.join('line %d\n' % i for i in range(20000))
+    with streams.BgzfReader(StringIO.StringIO(_bgzip(data))) as reader:
+        # Blocks are skipped without decompression.
+        reader.seek(150000)
+        virtual_offset = reader.virtual_offset(150000)
+        assert virtual_offset >> 16 > 0
+
+        reader.seek(0)
+        reader.seek_virtual(virtual_offset)
+        assert_equal(reader.read(10), data[150000:150010])
+
+    # Without reading the blocks before it first.
+    with streams.BgzfReader(StringIO.StringIO(_bgzip(data))) as reader:
+        reader.seek_virtual(virtual_offset)
+        assert_equal(reader.read(10), data[150000:150010])
+        assert_raises(IOError, reader.tell)
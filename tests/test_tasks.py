@@ -3,8 +3,12 @@ Test Celery tasks.
 """
 
 
+from contextlib import contextmanager
+import gzip
+import hashlib
 import os
 import StringIO
+import struct
 import tempfile
 
 import fixtures; fixtures.monkey_patch_fixture()
@@ -15,11 +19,13 @@ from nose.tools import *
 from sqlalchemy import create_engine
 import vcf
 
-from varda import create_app, db, models
-from varda.models import Annotation, Coverage, DataSource, Observation, Region, User, Variation
-from varda import tasks, utils
+from varda import celery, contigs, create_app, db, models
+from varda.models import Annotation, Coverage, DataSource, DataUnavailable, Observation, Region, User, Variation
+from varda import bcf_reader, bulk, tasks, utils
+from varda.region_binning import assign_bin
 
-from fixtures import AnnotationData, CoverageData, DataSourceData, VariationData
+from fixtures import (AnnotationData, CoverageData, DataSourceData, UserData,
+                      VariationData)
 
 
 TEST_SETTINGS = {
@@ -38,6 +44,39 @@ TEST_SETTINGS = {
 }
 
 
+class FailingWriter(object):
+    """
+    Writer failing after writing a number of batches.
+    """
+    def __init__(self, writer, batches):
+        self.writer = writer
+        self.batches = batches
+
+    def write(self, rows):
+        if not self.batches:
+            raise RuntimeError('Connection lost')
+        self.batches -= 1
+        return self.writer.write(rows)
+
+
+@contextmanager
+def failing_staging_writer(batches, buffer_size):
+    """
+    Let writing to staging tables fail after `batches` batches of
+    `buffer_size` rows.
+    """
+    staging_writer = bulk.StagingTable.writer
+    db_buffer_size = tasks.DB_BUFFER_SIZE
+    bulk.StagingTable.writer = lambda self: FailingWriter(staging_writer(self),
+                                                          batches)
+    tasks.DB_BUFFER_SIZE = buffer_size
+    try:
+        yield
+    finally:
+        bulk.StagingTable.writer = staging_writer
+        tasks.DB_BUFFER_SIZE = db_buffer_size
+
+
 class TestTasks(TestCase):
     """
     Test Celery tasks, by calling them in various ways.
@@ -91,6 +130,71 @@ class TestTasks(TestCase):
             assert coverage.task_done
             assert_equal(Region.query.filter_by(coverage=coverage).count(), 22)
 
+    def test_import_coverage_unsorted(self):
+        """
+        Import an unsorted coverage file with overlapping regions.
+        """
+        with self.fixture.data(CoverageData) as data:
+            coverage = Coverage.query.get(
+                data.CoverageData.exome_unsorted_coverage.id)
+            result = tasks.import_coverage.delay(coverage.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert_equal((result.result['regions'], result.result['merged']),
+                         (21, 4))
+            assert coverage.task_done
+            regions = Region.query.filter_by(coverage=coverage).order_by(
+                Region.begin)
+            assert_equal(regions.count(), 21)
+            assert_equal([(r.begin, r.end) for r in regions[:2]],
+                         [(68113, 69000), (76582, 77500)])
+            assert_equal((regions[-1].begin, regions[-1].end),
+                         (187548, 187975))
+
+    def test_import_coverage_bedgraph(self):
+        """
+        Import a depth track in bedGraph format as coverage.
+        """
+        with self.fixture.data(CoverageData) as data:
+            coverage = Coverage.query.get(
+                data.CoverageData.exome_depth_coverage.id)
+            result = tasks.import_coverage.delay(coverage.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert_equal((result.result['regions'], result.result['merged']),
+                         (6, 6))
+            assert coverage.task_done
+            regions = Region.query.filter_by(coverage=coverage).order_by(
+                Region.begin)
+            assert_equal([(r.begin, r.end) for r in regions],
+                         [(68113, 68581), (76582, 77360), (90026, 90350),
+                          (123068, 123512), (125992, 126403),
+                          (131407, 131694)])
+
+    def test_import_coverage_resume(self):
+        """
+        Resume a failed import of a coverage file with overlapping regions
+        from its checkpoint.
+        """
+        with self.fixture.data(CoverageData) as data:
+            coverage = Coverage.query.get(
+                data.CoverageData.exome_overlapping_coverage.id)
+            with failing_staging_writer(batches=1, buffer_size=2):
+                with assert_raises(RuntimeError):
+                    tasks.import_coverage.delay(coverage.id)
+            db.session.rollback()
+            assert not coverage.task_done
+            # The first two regions are merged from four records.
+            assert_equal(coverage.checkpoint_record, 4)
+            assert_equal(bulk.region_staging(coverage.id).count(), 2)
+
+            result = tasks.import_coverage.delay(coverage.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert coverage.task_done
+            regions = sorted((r.begin, r.end) for r in coverage.regions)
+            with coverage.data_source.data() as data:
+                assert_equal(regions,
+                             [r[2:] for r in tasks.MergedRegions(
+                                 tasks.read_regions(data))])
+
     def test_import_nonexisting_coverage(self):
         """
         Import a coverage file for nonexisting coverage resource.
@@ -140,9 +244,294 @@ class TestTasks(TestCase):
                 data.VariationData.exome_variation.id)
             result = tasks.import_variation.delay(variation.id)
             assert_equal(result.state, 'SUCCESS')
+            assert_equal((result.result['observations'],
+                          result.result['aggregated']), (16, 0))
             assert variation.task_done
             assert_equal(Observation.query.filter_by(variation=variation).count(), 16)
 
+    def test_import_variation_timing(self):
+        """
+        Import a variation file and report timing per stage.
+        """
+        celery.conf['TASK_TIMING'] = True
+        try:
+            with self.fixture.data(VariationData) as data:
+                variation = Variation.query.get(
+                    data.VariationData.exome_variation.id)
+                result = tasks.import_variation.delay(variation.id)
+                assert_equal(result.state, 'SUCCESS')
+                timing = result.result['timing']
+                assert_equal(timing['rows'], 16)
+                for stage in ('decompress', 'parse', 'normalize', 'bin',
+                              'write'):
+                    assert stage in timing['stages']
+                    assert timing['stages'][stage]['wall'] >= 0
+                assert timing['wall'] >= sum(
+                    s['wall'] for s in timing['stages'].values()) - 0.01
+        finally:
+            celery.conf['TASK_TIMING'] = False
+
+    def test_import_variation_no_timing(self):
+        """
+        Import a variation file without timing.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert 'timing' not in result.result
+
+    def test_import_variation_digest(self):
+        """
+        Import a variation file and calculate its digest.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            assert_equal(variation.data_source.checksum, None)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            with variation.data_source.data() as data:
+                assert_equal((variation.data_source.checksum,
+                              variation.data_source.records),
+                             utils.digest(data))
+
+    def test_staging_table_is_empty(self):
+        """
+        Check if a staging table has rows.
+        """
+        staging = bulk.region_staging(27)
+        staging.create()
+        try:
+            assert staging.is_empty()
+            staging.writer().write([(27, '20', 100, 200, 585)])
+            assert not staging.is_empty()
+            staging.truncate()
+            assert staging.is_empty()
+        finally:
+            staging.discard()
+            db.session.commit()
+
+    def test_import_variation_resume(self):
+        """
+        Resume a failed import of a variation file from its checkpoint.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            with failing_staging_writer(batches=2, buffer_size=4):
+                with assert_raises(RuntimeError):
+                    tasks.import_variation.delay(variation.id)
+            db.session.rollback()
+            assert not variation.task_done
+            assert_equal(variation.checkpoint_record, 31)
+            assert_equal(bulk.observation_staging(variation.id).count(), 8)
+            assert_equal(variation.observations.count(), 0)
+
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert variation.task_done
+            assert_equal(variation.checkpoint_record, None)
+            assert not bulk.observation_staging(variation.id).exists()
+
+            observations = sorted((o.position, o.reference, o.observed,
+                                   o.zygosity, o.support)
+                                  for o in variation.observations)
+            with variation.data_source.data() as data:
+                assert_equal(observations,
+                             sorted(o[2:] for o in
+                                    tasks.read_observations(data)))
+
+    def test_record_lines_offset(self):
+        """
+        Read lines from a file starting at a given offset.
+        """
+        data = '#header\nline 2\nline 3\nline 4\n'
+        lines = tasks.RecordLines(StringIO.StringIO(data), first_record=3,
+                                  first_offset=15)
+        assert_equal(list(lines), ['#header\n', 'line 3\n', 'line 4\n'])
+        assert_equal(lines.line_number, 4)
+        assert_equal(lines.offset, len(data))
+
+    def test_import_variation_bins(self):
+        """
+        Import a variation file and check the bin index of the observations.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            for observation in variation.observations:
+                assert_equal(observation.bin,
+                             assign_bin(observation.position,
+                                        observation.position +
+                                        max(1, len(observation.reference)) - 1))
+
+    def test_publish_sorted(self):
+        """
+        Publish observations sorted by location.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            staging = bulk.observation_staging(variation.id)
+            staging.create()
+            staging.writer().write(
+                (variation.id, 'chr20', position, 'A', 'T',
+                 assign_bin(position, position), 'heterozygous', 1)
+                for position in (300, 100, 200))
+            assert_equal(staging.publish(order_by=('chromosome', 'position')),
+                         3)
+            db.session.commit()
+
+            assert_equal([o.position for o in
+                          variation.observations.order_by(Observation.id)],
+                         [100, 200, 300])
+            variation.observations.delete()
+            db.session.commit()
+
+    def test_import_variation_sharded(self):
+        """
+        Import a variation file in shards.
+        """
+        celery.conf['IMPORT_SHARDING'] = 'records'
+        celery.conf['IMPORT_SHARD_RECORDS'] = 10
+        try:
+            with self.fixture.data(VariationData) as data:
+                variation = Variation.query.get(
+                    data.VariationData.exome_variation.id)
+                result = tasks.import_variation.delay(variation.id)
+                assert_equal(result.state, 'SUCCESS')
+                assert_equal(len(result.result['shards']), 2)
+                assert variation.task_done
+                assert_equal(Observation.query.filter_by(variation=variation).count(), 16)
+                with open('tests/data/exome.vcf') as vcf_file:
+                    offsets = [0]
+                    for line in vcf_file:
+                        offsets.append(offsets[-1] + len(line))
+                assert_equal(tasks.variation_shards(variation.data_source,
+                                                    'records'),
+                             [(24, 33, offsets[23]), (34, 39, offsets[33])])
+        finally:
+            celery.conf['IMPORT_SHARDING'] = None
+            celery.conf['IMPORT_SHARD_RECORDS'] = 1000000
+
+    def test_finish_variation_import_restarted(self):
+        """
+        Finish a variation import in shards after it was restarted.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation.id)
+            variation.task_uuid = 'restarted'
+            db.session.commit()
+            tasks.finish_variation_import.delay([(16, 0)], variation.id,
+                                                'original')
+            assert not variation.task_done
+            assert_equal(variation.task_uuid, 'restarted')
+
+    def test_variation_shards_chromosome(self):
+        """
+        Split a variation file in shards by chromosome.
+        """
+        with self.fixture.data(DataSourceData) as data:
+            data_source = DataSource.query.get(
+                data.DataSourceData.exome_variation.id)
+            with open('tests/data/exome.vcf') as vcf_file:
+                header = len(''.join(vcf_file.readlines()[:23]))
+            assert_equal(tasks.variation_shards(data_source, 'chromosome'),
+                         [(24, 39, header)])
+
+    def test_data_source_index(self):
+        """
+        Read regions from an indexed data source.
+        """
+        with open('tests/data/gonl-summary.vcf') as vcf_file:
+            lines = vcf_file.readlines()
+        records = [line for line in lines if not line.startswith('#')]
+        header = lines[:len(lines) - len(records)]
+        lines = header + records + ['21' + r[2:] for r in records]
+
+        data_source = DataSource(None, 'Indexed', 'vcf',
+                                 upload=StringIO.StringIO(''.join(lines)))
+        index = data_source.index()
+        assert_equal([c[0] for c in index.chromosomes], ['20', '21'])
+        first = len(header) + 1
+        shards = [(first, first + len(records) - 1,
+                   len(''.join(header))),
+                  (first + len(records), len(lines),
+                   len(''.join(header + records)))]
+        assert_equal(tasks.variation_shards(data_source, 'chromosome'),
+                     shards)
+        assert_equal(index.record_offset(shards[1][0]), shards[1][2])
+
+        positions = [int(r.split('\t')[1]) for r in records]
+        for chromosome, begin, end in [
+                ('20', positions[0], positions[0]),
+                ('chr20', positions[100], positions[800]),
+                ('21', positions[-1] - 100000, positions[-1]),
+                ('21', positions[-1] + 1, positions[-1] + 100000),
+                ('22', 1, 100000)]:
+            expected = [line for line in lines
+                        if line.startswith('#') or
+                        (line.split('\t')[0] == chromosome.lstrip('chr')
+                         and begin <= int(line.split('\t')[1]) <= end)]
+            with data_source.data(region=(chromosome, begin, end)) as region:
+                assert_equal(list(region), expected)
+
+    def test_data_source_index_invalid(self):
+        """
+        Do not index a data source with a malformed record.
+        """
+        with open('tests/data/gonl-summary.vcf') as vcf_file:
+            lines = vcf_file.readlines()
+        records = [i for i, line in enumerate(lines)
+                   if not line.startswith('#')]
+        fields = lines[records[10]].split('\t')
+        fields[1] = 'abc'
+        lines[records[10]] = '\t'.join(fields)
+
+        data_source = DataSource(None, 'Malformed', 'vcf',
+                                 upload=StringIO.StringIO(''.join(lines)))
+        assert_equal(data_source.index(), None)
+        assert_equal(tasks.variation_shards(data_source, 'chromosome'),
+                     [(records[0] + 1, records[-1] + 1,
+                       len(''.join(lines[:records[0]])))])
+        with assert_raises(DataUnavailable) as cm:
+            data_source.data(region=('20', 1, 100000))
+        assert_equal(cm.exception.code, 'data_source_not_indexed')
+
+    def test_data_source_index_bed(self):
+        """
+        Index a BED data source with fields separated by spaces.
+        """
+        lines = ['track name=test\n', 'chr20 100 200\n', 'chr20  300\t400\n',
+                 'chr21 100 200 name\n']
+        data_source = DataSource(None, 'Spaces', 'bed',
+                                 upload=StringIO.StringIO(''.join(lines)))
+        index = data_source.index()
+        assert_equal([c[:3] for c in index.chromosomes],
+                     [('chr20', 2, 3), ('chr21', 4, 4)])
+        with data_source.data(region=('chr20', 250, 350)) as region:
+            assert_equal(list(region), lines[:1] + lines[2:3])
+
+    def test_data_source_index_alias(self):
+        """
+        Read a region from an indexed data source by a chromosome alias.
+        """
+        # The test reference genome has no mitochondrial genome. Contig names
+        # are reset by creating the app for the next test.
+        contigs.init(self.app.config['CHROMOSOME_ALIASES'], ['chr20', 'chrM'])
+        lines = ['chr20 100 200\n', 'MT 100 200\n', 'MT 300 400\n']
+        data_source = DataSource(None, 'Aliases', 'bed',
+                                 upload=StringIO.StringIO(''.join(lines)))
+        with data_source.data(region=('chrM', 250, 350)) as region:
+            assert_equal(list(region), lines[2:])
+        with data_source.data(region=('20', 1, 1000)) as region:
+            assert_equal(list(region), lines[:1])
+
     def test_import_nonexisting_variation(self):
         """
         Import a variation file for nonexisting variation resource.
@@ -230,6 +619,62 @@ class TestTasks(TestCase):
                               ([1], [1.0]),
                               ([1], [1.0])])
 
+    def test_write_annotation_region(self):
+        """
+        Annotate the variants in a region.
+        """
+        with open('tests/data/gonl-summary.vcf') as vcf_file:
+            lines = vcf_file.readlines()
+        records = [line for line in lines if not line.startswith('#')]
+        positions = [int(r.split('\t')[1]) for r in records]
+        region = ('20', positions[100], positions[110])
+
+        with self.fixture.data(UserData) as data:
+            user = User.query.get(data.UserData.test_user.id)
+            original = DataSource(user, 'Indexed', 'vcf',
+                                  upload=StringIO.StringIO(''.join(lines)))
+            annotated = DataSource(user, 'Annotated', 'vcf', empty=True,
+                                   gzipped=True)
+            annotation = Annotation(original, annotated, group_query=[],
+                                    region=region)
+            db.session.add(annotation)
+            db.session.commit()
+            try:
+                result = tasks.write_annotation.delay(annotation.id)
+                assert_equal(result.state, 'SUCCESS')
+                assert_equal(annotation.region, region)
+
+                with annotated.data() as data:
+                    assert_equal([record.POS for record in vcf.Reader(data)],
+                                 positions[100:111])
+            finally:
+                db.session.delete(annotation)
+                db.session.delete(annotated)
+                db.session.delete(original)
+                db.session.commit()
+
+    def test_write_annotation_region_not_indexed(self):
+        """
+        Annotate the variants in a region of a data source without index.
+        """
+        with self.fixture.data(DataSourceData) as data:
+            original = DataSource.query.get(
+                data.DataSourceData.exome_variation.id)
+            annotated = DataSource(original.user, 'Annotated', 'vcf',
+                                   empty=True, gzipped=True)
+            annotation = Annotation(original, annotated, group_query=[],
+                                    region=('chr20', 1, 100000))
+            db.session.add(annotation)
+            db.session.commit()
+            try:
+                with assert_raises(tasks.TaskError) as cm:
+                    tasks.write_annotation.delay(annotation.id)
+                assert_equal(cm.exception.code, 'data_source_not_indexed')
+            finally:
+                db.session.delete(annotation)
+                db.session.delete(annotated)
+                db.session.commit()
+
     def test_write_nonexisting_annotation(self):
         """
         Write an annotation file for nonexisting annotation resource.
@@ -302,6 +747,33 @@ class TestTasks(TestCase):
                                      (187548, 187853),
                                      (187859, 187975)])])
 
+    def test_merged_regions(self):
+        """
+        Merge overlapping and adjacent regions.
+        """
+        regions = [(0, 'chr1', 10, 20), (1, 'chr1', 15, 25),
+                   (2, 'chr1', 26, 30), (3, 'chr1', 40, 50),
+                   (4, 'chr2', 5, 10), (5, 'chr2', 8, 9)]
+        merged = tasks.MergedRegions(iter(regions))
+        assert_equal(list(merged), [(2, 'chr1', 10, 30), (3, 'chr1', 40, 50),
+                                    (5, 'chr2', 5, 10)])
+        assert_equal(merged.merged, 3)
+
+        with assert_raises(tasks.UnsortedData):
+            list(tasks.MergedRegions(iter(regions[::-1])))
+
+    def test_sort_regions(self):
+        """
+        Sort regions using temporary files.
+        """
+        regions = [(0, 'chr2', 5, 10), (1, 'chr1', 40, 50),
+                   (2, 'chr1', 10, 20), (3, 'chr2', 1, 3),
+                   (4, 'chr1', 15, 25)]
+        assert_equal(list(tasks.sort_regions(iter(regions), buffer_size=2)),
+                     [(2, 'chr1', 10, 20), (4, 'chr1', 15, 25),
+                      (1, 'chr1', 40, 50), (3, 'chr2', 1, 3),
+                      (0, 'chr2', 5, 10)])
+
     def test_read_observations(self):
         """
         Read a file with observations.
@@ -331,6 +803,32 @@ class TestTasks(TestCase):
                                      (168728, 'T', 'A', 'homozygous', 1),
                                      (168781, 'G', 'T', 'heterozygous', 1)])])
 
+    def test_read_observations_batch(self):
+        """
+        Read observations from many records, normalizing them in batches with
+        vectorized reference checks.
+        """
+        vectorized = []
+        check_single_bases = utils._check_single_bases
+
+        def spy(contig, variants):
+            matches = check_single_bases(contig, variants)
+            vectorized.append(len(variants) >= utils.VECTORIZE_MIN_VARIANTS
+                              and any(matches))
+            return matches
+
+        utils._check_single_bases = spy
+        try:
+            with open('tests/data/gonl-summary.vcf') as vcf_file:
+                observations = list(tasks.read_observations(vcf_file))
+        finally:
+            utils._check_single_bases = check_single_bases
+
+        assert any(vectorized)
+        assert observations
+        assert all(utils.normalize_variant(*o[1:5]) == o[1:5]
+                   for o in observations)
+
     def test_read_observations_likelihoods(self):
         """
         Read a file with observations and prefer genotype likelihoods.
@@ -472,6 +970,191 @@ class TestTasks(TestCase):
                           (40, 'chr20', 168728, 'T', 'A', 'homozygous', 1),
                           (41, 'chr20', 168781, 'G', 'T', 'heterozygous', 1)])
 
+    def test_read_observations_readers(self):
+        """
+        Read files with observations with the fast and PyVCF parsers.
+        """
+        options = [{},
+                   {'skip_filtered': False},
+                   {'use_genotypes': False},
+                   {'prefer_genotype_likelihoods': True}]
+        vcf_reader = celery.conf['VCF_READER']
+
+        try:
+            for filename in ('1kg.vcf', 'exome.vcf', 'exome-filtered.vcf',
+                             'exome-subset.vcf', 'gonl.vcf',
+                             'gonl-summary.vcf'):
+                path = os.path.join(os.path.dirname(__file__), 'data',
+                                    filename)
+                for kwargs in options:
+                    observations = {}
+                    for reader in ('fast', 'pyvcf'):
+                        celery.conf['VCF_READER'] = reader
+                        with open(path) as data:
+                            observations[reader] = list(
+                                tasks.read_observations(data, **kwargs))
+                    assert_equal(observations['fast'],
+                                 observations['pyvcf'])
+        finally:
+            celery.conf['VCF_READER'] = vcf_reader
+
+    def test_read_observations_malformed(self):
+        """
+        Read VCF data with a malformed record.
+        """
+        with open('tests/data/exome.vcf') as vcf_file:
+            lines = vcf_file.readlines()
+        fields = lines[30].split('\t')
+        fields[1] = 'abc'
+        lines[30] = '\t'.join(fields)
+
+        vcf_reader = celery.conf['VCF_READER']
+        try:
+            for reader in ('fast', 'pyvcf'):
+                celery.conf['VCF_READER'] = reader
+                with assert_raises(tasks.ReadError):
+                    list(tasks.read_observations(
+                        StringIO.StringIO(''.join(lines))))
+        finally:
+            celery.conf['VCF_READER'] = vcf_reader
+
+    def test_read_observations_bcf(self):
+        """
+        Read files with observations in BCF format.
+        """
+        options = [{},
+                   {'skip_filtered': False},
+                   {'use_genotypes': False},
+                   {'prefer_genotype_likelihoods': True}]
+
+        for filename in ('1kg', 'exome', 'exome-filtered', 'exome-subset',
+                         'gonl', 'gonl-summary'):
+            path = os.path.join(os.path.dirname(__file__), 'data', filename)
+            for kwargs in options:
+                with open(path + '.vcf') as data:
+                    expected = [o[1:] for o in
+                                tasks.read_observations(data, **kwargs)]
+                with open(path + '.bcf', 'rb') as data:
+                    observations = list(tasks.read_observations(
+                        data, filetype='bcf', **kwargs))
+                assert_equal([o[1:] for o in observations], expected)
+
+    def test_read_observations_bcf_invalid(self):
+        """
+        Read invalid BCF data.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'data', 'exome.vcf')
+        with open(path) as data:
+            with assert_raises(tasks.ReadError):
+                list(tasks.read_observations(data, filetype='bcf'))
+
+    def test_read_observations_bcf_malformed(self):
+        """
+        Read BCF data with a malformed INFO column.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'data', 'exome.bcf')
+        with gzip.open(path) as data:
+            bcf = bytearray(data.read())
+        header, = struct.unpack_from('<I', bcf, 5)
+        # Set the number of INFO fields of the first record beyond what is
+        # in the record.
+        n_allele_info = 5 + 4 + header + 8 + 16
+        bcf[n_allele_info:n_allele_info + 2] = '\xff\xff'
+        with assert_raises(tasks.ReadError):
+            list(tasks.read_observations(StringIO.StringIO(str(bcf)),
+                                         filetype='bcf'))
+
+    def test_read_observations_bcf_unknown_contig(self):
+        """
+        Read BCF data with a record on a contig not in the header.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'data', 'exome.bcf')
+        with gzip.open(path) as data:
+            bcf = bytearray(data.read())
+        header, = struct.unpack_from('<I', bcf, 5)
+        # Set the contig index of the first record beyond the contigs in the
+        # header.
+        chromosome = 5 + 4 + header + 8
+        bcf[chromosome:chromosome + 4] = struct.pack('<i', 0xffff)
+        with assert_raises(tasks.ReadError) as cm:
+            list(tasks.read_observations(StringIO.StringIO(str(bcf)),
+                                         filetype='bcf'))
+        assert_equal(str(cm.exception), 'Unknown contig 65535 in BCF record')
+
+    def test_import_variation_bcf(self):
+        """
+        Import a variation file in BCF format.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation_bcf.id)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert variation.task_done
+            assert_equal(Observation.query.filter_by(variation=variation).count(), 16)
+
+    def test_import_variation_bcf_digest(self):
+        """
+        Import a variation file in BCF format and calculate its digest.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'data', 'exome.bcf')
+        with gzip.open(path) as data:
+            checksum = hashlib.sha1(data.read()).hexdigest()
+        with open(path, 'rb') as data:
+            records = sum(1 for _ in bcf_reader.Reader(data))
+
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation_bcf.id)
+            assert_equal(variation.data_source.checksum, None)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert_equal((variation.data_source.checksum,
+                          variation.data_source.records), (checksum, records))
+
+    def test_read_gvcf(self):
+        """
+        Read observations and merged regions from a gVCF file.
+        """
+        with open('tests/data/exome.g.vcf') as gvcf:
+            items = list(tasks.read_gvcf(gvcf, min_gq=20, min_dp=10))
+
+        observations = [item for kind, item in items if kind == 'observation']
+        assert_equal([o[1:5] for o in observations],
+                     [('chr20', 76962, 'T', 'C'),
+                      ('chr20', 126156, 'CAAA', ''),
+                      ('chr20', 126311, 'CC', ''),
+                      ('chr20', 131495, 'T', 'C')])
+        assert_equal(observations[-1][5:], ('homozygous', 1))
+
+        regions = [item[1:] for kind, item in items if kind == 'region']
+        assert_equal(regions, [('chr20', 76000, 100000),
+                               ('chr20', 100501, 126163),
+                               ('chr20', 126313, 131495)])
+
+    def test_import_variation_gvcf(self):
+        """
+        Import a variation file in gVCF format, including coverage.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_variation_gvcf.id)
+            result = tasks.import_variation.delay(variation.id)
+            assert_equal(result.state, 'SUCCESS')
+            assert variation.task_done
+            assert_equal(variation.observations.count(), 4)
+
+            coverage = variation.data_source.coverages.one()
+            assert coverage.task_done
+            assert_equal(coverage.sample, variation.sample)
+            assert_equal(coverage.regions.count(), 3)
+
+            # The coverage is not known to the fixture, so we remove it
+            # ourselves.
+            coverage.regions.delete()
+            db.session.delete(coverage)
+            db.session.commit()
+
     def test_annotate_variants(self):
         """
         Annotate a file with observation frequencies.
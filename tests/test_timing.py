@@ -0,0 +1,88 @@
+"""
+Test timing of task stages.
+"""
+
+
+from __future__ import division
+
+import time
+
+from nose.tools import *
+
+from varda import timing
+
+
+def teardown():
+    timing.stop()
+
+
+def test_inactive():
+    """
+    Without an active timer, functions and iterables are not wrapped.
+    """
+    timing.stop()
+    function = lambda x: x
+    assert timing.timed('parse', function) is function
+    assert_equal(list(timing.timed_iter('parse', [1, 2, 3])), [1, 2, 3])
+    with timing.stage('write'):
+        pass
+    assert_equal(timing.current(), None)
+
+
+class FakeClock(object):
+    """
+    Clock that only advances when told to, with CPU time at half the rate of
+    wall time.
+    """
+    def __init__(self):
+        self.wall = 100.0
+
+    def __call__(self):
+        return self.wall, self.wall / 2
+
+    def sleep(self, seconds):
+        self.wall += seconds
+
+
+def test_nested_stages():
+    """
+    Time is attributed to the innermost stage only.
+    """
+    clock = FakeClock()
+    timer = timing.start(clock=clock)
+
+    def parse(items):
+        for item in items:
+            clock.sleep(1)
+            yield item
+
+    @timing.timed_stage('normalize')
+    def normalize(item):
+        clock.sleep(2)
+        return item
+
+    with timing.stage('write'):
+        for item in timing.timed_iter('parse', parse(range(5)), count=True):
+            normalize(item)
+            clock.sleep(0.5)
+
+    clock.sleep(3)
+    meta = timer.meta()
+    assert_equal(meta['stages'], {'parse': {'wall': 5, 'cpu': 2.5},
+                                  'normalize': {'wall': 10, 'cpu': 5},
+                                  'write': {'wall': 2.5, 'cpu': 1.25}})
+    assert_equal(meta['wall'], 20.5)
+    assert_equal(meta['rows'], 5)
+    assert_equal(meta['rows_per_second'], round(5 / 20.5, 1))
+
+
+def test_real_clock():
+    """
+    Time is measured with the real clock by default.
+    """
+    timer = timing.start()
+    with timing.stage('write'):
+        time.sleep(0.01)
+    meta = timer.meta()
+    assert meta['stages']['write']['wall'] >= 0.01
+    assert meta['wall'] >= meta['stages']['write']['wall']
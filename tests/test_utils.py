@@ -0,0 +1,188 @@
+"""
+Test utilities.
+"""
+
+
+import random
+import StringIO
+
+from nose.tools import *
+
+from varda import create_app, genome, utils, vcf_reader
+
+
+VCF_HEADER = ('##fileformat=VCFv4.1\n'
+              '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+              '##FORMAT=<ID=PL,Number=G,Type=Integer,Description="PL">\n'
+              '##FORMAT=<ID=GL,Number=G,Type=Float,Description="GL">\n'
+              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'
+              'A\tB\tC\tD\n')
+
+
+def _record(line):
+    return next(iter(vcf_reader.Reader(StringIO.StringIO(VCF_HEADER + line))))
+
+
+def _count_per_call(record, prefer_likelihoods=False):
+    alt_support = [{} for _ in record.ALT]
+    for call in record.samples:
+        genotype = utils.read_genotype(call, prefer_likelihoods)
+        if genotype:
+            zygosity = ('heterozygous' if len(set(genotype)) > 1
+                        else 'homozygous')
+            for index in set(genotype):
+                if index > 0:
+                    support = alt_support[index - 1]
+                    support[zygosity] = support.get(zygosity, 0) + 1
+    return alt_support
+
+
+def _move_left_stepwise(context, position, sequence):
+    # Original implementation of move_left, moving one base at a time.
+    def lookup(p):
+        if position <= p < position + len(sequence):
+            return sequence[p - position].upper()
+        return context[p - 1].upper()
+
+    move = 0
+    while (position - move > 1 and
+           lookup(position - move - 1) ==
+           lookup(position + len(sequence) - move - 1)):
+        move += 1
+
+    if not move:
+        return position, sequence
+
+    return (position - move,
+            context[position - move - 1
+                    :min(position, position - move + len(sequence)) - 1]
+            + sequence[:-move])
+
+
+def test_count_genotypes():
+    """
+    Count genotypes from GT.
+    """
+    record = _record('1\t100\t.\tA\tC,G\t.\t.\t.\tGT\t'
+                     '0/1\t1|1\t1/2\t./.\n')
+    assert_equal(utils.count_genotypes(record),
+                 [{'heterozygous': 2, 'homozygous': 1},
+                  {'heterozygous': 1}])
+    assert_equal(utils.count_genotypes(record), _count_per_call(record))
+
+
+def test_count_genotypes_likelihoods():
+    """
+    Count genotypes derived from PL and GL.
+    """
+    record = _record('1\t100\t.\tA\tC\t.\t.\t.\tGT:PL\t'
+                     '0/0:10,0,50\t0/1:0,10,50\t./.:50,10,0\t1/1:0,0,0\n')
+    assert_equal(utils.count_genotypes(record, prefer_likelihoods=True),
+                 [{'heterozygous': 1, 'homozygous': 1}])
+    assert_equal(utils.count_genotypes(record, prefer_likelihoods=True),
+                 _count_per_call(record, prefer_likelihoods=True))
+
+    record = _record('1\t100\t.\tA\tC\t.\t.\t.\tGL\t'
+                     '-1,-0.1,-5\t-0.1,-1,-5\t-5,-1,-0.1\t-2,-1,-2\n')
+    assert_equal(utils.count_genotypes(record),
+                 [{'heterozygous': 2, 'homozygous': 1}])
+    assert_equal(utils.count_genotypes(record), _count_per_call(record))
+
+
+def test_count_genotypes_irregular():
+    """
+    Irregular records are not counted.
+    """
+    record = _record('X\t100\t.\tA\tC\t.\t.\t.\tGT\t0/1\t1\t1\t0\n')
+    assert_equal(utils.count_genotypes(record), None)
+
+    record = _record('1\t100\t.\tA\tC\t.\t.\t.\tGT\t0/.\t1/1\t0/1\t0/0\n')
+    assert_equal(utils.count_genotypes(record), None)
+
+
+@raises(utils.NoGenotypesInRecord)
+def test_count_genotypes_no_genotypes():
+    """
+    Count genotypes in a record without genotypes.
+    """
+    record = _record('1\t100\t.\tA\tC\t.\t.\t.\tDP\t3\t4\t5\t6\n')
+    utils.count_genotypes(record)
+
+
+def test_move_left():
+    """
+    Move sequences to the left in a context.
+    """
+    assert_equal(utils.move_left('abbaabbaabba', 5, 'abba'), (1, 'abba'))
+    assert_equal(utils.move_left('abbaabbaabba', 6, 'bbaa'), (1, 'abba'))
+    assert_equal(utils.move_left('abbaabbaabba', 6, 'bba'), (5, 'abb'))
+    assert_equal(utils.move_left('GA' + 'CA' * 300, 603, 'CA'), (2, 'AC'))
+    assert_equal(utils.move_left('G' + 'a' * 500, 501, 'AA'), (2, 'aa'))
+
+
+def test_move_left_random():
+    """
+    Moving sequences to the left in blocks gives the same result as moving
+    them one base at a time.
+    """
+    rng = random.Random(0)
+    for _ in range(2000):
+        # Build context from short repeat units to get long moves.
+        units = [''.join(rng.choice('ACGTacgt')
+                         for _ in range(rng.randint(1, 4)))
+                 for _ in range(3)]
+        context = ''.join(rng.choice(units) * rng.randint(1, 80)
+                          for _ in range(rng.randint(1, 6)))
+        position = rng.randint(1, len(context))
+        if rng.random() < 0.5:
+            # Deletion of context.
+            sequence = context[position - 1
+                               :position - 1 + rng.randint(0, 12)]
+        else:
+            # Insertion, often of a repeat unit seen in the context.
+            sequence = rng.choice(
+                [rng.choice(units) * rng.randint(1, 3),
+                 ''.join(rng.choice('ACGTacgt')
+                         for _ in range(rng.randint(0, 12)))])
+        block_size = rng.choice([1, 2, 3, 7, 64])
+        assert_equal(utils.move_left(context, position, sequence,
+                                     block_size=block_size),
+                     _move_left_stepwise(context, position, sequence))
+
+
+def test_normalize_variants():
+    """
+    Normalizing variants in batch gives the same result as normalizing them
+    one by one.
+    """
+    create_app({'GENOME': 'tests/data/hg19.fa'})
+    sequence = genome.contig('chr20')
+    rng = random.Random(0)
+
+    variants = []
+    for _ in range(1000):
+        position = rng.randint(60000, 70000)
+        reference = sequence[position - 1:position - 1 + rng.choice(
+            [1, 1, 1, 2, 5])]
+        if rng.random() < 0.1:
+            reference = rng.choice('ACGT')
+        observed = ''.join(rng.choice('ACGT')
+                           for _ in range(rng.choice([1, 1, 1, 2, 4])))
+        if rng.random() < 0.2:
+            observed = reference + observed
+        variants.append((rng.choice(['chr20', '20', 'chr20', 'chr21']),
+                         position, reference.lower() if rng.random() < 0.1
+                         else reference, observed))
+    variants.append(('chr20', 70000000, 'A', 'T'))
+
+    def normalize(variant):
+        try:
+            return utils.normalize_variant(*variant), None
+        except utils.ReferenceMismatch as e:
+            return None, str(e)
+
+    results = [(v, e and str(e))
+               for v, e in utils.normalize_variants(variants)]
+    assert_equal(results, [normalize(variant) for variant in variants])
+    assert any(e is None for _, e in results)
+    assert any(e is not None for _, e in results)
@@ -12,6 +12,7 @@ from flask import Flask
 from flask.ext.sqlalchemy import SQLAlchemy
 
 
+from .contigs import ContigResolver
 from .genome import Genome
 
 
@@ -40,6 +41,7 @@ __homepage__ = 'http://martijn.vermaat.name'
 db = SQLAlchemy()
 celery = Celery('varda')
 genome = Genome()
+contigs = ContigResolver()
 
 
 class ReverseProxied(object):
@@ -100,7 +102,11 @@ def create_app(settings=None):
     db.init_app(app)
     celery.conf.add_defaults(app.config)
     if app.config['GENOME'] is not None:
-        genome.init(app.config['GENOME'])
+        genome.init(app.config['GENOME'],
+                    uppercase_dir=app.config['GENOME_UPPERCASE_DIR'])
+        contigs.init(app.config['CHROMOSOME_ALIASES'], genome.keys())
+    else:
+        contigs.init(app.config['CHROMOSOME_ALIASES'])
     from .api import api
     app.register_blueprint(api, url_prefix=app.config['API_URL_PREFIX'])
     if app.config['AULE_LOCAL_PATH'] is not None:
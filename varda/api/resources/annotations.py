@@ -14,6 +14,7 @@ from flask import abort, current_app, g, jsonify, url_for
 from ... import db
 from ...models import Annotation, DataSource, InvalidDataSource, Sample
 from ... import tasks
+from ..errors import ValidationError
 from ..security import has_role, is_user, owns_annotation, owns_data_source
 from .base import TaskedResource
 from .data_sources import DataSourcesResource
@@ -77,7 +78,17 @@ class AnnotationsResource(TaskedResource):
                                                         {'schema': {'type': 'string'},
                                                          'type': 'list'}},
                                               'type': 'dict'},
-                                   'type': 'list'}}
+                                   'type': 'list'},
+                  'region': {'type': 'dict',
+                             'schema': {'chromosome': {'type': 'string',
+                                                       'maxlength': 30,
+                                                       'required': True},
+                                        'begin': {'type': 'integer',
+                                                  'min': 1,
+                                                  'required': True},
+                                        'end': {'type': 'integer',
+                                                'min': 1,
+                                                'required': True}}}}
 
     delete_ensure_conditions = [has_role('admin'), owns_annotation]
     delete_ensure_options = {'satisfy': any}
@@ -133,7 +144,7 @@ class AnnotationsResource(TaskedResource):
 
     @classmethod
     def add_view(cls, data_source, name=None, global_frequency=True,
-                 sample_frequency=None, group_query=None):
+                 sample_frequency=None, group_query=None, region=None):
         """
         Adds an annotation resource.
 
@@ -155,6 +166,11 @@ class AnnotationsResource(TaskedResource):
         - **global_frequency** (`boolean`)
         - **sample_frequency** (`list` of `uri`)
         - **group_query** (`list` of `dict` of queries on groups)
+        - **region** (`object`) -- Only annotate records overlapping this
+          region, given by the fields **chromosome** (`string`), **begin**
+          (`integer`) and **end** (`integer`), one-based and inclusive. This
+          requires the data source to be indexed (only sorted VCF and BED
+          data stored in the BGZF format).
         """
         # Todo: Check if data source is a VCF file.
         # The `satisfy` keyword argument used here in the `ensure` decorator means
@@ -165,6 +181,9 @@ class AnnotationsResource(TaskedResource):
         sample_frequency = sample_frequency or []
         name = name or '%s (annotated)' % data_source.name
 
+        if region and region['begin'] > region['end']:
+            raise ValidationError('Region begin must not be after its end')
+
         for sample in sample_frequency:
             if not (sample.public or
                     sample.user is g.user or
@@ -207,7 +226,9 @@ class AnnotationsResource(TaskedResource):
         annotation = Annotation(data_source, annotated_data_source,
                                 global_frequency=global_frequency,
                                 sample_frequency=sample_frequency,
-                                group_query=queries)
+                                group_query=queries,
+                                region=(region['chromosome'], region['begin'],
+                                        region['end']) if region else None)
         db.session.add(annotation)
         db.session.commit()
         current_app.logger.info('Added data source: %r', annotated_data_source)
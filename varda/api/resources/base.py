@@ -312,10 +312,13 @@ class TaskedResource(ModelResource):
         serialization = super(TaskedResource, cls).serialize(instance, embed=embed)
         task = {'done': instance.task_done}
         if instance.task_uuid:
-            result = cls.task.AsyncResult(instance.task_uuid)
+            result = tasks.task_result(cls.task, instance.task_uuid)
             task.update(state=result.state.lower())
             if result.state == 'PROGRESS':
                 task.update(progress=result.info.get('percentage'))
+            if (result.state in ('PROGRESS', 'SUCCESS') and
+                isinstance(result.info, dict) and 'timing' in result.info):
+                task.update(timing=result.info['timing'])
             if result.state == 'FAILURE':
                 if isinstance(result.result, tasks.TaskError):
                     error = {'code': result.result.code,
@@ -344,7 +347,7 @@ class TaskedResource(ModelResource):
             #     using redis [1].
             # [1] http://ask.github.com/celery/cookbook/tasks.html#ensuring-a-task-is-only-executed-one-at-a-time
             if instance.task_uuid:
-                result = cls.task.AsyncResult(instance.task_uuid)
+                result = tasks.task_result(cls.task, instance.task_uuid)
                 if result.state in ('STARTED', 'PROGRESS'):
                     raise IntegrityError('Cannot start task because a linked '
                                          'task is running')
@@ -360,7 +363,7 @@ class TaskedResource(ModelResource):
     def delete_view(cls, *args, **kwargs):
         instance = kwargs.get(cls.instance_name)
         if instance.task_uuid:
-            result = cls.task.AsyncResult(instance.task_uuid)
+            result = tasks.task_result(cls.task, instance.task_uuid)
             if result.state in ('STARTED', 'PROGRESS'):
                 raise IntegrityError('Cannot delete resource because a linked '
                                      'task is running')
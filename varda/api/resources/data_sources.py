@@ -7,8 +7,10 @@ REST API data sources model resource.
 """
 
 
-from flask import current_app, g, request, send_from_directory, url_for
+from flask import (current_app, g, jsonify, request, send_from_directory,
+                   url_for)
 
+from ... import db
 from ...models import DataSource, DATA_SOURCE_FILETYPES
 from ..security import has_role, is_user, owns_data_source, require_user
 from .base import ModelResource
@@ -27,7 +29,7 @@ class DataSourcesResource(ModelResource):
     instance_name = 'data_source'
     instance_type = 'data_source'
 
-    views = ['list', 'get', 'add', 'edit', 'delete', 'data']
+    views = ['list', 'get', 'add', 'edit', 'delete', 'data', 'upload']
 
     embeddable = {'user': UsersResource}
     filterable = {'user': 'user'}
@@ -44,7 +46,8 @@ class DataSourcesResource(ModelResource):
                   'filetype': {'type': 'string', 'allowed': DATA_SOURCE_FILETYPES,
                                'required': True},
                   'gzipped': {'type': 'boolean'},
-                  'local_file': {'type': 'string', 'maxlength': 200}}
+                  'local_file': {'type': 'string', 'maxlength': 200},
+                  'chunked': {'type': 'boolean'}}
 
     edit_ensure_conditions = [has_role('admin'), owns_data_source]
     edit_ensure_options = {'satisfy': any}
@@ -55,10 +58,19 @@ class DataSourcesResource(ModelResource):
     data_ensure_options = {'satisfy': any}
     data_schema = {'data_source': {'type': 'data_source', 'id': True}}
 
+    upload_rule = '/<int:data_source>/upload'
+    upload_ensure_conditions = [has_role('admin'), owns_data_source]
+    upload_ensure_options = {'satisfy': any}
+    upload_schema = {'data_source': {'type': 'data_source', 'id': True},
+                     'offset': {'type': 'integer', 'required': True},
+                     'done': {'type': 'boolean'}}
+
     def register_views(self):
         super(DataSourcesResource, self).register_views()
         if 'data' in self.views:
             self.register_view('data')
+        if 'upload' in self.views:
+            self.register_view('upload', methods=['POST'])
 
     @classmethod
     def serialize(cls, instance, embed=None):
@@ -78,8 +90,8 @@ class DataSourcesResource(ModelResource):
           Human readable sample name.
 
         **filetype** (`string`)
-          Data filetype. Possible values for this field are `bed`, `vcf`, and
-          `csv`.
+          Data filetype. Possible values for this field are `bed`, `vcf`,
+          `csv`, `bcf`, `gvcf`, and `bedgraph`.
 
         **data** (`object`)
           :ref:`Link <api-links>` to a :ref:`blob
@@ -88,6 +100,10 @@ class DataSourcesResource(ModelResource):
         **user** (`object`)
           :ref:`Link <api-links>` to a :ref:`user
           <api-resources-users-instances>` resource (embeddable).
+
+        **upload** (`object`)
+          Only present while a chunked upload is in progress. Object with
+          field **offset** (`integer`), the number of bytes received so far.
         """
         serialization = super(DataSourcesResource, cls).serialize(instance, embed=embed)
         serialization.update(data={'uri': url_for('.data_source_data',
@@ -96,6 +112,9 @@ class DataSourcesResource(ModelResource):
                              filetype=instance.filetype,
                              gzipped=instance.gzipped,
                              added=str(instance.added.isoformat()))
+        offset = instance.upload_offset()
+        if offset is not None:
+            serialization.update(upload={'offset': offset})
         return serialization
 
     @classmethod
@@ -143,6 +162,11 @@ class DataSourcesResource(ModelResource):
         - **gzipped** (`boolean`)
         - **local_file** (`string`)
         - **data** (`file`)
+        - **chunked** (`boolean`)
+
+        If **chunked** is `True`, no data is included in the request and it
+        should be uploaded in chunks using the :ref:`upload
+        <api-resources-data-sources-uploads>` subresource.
         """
         # Todo: If files['data'] is missing (or non-existent file?), we crash with
         #     a data_source_not_cached error.
@@ -180,3 +204,35 @@ class DataSourcesResource(ModelResource):
         return send_from_directory(current_app.config['DATA_DIR'],
                                    data_source.filename,
                                    mimetype='application/x-gzip')
+
+    @classmethod
+    def upload_view(cls, data_source, offset, done=False):
+        """
+        Uploads a chunk of data for a data source created with the
+        **chunked** option. Returns the data source representation in the
+        `data_source` field.
+
+        Chunks must be uploaded in order. An interrupted upload can be resumed
+        by getting the data source and continuing from the offset in its
+        **upload** field.
+
+        .. note:: Requires having the `admin` role or being the owner of the
+           data source.
+
+        **Required request data:**
+
+        - **offset** (`integer`) -- Position of the chunk in the data, must
+          be equal to the number of bytes received so far.
+
+        **Accepted request data:**
+
+        - **data** (`file`) -- Chunk of data.
+        - **done** (`boolean`) -- If `True`, this is the last chunk and the
+          data source is ready to be used.
+        """
+        data_source.upload_chunk(request.files.get('data'), offset,
+                                 done=done)
+        db.session.commit()
+        current_app.logger.info('Uploaded chunk for data_source: %r',
+                                data_source)
+        return jsonify(data_source=cls.serialize(data_source))
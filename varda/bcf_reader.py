@@ -0,0 +1,592 @@
+"""
+Streaming reader for variants in the BCF2 format.
+
+BCF is the binary counterpart of VCF. Values are stored as typed binary
+vectors, so reading a record requires no text splitting or number parsing
+at all. Records and calls mimic the interface of
+:mod:`varda.vcf_reader`, so they can be used by
+:func:`varda.tasks.read_observations` in the same way.
+
+Sample values are additionally available as NumPy arrays through
+:meth:`Record.sample_array`, which is used by
+:func:`varda.utils.count_genotypes`.
+
+See the `VCF specification
+<http://samtools.github.io/hts-specs/VCFv4.2.pdf>`_ for a description of the
+BCF2 format.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import functools
+import itertools
+import re
+import struct
+
+import numpy as np
+
+from .streams import gunzip_chunks, read_chunks
+
+
+#: First bytes of a BCF2 file (the minor version number follows).
+BCF_MAGIC = 'BCF\x02'
+
+#: Value for missing integers in arrays returned by
+#: :meth:`Record.sample_array`.
+MISSING = -0x80000000
+
+#: Value for integers beyond the end of the vector in arrays returned by
+#: :meth:`Record.sample_array`.
+END_OF_VECTOR = -0x7fffffff
+
+# Typed value types.
+TYPE_MISSING, TYPE_INT8, TYPE_INT16, TYPE_INT32, TYPE_FLOAT, TYPE_CHAR = \
+    0, 1, 2, 3, 5, 7
+
+# Per type: struct format, size, missing value, end of vector value (for
+# floats these are bit patterns).
+_TYPES = {TYPE_INT8: ('b', 1, -0x80, -0x7f),
+          TYPE_INT16: ('h', 2, -0x8000, -0x7fff),
+          TYPE_INT32: ('i', 4, -0x80000000, -0x7fffffff),
+          TYPE_FLOAT: ('f', 4, 0x7f800001, 0x7f800002),
+          TYPE_CHAR: ('s', 1, None, None)}
+
+_DTYPES = {TYPE_INT8: np.dtype('<i1'),
+           TYPE_INT16: np.dtype('<i2'),
+           TYPE_INT32: np.dtype('<i4'),
+           TYPE_FLOAT: np.dtype('<f4')}
+
+_SHARED = struct.Struct('<iiifII')
+
+
+class InvalidBCF(ValueError):
+    """
+    Exception thrown if data is not valid BCF.
+    """
+    pass
+
+
+def _decoding(method):
+    """
+    Decorator for methods decoding record data, raising :exc:`InvalidBCF` if
+    the data is malformed.
+
+    Record data is decoded lazily, so this can happen long after the record
+    was read.
+    """
+    @functools.wraps(method)
+    def decode(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except (IndexError, KeyError, TypeError, struct.error) as e:
+            raise InvalidBCF('Invalid BCF record: %s' % e)
+    return decode
+
+
+def _read_typed(data, offset):
+    """
+    Read the type descriptor of a typed value.
+
+    :return: Tuple of type, number of values, and offset of the values.
+    """
+    descriptor = ord(data[offset])
+    type_, count = descriptor & 0xf, descriptor >> 4
+    offset += 1
+    if count == 15:
+        count_type, _, offset = _read_typed(data, offset)
+        count, offset = _read_values(data, offset, count_type, 1)
+        count = count[0]
+    return type_, count, offset
+
+
+def _read_values(data, offset, type_, count):
+    """
+    Read `count` values of type `type_`.
+
+    :return: Tuple of the values (a string for characters, otherwise a list
+        with `None` for missing values and without values beyond the end of
+        the vector) and the offset after the values.
+    """
+    if type_ == TYPE_MISSING or not count:
+        return [], offset
+    try:
+        format, size, missing, end_of_vector = _TYPES[type_]
+    except KeyError:
+        raise InvalidBCF('Unknown type %d in BCF record' % type_)
+    end = offset + size * count
+
+    if type_ == TYPE_CHAR:
+        return data[offset:end].rstrip('\0'), end
+
+    if type_ == TYPE_FLOAT:
+        values = []
+        for bits, value in zip(
+                struct.unpack_from('<%dI' % count, data, offset),
+                struct.unpack_from('<%df' % count, data, offset)):
+            if bits == end_of_vector:
+                break
+            values.append(None if bits == missing else value)
+        return values, end
+
+    values = []
+    for value in struct.unpack_from('<%d%s' % (count, format), data, offset):
+        if value == end_of_vector:
+            break
+        values.append(None if value == missing else value)
+    return values, end
+
+
+def _read_typed_values(data, offset):
+    type_, count, offset = _read_typed(data, offset)
+    return _read_values(data, offset, type_, count)
+
+
+class Definition(object):
+    """
+    Definition of an INFO or FORMAT field in the header.
+    """
+    __slots__ = ('type', 'num')
+
+    def __init__(self, type_, num):
+        self.type = type_
+        self.num = num
+
+
+def _parse_value(values, definition, flag=False):
+    """
+    Convert decoded values the same way :mod:`varda.vcf_reader` parses them.
+    """
+    if definition is None:
+        entry_type, entry_num = 'Flag' if flag else 'String', None
+    else:
+        entry_type, entry_num = definition.type, definition.num
+    if flag and (entry_type == 'Flag' or not values):
+        return True
+    if isinstance(values, str):
+        values = [value if value != '.' else None
+                  for value in values.split(',')]
+    if entry_num == 1:
+        return values[0] if values else None
+    return values
+
+
+class Info(object):
+    """
+    Values in the INFO column of a record, decoded on first access.
+    """
+    __slots__ = ('_record', '_entries')
+
+    def __init__(self, record):
+        self._record = record
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._record._read_info()
+        return self._entries
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+
+class CallData(object):
+    """
+    Values of the fields of a sample call.
+    """
+    __slots__ = ('_call',)
+
+    def __init__(self, call):
+        self._call = call
+
+    @_decoding
+    def __getattr__(self, key):
+        record = self._call.site
+        try:
+            type_, count, offset = record.format_fields[key]
+        except KeyError:
+            raise AttributeError(key)
+        values, _ = _read_values(
+            record._indiv, offset + self._call.index * count *
+            _TYPES[type_][1], type_, count)
+
+        if key == 'GT':
+            return _format_genotype(values)
+        if type_ == TYPE_CHAR:
+            values = values.split(',')
+        if not values or all(value in (None, '.') for value in values):
+            return None
+        if len(values) == 1:
+            return values[0]
+        definition = record._reader.formats.get(key)
+        if definition is not None and definition.num == 1:
+            return values[0]
+        return values
+
+
+def _format_genotype(values):
+    """
+    Format binary GT values as in VCF.
+    """
+    if not values or all(value is None for value in values):
+        return None
+    alleles = []
+    for index, value in enumerate(values):
+        value = value or 0
+        if index:
+            alleles.append('|' if value & 1 else '/')
+        alleles.append(str((value >> 1) - 1) if value >> 1 else '.')
+    return ''.join(alleles)
+
+
+class Call(object):
+    """
+    A genotype call for one sample in a record.
+    """
+    __slots__ = ('site', 'sample', 'index', '_data')
+
+    def __init__(self, site, sample, index):
+        self.site = site
+        self.sample = sample
+        self.index = index
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = CallData(self)
+        return self._data
+
+    @property
+    def gt_nums(self):
+        if 'GT' not in self.site.format_fields:
+            return None
+        return self.data.GT
+
+    @property
+    def called(self):
+        if 'GT' not in self.site.format_fields:
+            return None
+        return self.data.GT is not None
+
+    @property
+    def gt_alleles(self):
+        gt = self.gt_nums
+        if gt is None:
+            raise AttributeError('gt_alleles')
+        return gt.split('|' if '|' in gt else '/')
+
+
+class Record(object):
+    """
+    A record in a BCF file.
+    """
+    __slots__ = ('CHROM', 'POS', 'REF', 'ALT', 'FILTER', 'INFO',
+                 '_reader', '_shared', '_info_offset', '_n_info', '_indiv',
+                 '_n_format', '_n_sample', '_format_fields', '_format_keys',
+                 '_samples')
+
+    @_decoding
+    def __init__(self, reader, shared, indiv):
+        self._reader = reader
+        self._shared = shared
+        self._indiv = indiv
+
+        (chromosome, position, _, _, n_allele_info,
+         n_format_sample) = _SHARED.unpack_from(shared)
+        if not 0 <= chromosome < len(reader.contigs) or \
+                reader.contigs[chromosome] is None:
+            raise InvalidBCF('Unknown contig %d in BCF record' % chromosome)
+        self.CHROM = reader.contigs[chromosome]
+        self.POS = position + 1
+        self._n_info = n_allele_info & 0xffff
+        self._n_format = n_format_sample >> 24
+        self._n_sample = n_format_sample & 0xffffff
+
+        # Identifier.
+        _, offset = _read_typed_values(shared, _SHARED.size)
+
+        alleles = []
+        for _ in range(n_allele_info >> 16):
+            allele, offset = _read_typed_values(shared, offset)
+            alleles.append(allele)
+        self.REF = alleles[0] if alleles else '.'
+        self.ALT = alleles[1:] or [None]
+
+        filters, offset = _read_typed_values(shared, offset)
+        if not filters:
+            self.FILTER = None
+        elif filters == [0]:
+            self.FILTER = []
+        else:
+            self.FILTER = [reader.strings[f] for f in filters]
+
+        self._info_offset = offset
+        self.INFO = Info(self)
+        self._format_fields = None
+        self._samples = None
+
+    @_decoding
+    def _read_info(self):
+        entries = {}
+        offset = self._info_offset
+        for _ in range(self._n_info):
+            key, offset = _read_typed_values(self._shared, offset)
+            type_, count, offset = _read_typed(self._shared, offset)
+            values, offset = _read_values(self._shared, offset, type_, count)
+            key = self._reader.strings[key[0]]
+            entries[key] = _parse_value(values, self._reader.infos.get(key),
+                                        flag=True)
+        return entries
+
+    @property
+    @_decoding
+    def format_fields(self):
+        """
+        Dictionary with for each FORMAT field a tuple of the type, number of
+        values per sample, and the offset of the values in the individual
+        data.
+        """
+        if self._format_fields is None:
+            self._format_fields = {}
+            self._format_keys = []
+            offset = 0
+            for _ in range(self._n_format):
+                key, offset = _read_typed_values(self._indiv, offset)
+                type_, count, offset = _read_typed(self._indiv, offset)
+                key = self._reader.strings[key[0]]
+                self._format_fields[key] = type_, count, offset
+                self._format_keys.append(key)
+                offset += self._n_sample * count * _TYPES[type_][1]
+        return self._format_fields
+
+    @property
+    def format_keys(self):
+        """
+        Names of the FORMAT fields, in order.
+        """
+        self.format_fields
+        return self._format_keys
+
+    @property
+    def FORMAT(self):
+        if not self._n_format:
+            return None
+        return ':'.join(self.format_keys)
+
+    @property
+    def samples(self):
+        """
+        List of :class:`Call` objects, one for each sample.
+        """
+        if self._samples is None:
+            if not self._n_format:
+                self._samples = []
+            else:
+                self._samples = [Call(self, sample, index) for index, sample
+                                 in enumerate(self._reader.samples)]
+        return self._samples
+
+    @_decoding
+    def sample_array(self, key):
+        """
+        Values of a numeric FORMAT field for all samples as an array.
+
+        Integer values are returned as ``int32``, with :data:`MISSING` for
+        missing values and :data:`END_OF_VECTOR` for values beyond the end
+        of shorter vectors. Floating point values are returned as
+        ``float64``, with ``nan`` for both.
+
+        :arg key: FORMAT field, must be present in :attr:`FORMAT`.
+        :type key: str
+
+        :return: Array with a row for each sample.
+        :rtype: numpy.ndarray
+        """
+        type_, count, offset = self.format_fields[key]
+        if type_ not in _DTYPES:
+            raise ValueError('FORMAT field %s is not numeric' % key)
+        if offset + self._n_sample * count * _TYPES[type_][1] > \
+                len(self._indiv):
+            raise InvalidBCF('Truncated FORMAT field %s in BCF record' % key)
+        values = np.frombuffer(self._indiv, dtype=_DTYPES[type_],
+                               count=self._n_sample * count,
+                               offset=offset).reshape(self._n_sample, count)
+
+        if type_ == TYPE_FLOAT:
+            bits = values.view(np.uint32)
+            values = values.astype(np.float64)
+            values[(bits == _TYPES[type_][2]) |
+                   (bits == _TYPES[type_][3])] = np.nan
+            return values
+
+        _, _, missing, end_of_vector = _TYPES[type_]
+        result = values.astype(np.int32)
+        result[values == missing] = MISSING
+        result[values == end_of_vector] = END_OF_VECTOR
+        return result
+
+
+class RecordCounter(object):
+    """
+    Incremental counter of the records in decompressed BCF data, without
+    decoding them.
+
+    Can be used as `counter` for :class:`varda.streams.Digest`.
+    """
+    def __init__(self):
+        #: Number of records counted so far.
+        self.records = 0
+        self._header = True
+        self._skip = 0
+        self._buffer = ''
+
+    def update(self, chunk):
+        """
+        Count the records in the next chunk of data.
+        """
+        data = self._buffer + chunk if self._buffer else chunk
+        offset = 0
+        while True:
+            skipped = min(self._skip, len(data) - offset)
+            offset += skipped
+            self._skip -= skipped
+            if self._skip:
+                break
+            # The header starts with the magic and the length of the header
+            # text, a record with the lengths of its shared and individual
+            # data.
+            size = 9 if self._header else 8
+            if len(data) - offset < size:
+                break
+            if self._header:
+                if data[offset:offset + 4] != BCF_MAGIC:
+                    raise InvalidBCF('Data is not in BCF2 format')
+                self._skip, = struct.unpack_from('<I', data, offset + 5)
+                self._header = False
+            else:
+                shared_length, indiv_length = struct.unpack_from(
+                    '<II', data, offset)
+                self._skip = shared_length + indiv_length
+                self.records += 1
+            offset += size
+        self._buffer = data[offset:]
+
+
+class Reader(object):
+    """
+    Reader for BCF files, an iterator returning :class:`Record` objects.
+    """
+    def __init__(self, data):
+        """
+        :arg data: Open handle to a BCF file, either decompressed or
+            BGZF-compressed.
+        :type data: file-like object
+        """
+        self.data = data
+        self._chunks = read_chunks(data)
+        self._buffer = ''
+        self._offset = 0
+
+        #: Number of records read so far.
+        self.record_number = 0
+
+        if self._read(2) == '\x1f\x8b':
+            self._chunks = gunzip_chunks(
+                itertools.chain([self._buffer], self._chunks))
+            self._buffer = ''
+
+        magic = self._read(5)
+        if magic[:4] != BCF_MAGIC:
+            raise InvalidBCF('Data is not in BCF2 format')
+        self._offset += 5
+        length, = struct.unpack('<I', self._read(4))
+        self._offset += 4
+        header = self._read(length)
+        if len(header) < length:
+            raise InvalidBCF('Truncated BCF header')
+        self._offset += length
+        self._parse_header(header.rstrip('\0'))
+
+    def _read(self, size):
+        # Make sure the buffer has at least `size` bytes after the current
+        # offset (unless at the end of the data) and return them.
+        while len(self._buffer) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer = self._buffer[self._offset:] + chunk
+            self._offset = 0
+        return self._buffer[self._offset:self._offset + size]
+
+    def _parse_header(self, header):
+        # The dictionary of strings has PASS first, followed by the FILTER,
+        # INFO, and FORMAT identifiers in order of appearance, unless an
+        # explicit IDX is given.
+        strings = {0: 'PASS'}
+        contigs = {}
+        self.infos = {}
+        self.formats = {}
+        self.samples = []
+
+        for line in header.split('\n'):
+            if line.startswith('#CHROM'):
+                self.samples = line.split('\t')[9:]
+                continue
+            match = re.match(r'##(FILTER|INFO|FORMAT|contig)=<.*?ID=([^,>]+)',
+                             line)
+            if not match:
+                continue
+            field, identifier = match.groups()
+            index = re.search(r'[<,]IDX=(\d+)', line)
+
+            if field == 'contig':
+                contigs[int(index.group(1)) if index else len(contigs)] = \
+                    identifier
+                continue
+
+            if index:
+                strings[int(index.group(1))] = identifier
+            elif identifier not in strings.values():
+                strings[max(strings) + 1] = identifier
+
+            if field in ('INFO', 'FORMAT'):
+                number = re.search(r'[<,]Number=([^,>]+)', line)
+                type_ = re.search(r'[<,]Type=([^,>]+)', line)
+                number = number.group(1) if number else None
+                definition = Definition(
+                    type_.group(1) if type_ else 'String',
+                    int(number) if number and number.isdigit() else None)
+                if field == 'INFO':
+                    self.infos[identifier] = definition
+                else:
+                    self.formats[identifier] = definition
+
+        self.strings = [strings.get(i) for i in range(max(strings) + 1)]
+        self.contigs = [contigs.get(i) for i in
+                        range(max(contigs) + 1 if contigs else 0)]
+
+    def __iter__(self):
+        while True:
+            lengths = self._read(8)
+            if not lengths:
+                break
+            if len(lengths) < 8:
+                raise InvalidBCF('Truncated BCF record')
+            shared_length, indiv_length = struct.unpack('<II', lengths)
+            self._offset += 8
+            data = self._read(shared_length + indiv_length)
+            if len(data) < shared_length + indiv_length:
+                raise InvalidBCF('Truncated BCF record')
+            self._offset += shared_length + indiv_length
+            self.record_number += 1
+            yield Record(self, data[:shared_length], data[shared_length:])
@@ -0,0 +1,459 @@
+"""
+Bulk loading of observations and regions into the database.
+
+Importing a data source through the ORM means constructing and tracking a
+model instance for every row, which is slow and makes memory usage grow with
+the size of the import. The writers in this module bypass the ORM and insert
+plain tuples directly on the underlying tables.
+
+On PostgreSQL (using psycopg2), rows are streamed into the table with
+``COPY ... FROM STDIN``, which is much faster than even batched ``INSERT``
+statements. On other database systems we fall back to ``executemany``.
+
+Imports are first loaded into a staging table (see :class:`StagingTable`)
+and published at once when complete, so queries never see partially
+imported data.
+
+.. note:: All genomic positions in this module are one-based and inclusive.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from collections import OrderedDict
+
+import sqlalchemy
+
+from . import db, timing
+from .models import Observation, Region
+from .region_binning import assign_bin
+
+
+#: Columns (in order) of the rows produced by :func:`observation_rows`.
+OBSERVATION_COLUMNS = ('variation_id', 'chromosome', 'position', 'reference',
+                       'observed', 'bin', 'zygosity', 'support')
+
+#: Columns (in order) of the rows produced by :func:`region_rows`.
+REGION_COLUMNS = ('coverage_id', 'chromosome', 'begin', 'end', 'bin')
+
+
+def observation_rows(variation_id, observations):
+    """
+    Convert observations to rows for the observation table.
+
+    :arg variation_id: Variation the observations belong to.
+    :type variation_id: int
+    :arg observations: Observations as yielded by
+        :func:`varda.tasks.read_observations`.
+    :type observations: iterator(tuple)
+
+    :return: Generator yielding tuples `(record, row)` where `row` has the
+        values for :data:`OBSERVATION_COLUMNS`.
+    """
+    bin_for = timing.timed('bin', assign_bin)
+    for (record, chromosome, position, reference, observed, zygosity,
+         support) in observations:
+        # We choose the 'region' of the reference covered by an insertion to
+        # be the base next to it (same as the Observation model does).
+        bin = bin_for(position, position + max(1, len(reference)) - 1)
+        yield record, (variation_id, chromosome, position, reference,
+                       observed, bin, zygosity, support)
+
+
+def region_rows(coverage_id, regions):
+    """
+    Convert regions to rows for the region table.
+
+    :arg coverage_id: Coverage the regions belong to.
+    :type coverage_id: int
+    :arg regions: Regions as yielded by :func:`varda.tasks.read_regions`.
+    :type regions: iterator(tuple)
+
+    :return: Generator yielding tuples `(record, row)` where `row` has the
+        values for :data:`REGION_COLUMNS`.
+    """
+    bin_for = timing.timed('bin', assign_bin)
+    for record, chromosome, begin, end in regions:
+        yield record, (coverage_id, chromosome, begin, end,
+                       bin_for(begin, end))
+
+
+def gvcf_rows(variation_id, coverage_id, items):
+    """
+    Convert observations and regions to rows for their tables.
+
+    :arg variation_id: Variation the observations belong to.
+    :type variation_id: int
+    :arg coverage_id: Coverage the regions belong to. If `None`, regions are
+        discarded.
+    :type coverage_id: int
+    :arg items: Observations and regions as yielded by
+        :func:`varda.tasks.read_gvcf`.
+    :type items: iterator(tuple)
+
+    :return: Generator yielding tuples `(record, (kind, row))` where `kind`
+        is ``observation`` or ``region`` and `row` has the values for
+        :data:`OBSERVATION_COLUMNS` or :data:`REGION_COLUMNS`, respectively.
+    """
+    for kind, item in items:
+        if kind == 'observation':
+            rows = observation_rows(variation_id, [item])
+        elif coverage_id is not None:
+            rows = region_rows(coverage_id, [item])
+        else:
+            continue
+        for record, row in rows:
+            yield record, (kind, row)
+
+
+class BulkWriter(object):
+    """
+    Write rows to a table with one ``executemany`` call per batch.
+
+    Rows are written in the current transaction of the session, so it is up
+    to the caller to commit.
+    """
+    def __init__(self, table, columns):
+        """
+        :arg table: Table to write to.
+        :type table: sqlalchemy.schema.Table
+        :arg columns: Names of the columns, in the order of the row values.
+        :type columns: tuple(str)
+        """
+        self.table = table
+        self.columns = columns
+        self.statement = table.insert()
+
+    def write(self, rows):
+        """
+        Write a batch of rows.
+
+        :arg rows: Rows to write, values ordered as in :attr:`columns`.
+        :type rows: iterable(tuple)
+
+        :return: Number of rows written.
+        :rtype: int
+        """
+        parameters = [dict(zip(self.columns, row)) for row in rows]
+        if parameters:
+            db.session.execute(self.statement, parameters)
+        return len(parameters)
+
+
+class RowStream(object):
+    """
+    Read-only file-like object serializing rows in the PostgreSQL ``COPY``
+    text format.
+
+    Rows are consumed lazily from the underlying iterator as data is read,
+    so they are never all materialized in memory.
+    """
+    def __init__(self, rows):
+        """
+        :arg rows: Rows to serialize.
+        :type rows: iterator(tuple)
+        """
+        self.rows = iter(rows)
+        self.count = 0
+        self._buffer = ''
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+    def readline(self, size=-1):
+        if not self._buffer:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                return ''
+            self.count += 1
+            self._buffer = '\t'.join(self.format_value(v) for v in row) + '\n'
+        if size < 0 or size >= len(self._buffer):
+            line, self._buffer = self._buffer, ''
+        else:
+            line, self._buffer = self._buffer[:size], self._buffer[size:]
+        return line
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            chunk = self.readline(size - length if size >= 0 else -1)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        return ''.join(chunks)
+
+
+class CopyWriter(BulkWriter):
+    """
+    Write rows to a table with one PostgreSQL ``COPY ... FROM STDIN`` per
+    batch.
+
+    Requires the psycopg2 driver. Rows are written in the current transaction
+    of the session, so it is up to the caller to commit.
+    """
+    def __init__(self, table, columns):
+        super(CopyWriter, self).__init__(table, columns)
+        preparer = db.engine.dialect.identifier_preparer
+        self.statement = 'COPY %s (%s) FROM STDIN' % (
+            preparer.format_table(table),
+            ', '.join(preparer.quote(column) for column in columns))
+
+    def write(self, rows):
+        stream = RowStream(rows)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(self.statement, stream)
+        finally:
+            cursor.close()
+        return stream.count
+
+
+class AggregatingWriter(object):
+    """
+    Sum a column over rows that are equal in all other columns before
+    writing them.
+
+    Rows are aggregated per batch, so a batch is held in memory. Since
+    batches end on record boundaries (see :func:`varda.tasks.write_rows`),
+    this aggregates rows read from neighbouring records, which is where
+    duplicates usually are.
+    """
+    def __init__(self, writer, columns, column):
+        """
+        :arg writer: Writer to write the aggregated rows to.
+        :type writer: BulkWriter
+        :arg columns: Names of the columns, in the order of the row values.
+        :type columns: tuple(str)
+        :arg column: Name of the column to sum.
+        :type column: str
+        """
+        self.writer = writer
+        self.index = columns.index(column)
+
+        #: Number of rows aggregated into another row.
+        self.aggregated = 0
+
+    def write(self, rows):
+        """
+        Write a batch of rows.
+
+        :arg rows: Rows to write.
+        :type rows: iterable(tuple)
+
+        :return: Number of rows written.
+        :rtype: int
+        """
+        index = self.index
+        totals = OrderedDict()
+        for row in rows:
+            key = row[:index] + row[index + 1:]
+            if key in totals:
+                totals[key] += row[index]
+                self.aggregated += 1
+            else:
+                totals[key] = row[index]
+        return self.writer.write(key[:index] + (total,) + key[index:]
+                                 for key, total in totals.iteritems())
+
+
+class SplitWriter(object):
+    """
+    Write rows of different kinds to different writers.
+
+    Rows are buffered per kind, so a batch is held in memory before it is
+    written.
+    """
+    def __init__(self, writers):
+        """
+        :arg writers: Writer for each kind of row.
+        :type writers: dict(str, BulkWriter)
+        """
+        self.writers = writers
+
+    def write(self, rows):
+        """
+        Write a batch of rows.
+
+        :arg rows: Tuples `(kind, row)`.
+        :type rows: iterable(tuple)
+
+        :return: Number of rows written.
+        :rtype: int
+        """
+        batches = dict((kind, []) for kind in self.writers)
+        for kind, row in rows:
+            batches[kind].append(row)
+        return sum(self.writers[kind].write(batch)
+                   for kind, batch in batches.items())
+
+
+def bulk_writer(table, columns):
+    """
+    Create a writer for `table`, using ``COPY`` if the database supports it.
+
+    :arg table: Table to write to.
+    :type table: sqlalchemy.schema.Table
+    :arg columns: Names of the columns, in the order of the row values.
+    :type columns: tuple(str)
+
+    :return: Writer for `table`.
+    :rtype: BulkWriter
+    """
+    if db.engine.dialect.driver == 'psycopg2':
+        return CopyWriter(table, columns)
+    return BulkWriter(table, columns)
+
+
+class StagingTable(object):
+    """
+    Table for collecting the rows of an import before they are published to
+    their destination table at once.
+
+    The staging table has the given columns of the destination table, but no
+    constraints or indexes. On PostgreSQL, it is created ``UNLOGGED`` which
+    makes writing to it cheaper. Note that unlogged tables are truncated
+    after a database crash.
+    """
+    def __init__(self, table, columns, name):
+        """
+        :arg table: Destination table.
+        :type table: sqlalchemy.schema.Table
+        :arg columns: Names of the columns, in the order of the row values.
+        :type columns: tuple(str)
+        :arg name: Name of the staging table.
+        :type name: str
+        """
+        self.target = table
+        self.columns = columns
+
+        # Enum columns are stored as strings, so we don't interfere with the
+        # lifetime of the enum type (on PostgreSQL).
+        staging_columns = []
+        for column in columns:
+            type_ = table.c[column].type
+            if isinstance(type_, sqlalchemy.Enum):
+                type_ = sqlalchemy.String(max(len(e) for e in type_.enums))
+            staging_columns.append(sqlalchemy.Column(column, type_))
+
+        prefixes = []
+        if db.engine.dialect.name == 'postgresql':
+            prefixes.append('UNLOGGED')
+
+        # We use a separate metadata object to keep the staging table out of
+        # `db.create_all()`.
+        self.table = sqlalchemy.Table(name, sqlalchemy.MetaData(),
+                                      *staging_columns, prefixes=prefixes)
+
+    def create(self):
+        """
+        Create the staging table if it does not exist.
+        """
+        self.table.create(db.session.connection(), checkfirst=True)
+
+    def exists(self):
+        """
+        Check if the staging table exists.
+        """
+        return self.table.exists(db.session.connection())
+
+    def count(self):
+        """
+        Number of rows in the staging table.
+        """
+        return db.session.execute(
+            sqlalchemy.select([sqlalchemy.func.count()]).select_from(
+                self.table)).scalar()
+
+    def is_empty(self):
+        """
+        Check if the staging table has no rows, without counting them.
+        """
+        return db.session.execute(
+            sqlalchemy.select([sqlalchemy.literal(1)]).select_from(
+                self.table).limit(1)).first() is None
+
+    def writer(self):
+        """
+        Create a writer for the staging table.
+        """
+        return bulk_writer(self.table, self.columns)
+
+    def publish(self, order_by=None):
+        """
+        Copy all rows to the destination table with one
+        ``INSERT ... SELECT`` statement and remove the staging table.
+
+        This is done in the current transaction of the session, so it is up
+        to the caller to commit.
+
+        :kwarg order_by: Names of columns to sort the rows by before they are
+            inserted. The database sorts them (spilling to disk if needed),
+            and newly allocated rows are stored in this order, so rows that
+            are queried together end up on the same pages.
+        :type order_by: tuple(str)
+
+        :return: Number of rows published.
+        :rtype: int
+        """
+        select = sqlalchemy.select(
+            [sqlalchemy.cast(self.table.c[column],
+                             self.target.c[column].type)
+             for column in self.columns])
+        if order_by:
+            select = select.order_by(*[self.table.c[column]
+                                       for column in order_by])
+        result = db.session.execute(
+            self.target.insert().from_select(self.columns, select))
+        self.table.drop(db.session.connection())
+        return result.rowcount
+
+    def truncate(self):
+        """
+        Remove all rows from the staging table.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('TRUNCATE TABLE %s' %
+                               db.engine.dialect.identifier_preparer.
+                               format_table(self.table))
+        else:
+            db.session.execute(self.table.delete())
+
+    def discard(self):
+        """
+        Remove the staging table with all its rows (if it exists).
+        """
+        if self.exists():
+            self.table.drop(db.session.connection())
+
+
+def observation_staging(variation_id):
+    """
+    Create a staging table for importing observations.
+
+    :arg variation_id: Variation the observations belong to.
+    :type variation_id: int
+    """
+    return StagingTable(Observation.__table__, OBSERVATION_COLUMNS,
+                        'observation_staging_%d' % variation_id)
+
+
+def region_staging(coverage_id):
+    """
+    Create a staging table for importing regions.
+
+    :arg coverage_id: Coverage the regions belong to.
+    :type coverage_id: int
+    """
+    return StagingTable(Region.__table__, REGION_COLUMNS,
+                        'region_staging_%d' % coverage_id)
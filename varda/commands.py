@@ -7,15 +7,20 @@ Varda management console.
 """
 
 
+from __future__ import division
+
 import argparse
 import getpass
 import os
 import sys
+import time
 
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 
 from . import create_app, db
-from .models import User
+from .models import Observation, User
+from .utils import calculate_frequency
 
 
 def debugserver(args):
@@ -45,6 +50,13 @@ def setup(args):
                    admin_password_hash=args.admin_password_hash)
 
 
+def cluster(args):
+    """
+    Reorder observations and regions on disk by location (PostgreSQL only).
+    """
+    database_cluster(create_app(), measure=args.measure)
+
+
 def database_setup(app, alembic_config='alembic.ini', destructive=False,
                    admin_password_hash=None):
     if not os.path.isfile(alembic_config):
@@ -71,6 +83,60 @@ def database_setup(app, alembic_config='alembic.ini', destructive=False,
             alembic.command.stamp(alembic_config, 'head')
 
 
+def database_cluster(app, measure=0):
+    """
+    Physically reorder the observation and region tables according to their
+    location indexes using ``CLUSTER``.
+
+    Rows are stored in insertion order, which for imported data is the order
+    of the data source. Frequency calculations look up all observations and
+    regions at a location, which after clustering are on the same pages
+    instead of scattered over the tables. Note that ``CLUSTER`` takes an
+    exclusive lock on the table and that new rows are not clustered, so this
+    should be repeated periodically.
+
+    If `measure` is positive, the average time of calculating the frequency
+    of this many randomly chosen observations is reported before and after
+    clustering.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.stderr.write('Clustering is only supported on PostgreSQL\n')
+            sys.exit(1)
+
+        variants = []
+        if measure > 0:
+            variants = db.session.query(
+                Observation.chromosome, Observation.position,
+                Observation.reference, Observation.observed).order_by(
+                func.random()).limit(measure).all()
+
+        def latency():
+            # Pages may still be cached from an earlier run, so this is only
+            # an indication.
+            start = time.time()
+            for variant in variants:
+                calculate_frequency(*variant)
+            return (time.time() - start) / len(variants) * 1000
+
+        if variants:
+            sys.stdout.write('Frequency calculation before clustering: '
+                             '%.2f ms\n' % latency())
+
+        for table, index in (('observation', 'observation_location'),
+                             ('region', 'region_location')):
+            start = time.time()
+            db.session.execute('CLUSTER %s USING %s' % (table, index))
+            db.session.execute('ANALYZE %s' % table)
+            db.session.commit()
+            sys.stdout.write('Clustered table %s on index %s in %.1f '
+                             'seconds\n' % (table, index, time.time() - start))
+
+        if variants:
+            sys.stdout.write('Frequency calculation after clustering: '
+                             '%.2f ms\n' % latency())
+
+
 def admin_setup(password_hash=None):
     """
     Update the password for the admin user. If the admin user does not exist,
@@ -136,6 +202,13 @@ def main():
                               parents=[config_parser])
     p.set_defaults(func=setup)
 
+    p = subparsers.add_parser('cluster', help=cluster.__doc__)
+    p.add_argument('-m', '--measure', metavar='N', dest='measure', type=int,
+                   default=0, help='report the average frequency calculation '
+                   'time for N random observations before and after '
+                   'clustering')
+    p.set_defaults(func=cluster)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -0,0 +1,106 @@
+"""
+Resolve contig names to the names used in the reference genome.
+
+Contig names differ between assemblies, e.g., ``chr1`` (UCSC) versus ``1``
+(GRCh37), ``chr1_gl000191_random`` versus ``GL000191.1``, and ``chrM``
+versus ``MT``. A :class:`ContigResolver` is built once with the contig names
+in the reference genome and resolves any of these names with a dictionary
+lookup. Results (including misses) are cached, so after the first occurrence
+of a name resolving it costs a single lookup.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import re
+
+
+# Contigs named after their GenBank accession in GRCh37 (e.g., GL000191.1)
+# and after the chromosome they are placed on in UCSC (chr1_gl000191_random,
+# or chrUn_gl000211 for unplaced contigs).
+GL_CONTIG = re.compile(r'(?:^|_)(gl\d+)(?:\.\d+|_random)?$', re.IGNORECASE)
+
+# Maximum number of names to cache.
+MAX_CACHED = 100000
+
+
+class ContigResolver(object):
+    """
+    Resolve contig names to the names used in the reference genome.
+
+    After creating an instance, call the :meth:`init` method with the contig
+    aliases and the names in the reference genome.
+    """
+    def __init__(self):
+        self.init()
+
+    def init(self, aliases=None, contigs=None):
+        """
+        :kwarg aliases: Groups of names for the same contig, e.g., all names
+            for the mitochondrial genome. Without reference genome, names in
+            a group are resolved to the first name in that group.
+        :type aliases: list(list(str))
+        :kwarg contigs: Contig names in the reference genome. If `None`, names
+            are not checked, but only normalized by removing any ``chr``
+            prefix.
+        :type contigs: list(str)
+        """
+        self.contigs = contigs
+        self._groups = {}
+        for i, group in enumerate(aliases or []):
+            for alias in group:
+                self._groups.setdefault(alias, (i, group[0]))
+
+        if contigs is None:
+            self._index = None
+            self._cache = {}
+        else:
+            # Exact names take precedence over all alias keys.
+            self._index = {}
+            for contig in contigs:
+                self._index.setdefault(self._key(contig), contig)
+            self._cache = dict((contig, contig) for contig in contigs)
+
+    def _key(self, name):
+        """
+        Key that is equal for all aliases of a contig.
+        """
+        if name in self._groups:
+            return 'alias', self._groups[name][0]
+        match = GL_CONTIG.search(name)
+        if match:
+            return 'gl', match.group(1).upper()
+        if name.startswith('chr'):
+            return 'name', name[3:]
+        return 'name', name
+
+    def _resolve(self, name):
+        if self._index is not None:
+            return self._index.get(self._key(name))
+        if name in self._groups:
+            return self._groups[name][1]
+        if name.startswith('chr'):
+            return name[3:]
+        return name
+
+    def resolve(self, name):
+        """
+        Resolve a contig name.
+
+        :arg name: Contig name.
+        :type name: str
+
+        :return: Name of the contig in the reference genome, or `None` if it
+            is not in the reference genome.
+        :rtype: str
+        """
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        contig = self._resolve(name)
+        if len(self._cache) < MAX_CACHED:
+            self._cache[name] = contig
+        return contig
@@ -17,6 +17,19 @@ DATA_DIR = '/tmp'
 # Maximum size for uploaded files
 MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1 gigabyte
 
+# Compression level for storing data files with gzip (1 is fastest, 9 is
+# smallest)
+DATA_COMPRESSION_LEVEL = 6
+
+# Decompress gzipped data files in a background thread while reading them,
+# buffering at most this many blocks of 1 megabyte (0 to disable)
+DATA_PREFETCH_BLOCKS = 8
+
+# Number of threads per process for decompressing data files in the BGZF
+# format (as written by bgzip), None to use the number of CPUs (0 to
+# decompress them as regular gzip files)
+DATA_DECOMPRESSION_THREADS = 4
+
 # Secondary directory to use files from, for example uploaded there by other
 # means such as SFTP (Varda will never write there, only symlink to it)
 SECONDARY_DATA_DIR = None
@@ -27,9 +40,48 @@ SECONDARY_DATA_BY_USER = False
 # Location of reference genome Fasta file
 GENOME = None
 
+# Directory to store an uppercase copy of the reference genome in (by default
+# no copy is made and sequences are converted to uppercase when they are read)
+GENOME_UPPERCASE_DIR = None
+
+# Groups of names for the same chromosome (in addition to names with and
+# without 'chr' prefix and UCSC and GRCh37 names for GL contigs)
+CHROMOSOME_ALIASES = [['M', 'MT', 'NC_012920.1', 'NC_012920_1', 'NC_012920',
+                       'chrM', 'chrMT']]
+
 # Abort entire task if a reference mismatch occurs
 REFERENCE_MISMATCH_ABORT = True
 
+# Split variation imports in shards that are imported in parallel, either by
+# 'chromosome' or by fixed ranges of 'records' (None to disable)
+IMPORT_SHARDING = None
+
+# Number of records per shard if IMPORT_SHARDING is 'records'
+IMPORT_SHARD_RECORDS = 1000000
+
+# Sort observations by chromosome and position when publishing an import,
+# so observations at the same location are stored close together
+IMPORT_SORT_OBSERVATIONS = False
+
+# Parser for VCF files, either 'fast' (varda.vcf_reader) or 'pyvcf'
+VCF_READER = 'fast'
+
+# Report a breakdown of running time per stage (parsing, writing, etc.) in
+# the metadata of import and annotation tasks (adds a fixed cost per record)
+TASK_TIMING = False
+
+# Minimum genotype quality (GQ) of a gVCF reference block to import it as
+# covered (None to disable)
+GVCF_MIN_GQ = 20
+
+# Minimum depth (MIN_DP, or DP) of a gVCF reference block to import it as
+# covered (None to disable)
+GVCF_MIN_DP = 10
+
+# Minimum depth of a bedGraph record to import it as covered (None to
+# disable)
+BEDGRAPH_MIN_DEPTH = 10
+
 # Location of Celery log file
 #CELERYD_LOG_FILE = '/tmp/varda-celeryd.log'
 
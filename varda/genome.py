@@ -1,13 +1,160 @@
 """
 Wrapper for ``pyfasta`` to load a genome after instantiation.
 
+On top of ``pyfasta``, the genome has a table of contig lengths and gives
+access to the sequence in uppercase. Optionally, an uppercase copy of the
+flattened Fasta file is stored in a given directory (with extension
+``.upper``) and memory-mapped, so reference checks do not need to convert
+case and slices are taken directly from the mapped file. Without the copy,
+slices of the flattened Fasta file are converted to uppercase when they are
+read.
+
+All genome data is memory-mapped from files and is never written to after
+loading. A genome loaded before forking worker processes is therefore shared
+by all of them, without loading it again or using private memory per
+process.
+
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 
 .. Licensed under the MIT license, see the LICENSE file.
 """
 
 
+import mmap
+import os
+import tempfile
+import threading
+
+import numpy as np
 from pyfasta import Fasta
+from pyfasta.records import is_up_to_date
+
+
+# Size of chunks to read when creating the uppercase copy of the sequence.
+CHUNK_SIZE = 1024 * 1024 * 16
+
+
+def map_file(filename):
+    """
+    Memory-map a file read-only.
+    """
+    with open(filename, 'rb') as handle:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def uppercase_copy(flat_file, directory):
+    """
+    Memory-map an uppercase copy of a flattened Fasta file.
+
+    The copy is created in `directory` if it does not exist or is older than
+    `flat_file`.
+
+    :arg flat_file: Path to the flattened Fasta file.
+    :type flat_file: str
+    :arg directory: Directory to store the copy in.
+    :type directory: str
+
+    :return: Read-only memory map of the uppercase copy, or `None` if it
+        cannot be created (e.g., the directory is not writable).
+    :rtype: mmap.mmap
+    """
+    upper_file = os.path.join(directory,
+                              os.path.basename(flat_file) + '.upper')
+
+    if not is_up_to_date(upper_file, flat_file):
+        try:
+            handle, temp_file = tempfile.mkstemp(dir=directory)
+        except OSError:
+            return None
+        # Write to a temporary file first, so other processes never see an
+        # incomplete copy.
+        with os.fdopen(handle, 'wb') as upper, open(flat_file, 'rb') as flat:
+            for chunk in iter(lambda: flat.read(CHUNK_SIZE), ''):
+                upper.write(chunk.upper())
+        os.chmod(temp_file, 0o644)
+        os.rename(temp_file, upper_file)
+
+    return map_file(upper_file)
+
+
+class ContigSequence(object):
+    """
+    Uppercase sequence of a contig.
+
+    Indexing and (contiguous) slicing work like on a string, without reading
+    the entire contig.
+    """
+    __slots__ = ('data', 'start', 'stop', 'upper')
+
+    def __init__(self, data, start, stop, upper=True):
+        """
+        :arg data: Sequence data containing the contig.
+        :type data: mmap.mmap
+        :arg start: Start of the contig in `data`.
+        :type start: int
+        :arg stop: End of the contig in `data`.
+        :type stop: int
+        :kwarg upper: Whether or not `data` is uppercase already. If not,
+            slices are converted to uppercase when they are read.
+        :type upper: bool
+        """
+        self.data = data
+        self.start = start
+        self.stop = stop
+        self.upper = upper
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            begin, end, step = index.indices(self.stop - self.start)
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported')
+            sequence = self.data[self.start + begin:
+                                 self.start + max(begin, end)]
+            return sequence if self.upper else sequence.upper()
+        if index < 0:
+            index += self.stop - self.start
+        if not 0 <= index < self.stop - self.start:
+            raise IndexError('Contig index out of range')
+        base = self.data[self.start + index]
+        return base if self.upper else base.upper()
+
+    def array(self, begin=0, end=None):
+        """
+        NumPy array of the sequence (or part of it). With an uppercase copy
+        of the genome, this is a view on the data without copying.
+
+        :kwarg begin: Start of the array, zero-based.
+        :type begin: int
+        :kwarg end: End of the array, zero-based, non-inclusive. Defaults to
+            the end of the contig.
+        :type end: int
+
+        :return: Array of single characters.
+        :rtype: numpy.ndarray
+        """
+        begin, end, _ = slice(begin, end).indices(self.stop - self.start)
+        if not self.upper:
+            return np.frombuffer(self[begin:end], dtype='S1')
+        return np.frombuffer(self.data, dtype='S1',
+                             count=max(0, end - begin),
+                             offset=self.start + begin)
+
+    def take(self, indices):
+        """
+        Bases at the given positions.
+
+        :arg indices: Zero-based positions in the contig.
+        :type indices: numpy.ndarray
+
+        :return: Array of single characters.
+        :rtype: numpy.ndarray
+        """
+        bases = np.frombuffer(self.data, dtype='S1', count=len(self),
+                              offset=self.start)[indices]
+        return bases if self.upper else np.char.upper(bases)
 
 
 class Genome(Fasta):
@@ -15,16 +162,65 @@ class Genome(Fasta):
     Version of ``pyfasta.Fasta`` that is initialized after instantiation.
 
     After creating an instance, call the ``init`` method with arguments you
-    would normally give the constructor.
+    would normally give the constructor. In addition, the `uppercase_dir`
+    keyword argument gives the directory to store an uppercase copy of the
+    sequence in (see :func:`uppercase_copy`).
 
     Checking if an instance has been initialized can be done by looking at its
     boolean value.
 
-    .. todo:: Check if ``pyfasta.Fasta`` is thread-safe. It depends on the
-        application server model (and Celery model) if we need it.
+    Calling ``init`` again with the same arguments does nothing if the Fasta
+    file did not change, so a genome initialized in a parent process is
+    reused by processes forked from it (e.g., Celery pool processes, or
+    Gunicorn workers with ``--preload``), even if they initialize it again.
+
+    Initialization is serialized by a lock. The contig sequences and lengths
+    are replaced at once and are read-only, so :meth:`contig` and
+    :attr:`lengths` can be used from any thread. Note that sequences obtained
+    by indexing the genome itself come from ``pyfasta.Fasta`` and are not
+    uppercase.
     """
     def __init__(self):
         self.index = {}
 
-    def init(self, *args, **kwargs):
-        super(Genome, self).__init__(*args, **kwargs)
+        #: Length of each contig.
+        self.lengths = {}
+
+        self._contigs = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def init(self, fasta_name, *args, **kwargs):
+        loaded = (os.path.abspath(fasta_name), os.stat(fasta_name).st_mtime,
+                  args, sorted(kwargs.items()))
+        uppercase_dir = kwargs.pop('uppercase_dir', None)
+        with self._lock:
+            if loaded == self._loaded:
+                return
+            super(Genome, self).__init__(fasta_name, *args, **kwargs)
+            data = None
+            if uppercase_dir is not None:
+                data = uppercase_copy(self.prepared.filename, uppercase_dir)
+            upper = data is not None
+            if not upper:
+                data = map_file(self.prepared.filename)
+            self.lengths = dict((contig, stop - start)
+                                for contig, (start, stop)
+                                in self.index.items())
+            self._contigs = dict((contig,
+                                  ContigSequence(data, start, stop, upper))
+                                 for contig, (start, stop)
+                                 in self.index.items())
+            self._loaded = loaded
+
+    def contig(self, name):
+        """
+        Uppercase sequence of a contig.
+
+        :arg name: Contig name.
+        :type name: str
+
+        :return: Contig sequence.
+        :rtype: ContigSequence
+        """
+        return self._contigs[name]
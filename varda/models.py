@@ -11,13 +11,18 @@ Models backed by SQL using SQLAlchemy.
 
 
 from datetime import datetime
+import fcntl
 from functools import wraps
 import gzip
 from hashlib import sha1
 import hmac
+import io
+import itertools
 import os
 import sqlite3
+import tempfile
 import uuid
+import zlib
 
 import bcrypt
 from flask import current_app
@@ -26,12 +31,16 @@ from sqlalchemy.engine import Engine
 from sqlalchemy.orm.exc import DetachedInstanceError
 import werkzeug
 
-from . import db
+from . import bcf_reader, db
 from .region_binning import assign_bin
+from .region_index import (INDEX_FILETYPES, RegionIndex, RegionReader,
+                           UnsortedData)
+from .streams import (BgzfReader, BgzfWriter, Digest, is_bgzf,
+                      PrefetchReader, read_chunks)
 
 
 # Todo: Use the types for which we have validators.
-DATA_SOURCE_FILETYPES = ('bed', 'vcf', 'csv')
+DATA_SOURCE_FILETYPES = ('bed', 'vcf', 'csv', 'bcf', 'gvcf', 'bedgraph')
 
 OBSERVATION_ZYGOSITIES = ('heterozygous', 'homozygous')
 
@@ -395,9 +404,9 @@ class DataSource(db.Model):
                            backref=db.backref('data_sources', lazy='dynamic'))
 
     def __init__(self, user, name, filetype, upload=None, local_file=None,
-                 empty=False, gzipped=False):
+                 empty=False, chunked=False, gzipped=False):
         """
-        One of the following three keyword arguments must be specified:
+        One of the following four keyword arguments must be specified:
 
         * `upload`: Data is provided as an uploaded file. Specifically,
           `upload` is expected to be a :class:`werkzeug.datastructures.FileStorage`
@@ -411,6 +420,9 @@ class DataSource(db.Model):
 
         * `empty`: No data is provided for the data source at this point. Data
           can be written to it later using the :meth:`data_writer` method.
+
+        * `chunked`: Data is uploaded later in consecutive chunks using the
+          :meth:`upload_chunk` method.
         """
         if not filetype in DATA_SOURCE_FILETYPES:
             raise InvalidDataSource('unknown_filetype',
@@ -428,13 +440,11 @@ class DataSource(db.Model):
                                 self.filename)
 
         if upload is not None:
-            if gzipped:
-                upload.save(path)
-            else:
-                data = gzip.open(path, 'wb')
-                data.write(upload.read())
-                data.close()
-            self.gzipped = True
+            self._store(upload)
+        elif chunked:
+            # Chunks are collected in a separate file until the upload is
+            # finished, so the data is not available before that.
+            open(path + '.part', 'wb').close()
         elif local_file is not None:
             if not current_app.config['SECONDARY_DATA_DIR']:
                 raise InvalidDataSource(
@@ -459,23 +469,158 @@ class DataSource(db.Model):
         return '<DataSource %r, filename=%r, filetype=%r, records=%r>' \
             % (self.name, self.filename, self.filetype, self.records)
 
-    def data(self):
+    def _store(self, upload):
+        """
+        Store uploaded data gzip-compressed (in the BGZF format), reading it
+        in chunks.
+
+        Data that is already in the BGZF format (e.g., BCF) is stored as-is.
+        """
+        path = os.path.join(current_app.config['DATA_DIR'], self.filename)
+
+        chunks = read_chunks(upload)
+        first = next(chunks, '')
+        bgzf = is_bgzf(io.BytesIO(first))
+
+        # The digest is calculated while the data is written, so we don't
+        # have to read it again before importing. It is always calculated
+        # over the uncompressed data.
+        digest = Digest(gzipped=self.gzipped or bgzf,
+                        counter=bcf_reader.RecordCounter()
+                        if self.filetype == 'bcf' else None)
+        if self.gzipped or bgzf:
+            data = open(path, 'wb')
+        else:
+            data = BgzfWriter(open(path, 'wb'),
+                              current_app.config['DATA_COMPRESSION_LEVEL'])
+        try:
+            with data:
+                for chunk in itertools.chain([first], chunks):
+                    digest.update(chunk)
+                    data.write(chunk)
+        except zlib.error as e:
+            os.remove(path)
+            raise InvalidDataSource(
+                'invalid_data', 'Data is not valid gzip-compressed data: %s'
+                % str(e))
+        except bcf_reader.InvalidBCF as e:
+            os.remove(path)
+            raise InvalidDataSource('invalid_data', str(e))
+        self.checksum, self.records = digest.checksum, digest.records
+        self.gzipped = True
+
+    def upload_offset(self):
+        """
+        Get the number of bytes received for a chunked upload in progress.
+
+        :return: Number of bytes received, or `None` if no chunked upload is
+            in progress.
+        :rtype: int
+        """
+        path = os.path.join(current_app.config['DATA_DIR'],
+                            self.filename + '.part')
+        try:
+            return os.path.getsize(path)
+        except EnvironmentError:
+            return None
+
+    def upload_chunk(self, chunk, offset, done=False):
+        """
+        Append a chunk to a chunked upload in progress.
+
+        Uploads can be resumed after an interruption by querying
+        :meth:`upload_offset` and continuing from there.
+
+        :arg chunk: Uploaded chunk of data, or `None` if there is no more
+            data.
+        :type chunk: werkzeug.datastructures.FileStorage
+        :arg offset: Position of the chunk in the uploaded data. Must be equal
+            to the number of bytes received so far.
+        :type offset: int
+        :kwarg done: If `True`, this is the last chunk and the data is stored.
+        :type done: bool
+        """
+        path = os.path.join(current_app.config['DATA_DIR'],
+                            self.filename + '.part')
+        try:
+            # Don't create the file if no chunked upload is in progress.
+            data = os.fdopen(os.open(path, os.O_WRONLY | os.O_APPEND), 'ab')
+        except EnvironmentError:
+            raise InvalidDataSource('invalid_upload',
+                                    'No chunked upload is in progress')
+
+        with data:
+            # Concurrent (or retried) requests for the same upload wait for
+            # each other, so checking the offset and appending the chunk is
+            # atomic and a chunk is never appended twice.
+            fcntl.flock(data.fileno(), fcntl.LOCK_EX)
+            status = os.fstat(data.fileno())
+            if not status.st_nlink:
+                # The upload was finished while we were waiting.
+                raise InvalidDataSource('invalid_upload',
+                                        'No chunked upload is in progress')
+            received = status.st_size
+            if offset != received:
+                raise InvalidDataSource('invalid_offset',
+                                        'Chunk offset should be %d' % received)
+
+            if chunk is not None:
+                for part in read_chunks(chunk):
+                    data.write(part)
+                data.flush()
+
+            if done:
+                with open(path, 'rb') as upload:
+                    self._store(upload)
+                os.remove(path)
+
+    def data(self, region=None):
         """
         Get open file-like handle to data contained in this data source for
         reading.
 
+        :kwarg region: Read only the header and the records overlapping this
+            region, given as a tuple of chromosome, begin and end (one-based,
+            inclusive). This requires the data to be indexed (see
+            :meth:`index`).
+        :type region: tuple(str, int, int)
+
+        Gzipped data in the BGZF format is decompressed by a pool of threads
+        (see :class:`varda.streams.BgzfReader`), unless
+        `DATA_DECOMPRESSION_THREADS` is `0`.
+
+        If the data is gzipped and `DATA_PREFETCH_BLOCKS` is configured, it
+        is decompressed ahead of reading in a background thread (see
+        :class:`varda.streams.PrefetchReader`).
+
         .. note:: Be sure to close after calling this.
         """
+        if region is not None:
+            index = self.index()
+            if index is None:
+                raise DataUnavailable('data_source_not_indexed',
+                                      'Data source cannot be read by region')
+            return RegionReader(self._bgzf_reader(), index, *region)
+
         filepath = os.path.join(current_app.config['DATA_DIR'],
                                 self.filename)
         try:
-            if self.gzipped:
-                return gzip.open(filepath)
-            else:
+            if not self.gzipped:
                 return open(filepath)
+            threads = current_app.config['DATA_DECOMPRESSION_THREADS']
+            data = open(filepath, 'rb')
+            if threads != 0 and is_bgzf(data):
+                data = BgzfReader(data, threads=threads)
+            else:
+                data.close()
+                data = gzip.open(filepath)
         except EnvironmentError:
             raise DataUnavailable('data_source_not_cached',
                                   'Data source is not in the cache')
+        blocks = current_app.config['DATA_PREFETCH_BLOCKS']
+        if blocks:
+            return PrefetchReader(data, blocks=blocks)
+        return data
 
     def data_writer(self):
         """
@@ -486,15 +631,81 @@ class DataSource(db.Model):
         """
         filepath = os.path.join(current_app.config['DATA_DIR'],
                                 self.filename)
+        # Any index on the previous data is no longer valid.
+        if os.path.exists(filepath + '.idx'):
+            os.remove(filepath + '.idx')
         try:
             if self.gzipped:
-                return gzip.open(filepath, 'wb')
+                return BgzfWriter(open(filepath, 'wb'),
+                                  current_app.config['DATA_COMPRESSION_LEVEL'])
             else:
                 return open(filepath, 'wb')
         except EnvironmentError:
             raise DataUnavailable('data_source_not_cached',
                                   'Data source is not in the cache')
 
+    def _bgzf_reader(self):
+        """
+        Open the data in the BGZF format for reading with
+        :class:`varda.streams.BgzfReader`.
+        """
+        threads = current_app.config['DATA_DECOMPRESSION_THREADS']
+        try:
+            raw = open(self.local_path(), 'rb')
+        except EnvironmentError:
+            raise DataUnavailable('data_source_not_cached',
+                                  'Data source is not in the cache')
+        return BgzfReader(raw, threads=1 if threads == 0 else threads)
+
+    def index(self, build=True):
+        """
+        Get the region index on the data contained in this data source (see
+        :mod:`varda.region_index`).
+
+        The index is stored next to the data. Only sorted and well-formed VCF
+        and BED data in the BGZF format can be indexed.
+
+        :kwarg build: If the index does not yet exist, build and store it.
+        :type build: bool
+
+        :return: Index on the data, or `None` if the data is not indexed.
+        :rtype: varda.region_index.RegionIndex
+        """
+        if not self.gzipped or self.filetype not in INDEX_FILETYPES:
+            return None
+
+        path = self.local_path() + '.idx'
+        try:
+            with open(path) as handle:
+                return RegionIndex.load(handle)
+        except (EnvironmentError, ValueError):
+            # An index in an older format is built again.
+            if not build:
+                return None
+
+        with self._bgzf_reader() as reader:
+            if not is_bgzf(reader.raw):
+                return None
+            # Malformed records are reported when the data is imported.
+            try:
+                index = RegionIndex.build(reader, self.filetype)
+            except (UnsortedData, ValueError):
+                return None
+
+        # Write to a temporary file first, so a concurrent reader never sees
+        # a partially written index. Every builder has its own temporary
+        # file, so concurrent builders don't write to the same file.
+        fd, temp_path = tempfile.mkstemp(dir=current_app.config['DATA_DIR'],
+                                         prefix=self.filename + '.idx.')
+        try:
+            with os.fdopen(fd, 'w') as handle:
+                index.dump(handle)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return index
+
     def empty(self):
         """
         Remove all data from this data source.
@@ -540,6 +751,14 @@ class Variation(db.Model):
     #: used if :attr:`use_genotypes` is `True`.
     prefer_genotype_likelihoods = db.Column(db.Boolean)
 
+    #: Number of records (lines) of the data source imported so far. Can be
+    #: `None` if no import is in progress. Used to resume a failed import.
+    checkpoint_record = db.Column(db.Integer)
+
+    #: Offset in the (uncompressed) data source data of the record following
+    #: :attr:`checkpoint_record`.
+    checkpoint_offset = db.Column(db.BigInteger)
+
     #: The :class:`Sample` this set of :class:`Observation`s belong to.
     sample = db.relationship(Sample,
                              backref=db.backref('variations', lazy='dynamic',
@@ -582,6 +801,14 @@ class Coverage(db.Model):
     task_done = db.Column(db.Boolean, default=False)
     task_uuid = db.Column(db.String(36))
 
+    #: Number of records (lines) of the data source imported so far. Can be
+    #: `None` if no import is in progress. Used to resume a failed import.
+    checkpoint_record = db.Column(db.Integer)
+
+    #: Offset in the (uncompressed) data source data of the record following
+    #: :attr:`checkpoint_record`.
+    checkpoint_offset = db.Column(db.BigInteger)
+
     #: The :class:`Sample` this set of :class:`Region`s belong to.
     sample = db.relationship(Sample,
                              backref=db.backref('coverages', lazy='dynamic',
@@ -642,6 +869,16 @@ class Annotation(db.Model):
     #: e.g. [{'group1': False, 'group2': True}, {'group1': True, 'group2': False}]
     group_query = db.Column(db.PickleType)
 
+    #: Chromosome of the region to annotate, or `None` to annotate all
+    #: records. See :attr:`region`.
+    region_chromosome = db.Column(db.String(30))
+
+    #: Start of the region to annotate (one-based, inclusive).
+    region_begin = db.Column(db.Integer)
+
+    #: End of the region to annotate (one-based, inclusive).
+    region_end = db.Column(db.Integer)
+
     #: The original :class:`DataSource` that is being annotated.
     original_data_source = db.relationship(
         DataSource,
@@ -655,7 +892,8 @@ class Annotation(db.Model):
         backref=db.backref('annotation', uselist=False, lazy='select'))
 
     def __init__(self, original_data_source, annotated_data_source,
-                 global_frequency=True, sample_frequency=None, group_query=None):
+                 global_frequency=True, sample_frequency=None, group_query=None,
+                 region=None):
         sample_frequency = sample_frequency or []
 
         self.original_data_source = original_data_source
@@ -663,6 +901,21 @@ class Annotation(db.Model):
         self.global_frequency = global_frequency
         self.sample_frequency = sample_frequency
         self.group_query = group_query
+        if region is not None:
+            (self.region_chromosome, self.region_begin,
+             self.region_end) = region
+
+    @property
+    def region(self):
+        """
+        Region to annotate as a tuple of chromosome, begin and end (one-based,
+        inclusive), or `None` to annotate all records. Only records
+        overlapping the region are read from the original data source (see
+        :meth:`DataSource.data`).
+        """
+        if self.region_chromosome is None:
+            return None
+        return self.region_chromosome, self.region_begin, self.region_end
 
     @detached_session_fix
     def __repr__(self):
@@ -0,0 +1,297 @@
+"""
+Index on genomic regions for data sources stored in the BGZF format.
+
+The index is similar in spirit to a tabix index. For every chromosome we
+store a linear index, which has for every window of 16 kilobases the BGZF
+virtual offset of the first record overlapping it. This allows us to start
+reading records in a region without decompressing any of the data before
+it.
+
+Indexes are built for VCF, BED and bedGraph files, which must be sorted by
+position and have all records for a chromosome together.
+
+.. note:: All genomic positions in this module are one-based and inclusive.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import json
+
+from . import contigs
+
+
+#: Version of the index format.
+INDEX_VERSION = 2
+
+#: Filetypes an index can be built for.
+INDEX_FILETYPES = ('bed', 'vcf', 'bedgraph')
+
+#: Size of the windows in the linear index (same as used by tabix).
+WINDOW_SIZE = 1 << 14
+
+
+class UnsortedData(Exception):
+    """
+    Exception thrown if data is not sorted by position.
+    """
+    pass
+
+
+def record_span(line, filetype):
+    """
+    Get the region covered by a record.
+
+    :arg line: Line in the data source.
+    :type line: str
+    :arg filetype: Data source filetype, one of :data:`INDEX_FILETYPES`.
+    :type filetype: str
+
+    :return: Tuple of chromosome, begin and end of the record, or `None` if
+        the line is not a record.
+    :rtype: tuple(str, int, int)
+
+    :raise ValueError: If the record cannot be parsed.
+    """
+    if line.startswith('#') or not line.strip():
+        return None
+    try:
+        if filetype == 'vcf':
+            fields = line.split('\t', 4)
+            position = int(fields[1])
+            return (fields[0], position,
+                    position + max(1, len(fields[3])) - 1)
+        if line.startswith('track') or line.startswith('browser'):
+            return None
+        fields = line.split(None, 3)
+        return fields[0], int(fields[1]) + 1, int(fields[2])
+    except (IndexError, ValueError):
+        raise ValueError('Invalid record: %s' % line.rstrip())
+
+
+class RegionIndex(object):
+    """
+    Index on the records in a data source by region.
+
+    The linear index has BGZF virtual offsets, which
+    :meth:`varda.streams.BgzfReader.seek_virtual` can seek to directly.
+    Other offsets are in the uncompressed data.
+    """
+    def __init__(self, filetype, header, chromosomes):
+        """
+        :arg filetype: Data source filetype.
+        :type filetype: str
+        :arg header: Offset of the first record.
+        :type header: int
+        :arg chromosomes: For each chromosome (in order of the data), a tuple
+            of the name, first and last line number, the offset of the first
+            record, and the linear index.
+        :type chromosomes: list(tuple(str, int, int, int, list(int)))
+        """
+        self.filetype = filetype
+        self.header = header
+        self.chromosomes = chromosomes
+        self._chromosomes = dict((c[0], c) for c in chromosomes)
+
+    @classmethod
+    def build(cls, reader, filetype):
+        """
+        Build an index by reading all data.
+
+        :arg reader: Data to index.
+        :type reader: varda.streams.BgzfReader
+        :arg filetype: Data source filetype, one of :data:`INDEX_FILETYPES`.
+        :type filetype: str
+
+        :return: Index on `reader`.
+        :rtype: RegionIndex
+
+        :raise UnsortedData: If the data is not sorted.
+        :raise ValueError: If a record cannot be parsed.
+        """
+        header = None
+        chromosomes = []
+        seen = set()
+        previous_begin = 0
+        offset = 0
+
+        for line_number, line in enumerate(reader, 1):
+            span = record_span(line, filetype)
+            if span is None:
+                offset += len(line)
+                continue
+
+            chromosome, begin, end = span
+            if header is None:
+                header = offset
+
+            if not chromosomes or chromosomes[-1][0] != chromosome:
+                if chromosome in seen:
+                    raise UnsortedData('Records on chromosome "%s" are not '
+                                       'together' % chromosome)
+                seen.add(chromosome)
+                chromosomes.append([chromosome, line_number, line_number,
+                                    offset, []])
+                previous_begin = 0
+            elif begin < previous_begin:
+                raise UnsortedData('Records on chromosome "%s" are not '
+                                   'sorted by position' % chromosome)
+            previous_begin = begin
+
+            chromosomes[-1][2] = line_number
+            windows = chromosomes[-1][4]
+            last_window = (end - 1) // WINDOW_SIZE
+            if last_window >= len(windows):
+                windows.extend([None] * (last_window - len(windows) + 1))
+            for window in range((begin - 1) // WINDOW_SIZE, last_window + 1):
+                if windows[window] is None:
+                    windows[window] = offset
+
+            offset += len(line)
+
+        # Windows without records get the offset of the previous window, the
+        # records we are looking for can only start after it. All offsets
+        # were read, so they can be converted to virtual offsets.
+        for chromosome in chromosomes:
+            windows = chromosome[4]
+            previous = chromosome[3]
+            for window, window_offset in enumerate(windows):
+                if window_offset is None:
+                    windows[window] = previous
+                previous = windows[window]
+            chromosome[4] = [reader.virtual_offset(window_offset)
+                             for window_offset in windows]
+
+        return cls(filetype, offset if header is None else header,
+                   [tuple(c) for c in chromosomes])
+
+    @classmethod
+    def load(cls, handle):
+        """
+        Load an index from an open file handle.
+        """
+        index = json.load(handle)
+        if index.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported index version')
+        return cls(index['filetype'], index['header'],
+                   [(str(c[0]),) + tuple(c[1:]) for c in index['chromosomes']])
+
+    def dump(self, handle):
+        """
+        Write the index to an open file handle.
+        """
+        json.dump({'version': INDEX_VERSION,
+                   'filetype': self.filetype,
+                   'header': self.header,
+                   'chromosomes': self.chromosomes}, handle)
+
+    def chromosome(self, chromosome):
+        """
+        Get the index entry for a chromosome. Names that are not in the index
+        are resolved in the same way as on import (see
+        :class:`varda.contigs.ContigResolver`), so any alias of a chromosome
+        can be used.
+
+        :return: Tuple of the name, first and last line number, offset of
+            the first record, and linear index, or `None` if there are no
+            records on `chromosome`.
+        :rtype: tuple(str, int, int, int, list(int))
+        """
+        if chromosome in self._chromosomes:
+            return self._chromosomes[chromosome]
+        contig = contigs.resolve(chromosome)
+        if contig is None:
+            return None
+        for entry in self.chromosomes:
+            if contigs.resolve(entry[0]) == contig:
+                return entry
+        return None
+
+    def record_offset(self, line_number):
+        """
+        Get the offset of a record if it is the first on its chromosome.
+
+        :return: Offset of the record, or `None` if it is unknown.
+        :rtype: int
+        """
+        for _, first_line, _, offset, _ in self.chromosomes:
+            if first_line == line_number:
+                return offset
+        return None
+
+    def read_region(self, reader, chromosome, begin, end):
+        """
+        Read records overlapping a region.
+
+        :arg reader: Indexed data.
+        :type reader: varda.streams.BgzfReader
+        :arg chromosome: Chromosome name.
+        :type chromosome: str
+        :arg begin: Start of the region.
+        :type begin: int
+        :arg end: End of the region.
+        :type end: int
+
+        :return: Generator yielding the header lines, followed by the lines
+            of all records overlapping the region.
+        """
+        reader.seek(0)
+        while reader.tell() < self.header:
+            yield reader.readline()
+
+        entry = self.chromosome(chromosome)
+        if entry is None:
+            return
+        name, _, _, _, windows = entry
+        window = (begin - 1) // WINDOW_SIZE
+        if window >= len(windows):
+            return
+
+        reader.seek_virtual(windows[window])
+        for line in reader:
+            span = record_span(line, self.filetype)
+            if span is None:
+                continue
+            if span[0] != name or span[1] > end:
+                break
+            if span[2] >= begin:
+                yield line
+
+
+class RegionReader(object):
+    """
+    Read-only file-like object for reading the records in a region of an
+    indexed data source.
+    """
+    def __init__(self, reader, index, chromosome, begin, end):
+        """
+        :arg reader: Indexed data.
+        :type reader: varda.streams.BgzfReader
+        :arg index: Index on `reader`.
+        :type index: RegionIndex
+        :arg chromosome: Chromosome name.
+        :type chromosome: str
+        :arg begin: Start of the region.
+        :type begin: int
+        :arg end: End of the region.
+        :type end: int
+        """
+        self.reader = reader
+        self.lines = index.read_region(reader, chromosome, begin, end)
+
+    def readline(self):
+        return next(self.lines, '')
+
+    def __iter__(self):
+        return self.lines
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,692 @@
+"""
+File-like wrappers and helpers for streaming data source contents.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import bisect
+import collections
+import hashlib
+import io
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+import struct
+import sys
+import threading
+import zlib
+
+
+#: Size of the chunks in which data is read by :func:`read_chunks`.
+CHUNK_SIZE = 0xf00000
+
+#: Size of the blocks of data read by :class:`PrefetchReader`.
+BLOCK_SIZE = 0x100000
+
+#: First bytes of gzip-compressed data.
+GZIP_MAGIC = '\x1f\x8b'
+
+#: First bytes of a BGZF block (gzip magic, deflate, and the FEXTRA flag).
+BGZF_MAGIC = '\x1f\x8b\x08\x04'
+
+#: Maximum size of the uncompressed data in a BGZF block (same as used by
+#: htslib).
+BGZF_BLOCK_SIZE = 0xff00
+
+
+def read_chunks(data, chunk_size=CHUNK_SIZE):
+    """
+    Read a file-like object in chunks.
+
+    :arg data: File-like object opened for reading.
+    :type data: file-like object
+    :kwarg chunk_size: Size of the chunks (default is 16 megabytes).
+    :type chunk_size: int
+
+    :return: Generator yielding chunks.
+    """
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class GzipDecompressor(object):
+    """
+    Incremental decompressor for gzip data.
+
+    The data can consist of several concatenated gzip members (e.g., BGZF),
+    each of which needs its own ``zlib`` decompressor.
+    """
+    def __init__(self):
+        self._decompressor = None
+
+    def decompress(self, chunk):
+        """
+        Decompress the next chunk of gzip data.
+
+        :arg chunk: Compressed data.
+        :type chunk: str
+
+        :return: Generator yielding decompressed data.
+        """
+        while chunk:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            yield self._decompressor.decompress(chunk)
+            chunk = self._decompressor.unused_data
+            if chunk:
+                self._decompressor = None
+
+
+def gunzip_chunks(chunks):
+    """
+    Decompress chunks of gzip data (see :class:`GzipDecompressor`).
+
+    :arg chunks: Chunks of compressed data.
+    :type chunks: iterator(str)
+
+    :return: Generator yielding decompressed data.
+    """
+    decompressor = GzipDecompressor()
+    for chunk in chunks:
+        for data in decompressor.decompress(chunk):
+            yield data
+
+
+class Digest(object):
+    """
+    Incrementally calculated digest of data as SHA1 checksum and number of
+    records.
+
+    Calculating the number of records is done in a naive way by counting the
+    number of lines, and as such includes empty and header lines, unless a
+    record counter for the data format is given.
+    """
+    def __init__(self, gzipped=False, counter=None):
+        """
+        :kwarg gzipped: Whether or not the data is fed gzip-compressed. If
+            `None`, this is detected from the first bytes of the data. The
+            digest is always calculated over the uncompressed data.
+        :type gzipped: bool
+        :kwarg counter: Object counting records in the uncompressed data fed
+            to its `update` method in its `records` attribute (e.g.,
+            :class:`varda.bcf_reader.RecordCounter`).
+        """
+        self.gzipped = gzipped
+        self.counter = counter
+        self._sha1 = hashlib.sha1()
+        self._records = 0
+        self._decompressor = GzipDecompressor()
+        self._pending = ''
+
+    def update(self, chunk):
+        """
+        Update the digest with the next chunk of data.
+        """
+        if self.gzipped is None:
+            self._pending += chunk
+            if len(self._pending) < len(GZIP_MAGIC):
+                return
+            self.gzipped = self._pending.startswith(GZIP_MAGIC)
+            chunk, self._pending = self._pending, ''
+        chunks = (self._decompressor.decompress(chunk) if self.gzipped
+                  else [chunk])
+        for chunk in chunks:
+            self._sha1.update(chunk)
+            if self.counter is None:
+                self._records += chunk.count('\n')
+            else:
+                self.counter.update(chunk)
+
+    def _flush(self):
+        # Data too short to detect compression is not compressed.
+        if self.gzipped is None and self._pending:
+            self.gzipped = False
+            pending, self._pending = self._pending, ''
+            self.update(pending)
+
+    @property
+    def checksum(self):
+        """
+        SHA1 checksum of the data fed so far.
+        """
+        self._flush()
+        return self._sha1.hexdigest()
+
+    @property
+    def records(self):
+        """
+        Number of records in the data fed so far.
+        """
+        self._flush()
+        if self.counter is not None:
+            return self.counter.records
+        return self._records
+
+
+class DigestReader(object):
+    """
+    Read-only file-like wrapper calculating a :class:`Digest` over all data
+    read through it.
+
+    This makes it possible to calculate the digest of a data source as part
+    of reading it for some other purpose, instead of in a separate pass.
+    """
+    def __init__(self, data, gzipped=False, counter=None):
+        """
+        :arg data: File-like object opened for reading.
+        :type data: file-like object
+        :kwarg gzipped: Whether or not the data is gzip-compressed, see
+            :class:`Digest`.
+        :type gzipped: bool
+        :kwarg counter: Record counter, see :class:`Digest`.
+        """
+        self.data = data
+        self._digest = Digest(gzipped=gzipped, counter=counter)
+
+    def read(self, size=-1):
+        chunk = self.data.read(size)
+        self._digest.update(chunk)
+        return chunk
+
+    def readline(self, size=-1):
+        line = self.data.readline(size)
+        self._digest.update(line)
+        return line
+
+    def __iter__(self):
+        for line in self.data:
+            self._digest.update(line)
+            yield line
+
+    def digest(self):
+        """
+        Read any remaining data and return the digest over all data.
+
+        :return: Tuple of SHA1 checksum and number of records.
+        :rtype: str, int
+        """
+        for line in self:
+            pass
+        return self._digest.checksum, self._digest.records
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PrefetchReader(object):
+    """
+    Read-only file-like wrapper reading ahead in a background thread.
+
+    The wrapped file is read in blocks by a separate thread, which puts the
+    lines in each block on a bounded queue. For gzipped files this means
+    decompression (during which zlib releases the GIL) overlaps with
+    processing the lines in the main thread.
+    """
+    def __init__(self, data, blocks=8, block_size=BLOCK_SIZE):
+        """
+        :arg data: File-like object opened for reading.
+        :type data: file-like object
+        :kwarg blocks: Maximum number of blocks to read ahead.
+        :type blocks: int
+        :kwarg block_size: Size of the blocks to read.
+        :type block_size: int
+        """
+        self.data = data
+        self.blocks = blocks
+        self.block_size = block_size
+        self._lines = collections.deque()
+        self._start()
+
+    def _start(self):
+        self._queue = Queue.Queue(self.blocks)
+        self._stopped = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stop(self):
+        self._stopped.set()
+        while self._thread.is_alive():
+            # Make room for the producer to notice it should stop.
+            try:
+                self._queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        self._thread.join()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        # Runs in the background thread. The queue gets lists of lines, or an
+        # exception tuple if reading failed, and finally `None`.
+        try:
+            partial = ''
+            while True:
+                chunk = self.data.read(self.block_size)
+                if not chunk:
+                    if partial and not self._put([partial]):
+                        return
+                    break
+                lines = io.BytesIO(partial + chunk).readlines()
+                partial = '' if lines[-1].endswith('\n') else lines.pop()
+                if lines and not self._put(lines):
+                    return
+        except Exception:
+            self._put(sys.exc_info())
+            return
+        self._put(None)
+
+    def _fill(self):
+        if self._done:
+            return False
+        item = self._queue.get()
+        if item is None:
+            self._done = True
+            return False
+        if isinstance(item, tuple):
+            self._done = True
+            raise item[0], item[1], item[2]
+        self._lines.extend(item)
+        return True
+
+    def readline(self, size=-1):
+        while not self._lines:
+            if not self._fill():
+                return ''
+        line = self._lines.popleft()
+        if 0 <= size < len(line):
+            line, rest = line[:size], line[size:]
+            self._lines.appendleft(rest)
+        return line
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            chunk = self.readline(size - length if size >= 0 else -1)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        return ''.join(chunks)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def seek(self, offset):
+        """
+        Seek to the given offset in the wrapped file.
+        """
+        self._stop()
+        self._lines.clear()
+        self.data.seek(offset)
+        self._start()
+
+    def close(self):
+        self._stop()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Pools of decompression threads by process id and number of threads.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _shared_pool(threads):
+    """
+    Get the pool of `threads` decompression threads of this process.
+
+    Pools are created on first use and shared by all readers in the process.
+    After forking (e.g., in prefork Celery workers), every process creates
+    its own pools.
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] != pid]:
+            # Inherited from the parent process, the threads don't exist in
+            # this process.
+            del _pools[key]
+        pool = _pools.get((pid, threads))
+        if pool is None:
+            pool = _pools[pid, threads] = ThreadPool(threads)
+    return pool
+
+
+def _read_bgzf_header(raw):
+    """
+    Read the header of a BGZF block from `raw` and return the total size of
+    the block and the size of the header, or `None` at the end of the file.
+    """
+    header = raw.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise IOError('Not a BGZF block')
+    extra_length, = struct.unpack('<H', header[10:12])
+    extra = raw.read(extra_length)
+    position = 0
+    while position + 4 <= len(extra):
+        subfield, length = struct.unpack('<2sH', extra[position:position + 4])
+        if subfield == 'BC' and length == 2:
+            size, = struct.unpack('<H', extra[position + 4:position + 6])
+            return size + 1, 12 + extra_length
+        position += 4 + length
+    raise IOError('Not a BGZF block')
+
+
+def _inflate(compressed, crc, size):
+    data = zlib.decompress(compressed, -zlib.MAX_WBITS)
+    if len(data) != size or zlib.crc32(data) & 0xffffffff != crc:
+        raise IOError('CRC check failed in BGZF block')
+    return data
+
+
+def is_bgzf(raw):
+    """
+    Check if a file is compressed in the BGZF format (as written by
+    ``bgzip``).
+
+    :arg raw: File-like object opened for reading in binary mode. Its
+        position is reset to the start of the file.
+    :type raw: file-like object
+
+    :rtype: bool
+    """
+    raw.seek(0)
+    try:
+        return _read_bgzf_header(raw) is not None
+    except (IOError, struct.error):
+        return False
+    finally:
+        raw.seek(0)
+
+
+class BgzfReader(object):
+    """
+    Read-only file-like object decompressing a BGZF file with a pool of
+    threads.
+
+    BGZF files consist of independently compressed blocks of at most 64
+    kilobytes, which we decompress in parallel (zlib releases the GIL) and
+    return in order. The threads are shared by all readers in the process. Offsets for :meth:`seek` and :meth:`tell` are in the
+    uncompressed data, just like with :class:`gzip.GzipFile`.
+
+    The start of every block read is recorded, so offsets in the data read
+    so far can be converted to BGZF virtual offsets, which can be used for
+    random access using :meth:`seek_virtual` later.
+    """
+    def __init__(self, raw, threads=None):
+        """
+        :arg raw: BGZF file opened for reading in binary mode.
+        :type raw: file-like object
+        :kwarg threads: Number of decompression threads (default is the
+            number of CPUs).
+        :type threads: int
+        """
+        self.raw = raw
+        threads = threads or multiprocessing.cpu_count()
+        self._pool = _shared_pool(threads)
+        self._window = 2 * threads
+
+        # Compressed and uncompressed offsets of the boundaries of all blocks
+        # seen so far. Uncompressed offsets are relative to the first block
+        # in the list, which is the first block of the file unless
+        # :meth:`seek_virtual` skipped to a block not seen before.
+        self._block_offsets = [0]
+        self._data_offsets = [0]
+        self._known_offsets = True
+
+        self._start(0)
+
+    def _start(self, block):
+        # Start reading at the given block.
+        self.raw.seek(self._block_offsets[block])
+        self._next_block = block
+        self._eof = False
+        self._pending = collections.deque()
+        self._buffer = ''
+        self._position = 0
+        self._offset = self._data_offsets[block]
+
+    def _read_block(self):
+        # Read the next block from the raw file and schedule decompression.
+        header = _read_bgzf_header(self.raw)
+        if header is None:
+            self._eof = True
+            return
+        size, header_size = header
+        rest = self.raw.read(size - header_size)
+        crc, data_size = struct.unpack('<II', rest[-8:])
+        self._add_boundary(self._next_block, size, data_size)
+        self._next_block += 1
+        self._pending.append(self._pool.apply_async(
+            _inflate, (rest[:-8], crc, data_size)))
+
+    def _add_boundary(self, block, size, data_size):
+        if block + 1 == len(self._block_offsets):
+            self._block_offsets.append(self._block_offsets[block] + size)
+            self._data_offsets.append(self._data_offsets[block] + data_size)
+
+    def _scan_block(self):
+        # Add the boundary of the next unseen block without decompressing it.
+        # The raw file position is not restored.
+        block = len(self._block_offsets) - 1
+        self.raw.seek(self._block_offsets[block])
+        header = _read_bgzf_header(self.raw)
+        if header is None:
+            return False
+        size = header[0]
+        self.raw.seek(self._block_offsets[block] + size - 4)
+        data_size, = struct.unpack('<I', self.raw.read(4))
+        self._add_boundary(block, size, data_size)
+        return True
+
+    def _fill(self):
+        while len(self._pending) < self._window and not self._eof:
+            self._read_block()
+        if not self._pending:
+            return False
+        self._buffer = self._pending.popleft().get()
+        self._position = 0
+        return True
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            if self._position >= len(self._buffer) and not self._fill():
+                break
+            end = len(self._buffer)
+            if size >= 0:
+                end = min(end, self._position + size - length)
+            chunks.append(self._buffer[self._position:end])
+            length += end - self._position
+            self._position = end
+        self._offset += length
+        return ''.join(chunks)
+
+    def readline(self, size=-1):
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            if self._position >= len(self._buffer) and not self._fill():
+                break
+            end = self._buffer.find('\n', self._position) + 1 or \
+                len(self._buffer)
+            if size >= 0:
+                end = min(end, self._position + size - length)
+            chunks.append(self._buffer[self._position:end])
+            length += end - self._position
+            self._position = end
+            if chunks[-1].endswith('\n'):
+                break
+        self._offset += length
+        return ''.join(chunks)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def _check_offsets(self):
+        if not self._known_offsets:
+            raise IOError('Offsets in the uncompressed data are unknown '
+                          'after seeking to an unread BGZF block')
+
+    def tell(self):
+        """
+        Current offset in the uncompressed data.
+        """
+        self._check_offsets()
+        return self._offset
+
+    def seek(self, offset):
+        """
+        Seek to the given offset in the uncompressed data.
+
+        Blocks before `offset` that were not read yet are skipped without
+        decompressing them.
+        """
+        self._check_offsets()
+        while self._data_offsets[-1] <= offset and self._scan_block():
+            pass
+        block = bisect.bisect_right(self._data_offsets, offset) - 1
+        self._start(block)
+        self.read(offset - self._offset)
+
+    def virtual_offset(self, offset):
+        """
+        Convert an offset in the uncompressed data read so far to a BGZF
+        virtual offset.
+
+        :arg offset: Offset in the uncompressed data.
+        :type offset: int
+
+        :return: Virtual offset, the compressed offset of the block
+            containing `offset` shifted 16 bits to the left, plus the offset
+            within the uncompressed block.
+        :rtype: int
+        """
+        self._check_offsets()
+        block = bisect.bisect_right(self._data_offsets, offset) - 1
+        if block == len(self._data_offsets) - 1 and \
+                offset > self._data_offsets[block]:
+            raise ValueError('Offset %d was not read yet' % offset)
+        return ((self._block_offsets[block] << 16) |
+                (offset - self._data_offsets[block]))
+
+    def seek_virtual(self, virtual_offset):
+        """
+        Seek to the given BGZF virtual offset.
+
+        If the block at the virtual offset was not seen yet, we go there
+        directly without scanning the blocks before it. Offsets in the
+        uncompressed data are then unknown, so :meth:`tell`, :meth:`seek` and
+        :meth:`virtual_offset` cannot be used anymore.
+        """
+        block_offset = virtual_offset >> 16
+        block = bisect.bisect_left(self._block_offsets, block_offset)
+        if (block == len(self._block_offsets) or
+            block_offset < self._block_offsets[0]):
+            self._block_offsets = [block_offset]
+            self._data_offsets = [0]
+            self._known_offsets = False
+            block = 0
+        elif self._block_offsets[block] != block_offset:
+            raise IOError('No BGZF block at offset %d' % block_offset)
+        self._start(block)
+        self.read(virtual_offset & 0xffff)
+
+    def close(self):
+        self._pending.clear()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfWriter(object):
+    """
+    Write-only file-like object compressing data in the BGZF format.
+
+    The result is a valid gzip file, consisting of many small gzip members,
+    which can be decompressed in parallel by :class:`BgzfReader`.
+    """
+    def __init__(self, raw, compresslevel=6):
+        """
+        :arg raw: File opened for writing in binary mode.
+        :type raw: file-like object
+        :kwarg compresslevel: Compression level, from 1 (fastest) to 9
+            (smallest).
+        :type compresslevel: int
+        """
+        self.raw = raw
+        self.compresslevel = compresslevel
+        self._buffer = []
+        self._buffered = 0
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        self.raw.write(BGZF_MAGIC)
+        self.raw.write(struct.pack('<IBBH2sHH', 0, 0, 0xff, 6, 'BC', 2,
+                                   len(compressed) + 25))
+        self.raw.write(compressed)
+        self.raw.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                   len(data)))
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BGZF_BLOCK_SIZE:
+            data = ''.join(self._buffer)
+            end = len(data) - len(data) % BGZF_BLOCK_SIZE
+            for start in range(0, end, BGZF_BLOCK_SIZE):
+                self._write_block(data[start:start + BGZF_BLOCK_SIZE])
+            self._buffer = [data[end:]]
+            self._buffered = len(data) - end
+
+    def close(self):
+        data = ''.join(self._buffer)
+        if data:
+            self._write_block(data)
+        # Empty block marking the end of the file.
+        self._write_block('')
+        self._buffer = []
+        self._buffered = 0
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
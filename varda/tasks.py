@@ -16,12 +16,15 @@ from __future__ import division
 from collections import Counter, defaultdict
 from contextlib import contextmanager
 import hashlib
+import heapq
 import itertools
 import os
+import tempfile
 import time
 import uuid
 
-from celery import current_task, current_app, Task
+from celery import chord, current_task, current_app, Task
+from celery.signals import task_postrun
 from celery.utils.log import get_task_logger
 from sqlalchemy import and_, or_
 from sqlalchemy.exc import IntegrityError
@@ -29,22 +32,96 @@ from sqlalchemy.orm.exc import NoResultFound
 from vcf.parser import _Info as VcfInfo, field_counts as vcf_field_counts
 import vcf
 
-from . import db, celery
+from . import bcf_reader, db, celery, timing, vcf_reader
+from .bulk import (AggregatingWriter, gvcf_rows, observation_rows,
+                   observation_staging, region_rows, region_staging,
+                   SplitWriter)
 from .models import (Annotation, Coverage, DataSource, DataUnavailable,
-                     Observation, Sample, Region, Variation, Group)
+                     Observation, Sample, Variation, Group)
 from .region_binning import all_bins
-from .utils import (calculate_frequency, digest, NoGenotypesInRecord,
-                    normalize_variant, normalize_chromosome, normalize_region,
-                    read_genotype, ReferenceMismatch)
+from .region_index import UnsortedData
+from .streams import DigestReader
+from .utils import (calculate_frequency, count_genotypes, digest,
+                    NoGenotypesInRecord, normalize_variant,
+                    normalize_variants, normalize_chromosome,
+                    normalize_region, read_genotype,
+                    ReferenceMismatch)
 
 
-# Number of records to buffer before committing to the database.
+# Number of rows to buffer before writing and committing to the database.
 DB_BUFFER_SIZE = 5000
 
+# Number of records to normalize the observations of at once.
+NORMALIZE_BATCH_SIZE = 1000
+
+# Number of regions to sort in memory before writing them to a temporary file
+# when sorting regions.
+SORT_BUFFER_SIZE = 500000
+
+# Symbolic alleles used in gVCF files for any allele not observed at a site.
+NON_REF_ALLELES = ('<NON_REF>', '<*>')
+
 
 logger = get_task_logger(__name__)
 
 
+@task_postrun.connect
+def stop_timing(**kwargs):
+    """
+    Deactivate the stage timer of a task after it has run.
+    """
+    timing.stop()
+
+
+def start_timing():
+    """
+    Activate a stage timer for the current task if the ``TASK_TIMING``
+    configuration setting is enabled.
+
+    :return: The timer, or `None` if timing is disabled.
+    :rtype: varda.timing.StageTimer
+    """
+    if current_app.conf['TASK_TIMING']:
+        return timing.start()
+    timing.stop()
+    return None
+
+
+def timing_result(timer, **result):
+    """
+    Task result, including the timing breakdown if the task is timed.
+    """
+    if timer is not None:
+        result['timing'] = timer.meta()
+    return result
+
+
+def progress_meta(percentage):
+    """
+    Task state metadata for reporting progress, including a timing breakdown
+    per stage if the task is timed (see :mod:`varda.timing`).
+    """
+    meta = {'percentage': percentage}
+    timer = timing.current()
+    if timer is not None:
+        meta['timing'] = timer.meta()
+    return meta
+
+
+def digest_options(filetype):
+    """
+    Options for calculating the digest of data in the given format (see
+    :class:`varda.streams.Digest`).
+
+    BCF data is read with or without BGZF compression. Its digest is always
+    calculated over the uncompressed data and counts BCF records instead of
+    lines, the same as for uploaded data.
+    """
+    if filetype == 'bcf':
+        return {'gzipped': None, 'counter': bcf_reader.RecordCounter()}
+    return {}
+
+
 class ReadError(Exception):
     """
     Exception thrown on failed data reading.
@@ -84,6 +161,180 @@ class CleanTask(Task):
         del self._cleanups[task_id]
 
 
+class ShardedResult(object):
+    """
+    Aggregated result of a task that divided its work in shards, imported by
+    parallel subtasks followed by a callback (see :func:`import_variation`).
+
+    Has the attributes of :class:`celery.result.AsyncResult` used for
+    monitoring a task. Until the callback has started, the task is in the
+    ``PROGRESS`` state with the average progress of the shards. After that,
+    the state and result are those of the callback.
+    """
+    def __init__(self, shards, callback):
+        """
+        :arg shards: Task ids of the shards.
+        :type shards: list(str)
+        :arg callback: Task id of the callback.
+        :type callback: str
+        """
+        self.shards = [celery.AsyncResult(shard) for shard in shards]
+        self.callback = celery.AsyncResult(callback)
+
+    def _progress(self):
+        # Shards that are not started yet are at 0 percent.
+        percentages = []
+        for shard in self.shards:
+            if shard.ready():
+                percentages.append(100)
+            elif shard.state == 'PROGRESS':
+                percentages.append(shard.info.get('percentage', 0))
+            else:
+                percentages.append(0)
+        return min(sum(percentages) // len(percentages), 99)
+
+    @property
+    def state(self):
+        if self.callback.state != 'PENDING':
+            return self.callback.state
+        # Results of finished tasks expire, in which case we don't know if
+        # the shards ever ran.
+        if all(shard.state == 'PENDING' for shard in self.shards):
+            return 'PENDING'
+        return 'PROGRESS'
+
+    @property
+    def info(self):
+        if self.callback.state != 'PENDING':
+            return self.callback.info
+        return {'percentage': self._progress()}
+
+    @property
+    def result(self):
+        return self.info
+
+    def revoke(self, terminate=False):
+        for shard in self.shards:
+            shard.revoke(terminate=terminate)
+        self.callback.revoke(terminate=terminate)
+
+
+def task_result(task, task_id):
+    """
+    Get the result of a task for monitoring it.
+
+    If the task divided its work in shards, the result aggregates the shards
+    and their callback (see :class:`ShardedResult`).
+
+    :arg task: Task.
+    :type task: celery.Task
+    :arg task_id: Task id.
+    :type task_id: str
+
+    :rtype: celery.result.AsyncResult or ShardedResult
+    """
+    result = task.AsyncResult(task_id)
+    if (result.state == 'SUCCESS' and isinstance(result.info, dict) and
+        'shards' in result.info):
+        return ShardedResult(result.info['shards'], result.info['callback'])
+    return result
+
+
+class RecordLines(object):
+    """
+    Iterator over the lines in a file, keeping track of the current line
+    number and offset and optionally skipping records outside a given range.
+
+    Header lines (starting with ``#``) are always included. Records are
+    numbered by their line number (one-based), which is comparable to what is
+    reported by :func:`varda.utils.digest`.
+    """
+    def __init__(self, lines, first_record=None, last_record=None,
+                 first_offset=None):
+        """
+        :arg lines: Open handle to a file.
+        :type lines: file-like object
+        :arg first_record: Skip records before this record.
+        :type first_record: int
+        :arg last_record: Stop reading after this record.
+        :type last_record: int
+        :arg first_offset: Offset of `first_record` in the file. If given,
+            we seek to this offset after reading the header lines instead of
+            reading the records before `first_record`.
+        :type first_offset: int
+        """
+        self.lines = lines
+        self.first_record = first_record
+        self.last_record = last_record
+        self.first_offset = first_offset
+        self.line_number = 0
+
+        #: Offset of the start of the current line.
+        self.line_offset = 0
+
+        #: Offset of the end of the current line.
+        self.offset = 0
+
+    def __iter__(self):
+        if self.first_offset is not None:
+            for line in self.lines:
+                if not line.startswith('#'):
+                    break
+                self.line_number += 1
+                self.line_offset, self.offset = (self.offset,
+                                                 self.offset + len(line))
+                yield line
+            self.lines.seek(self.first_offset)
+            self.line_number = self.first_record - 1
+            self.offset = self.first_offset
+
+        for line in self.lines:
+            self.line_number += 1
+            self.line_offset, self.offset = self.offset, self.offset + len(line)
+            if line.startswith('#'):
+                yield line
+                continue
+            if (self.first_record is not None and
+                self.line_number < self.first_record):
+                continue
+            if (self.last_record is not None and
+                self.line_number > self.last_record):
+                return
+            yield line
+
+
+class RecordPosition(object):
+    """
+    Position in :class:`RecordLines` of the record that is currently
+    processed by a reader that reads ahead.
+
+    The position is available in the same way as on :class:`RecordLines`, so
+    it can be used for a checkpoint (see :func:`save_checkpoint`) that never
+    falls after records that are read but not yet processed.
+    """
+    def __init__(self, lines):
+        """
+        :arg lines: Lines that are read ahead of processing.
+        :type lines: RecordLines
+        """
+        self.lines = lines
+        self.restore(self.mark())
+
+    def mark(self):
+        """
+        Current position of `lines`, to restore when the record that was just
+        read is processed.
+        """
+        return (self.lines.line_number, self.lines.line_offset,
+                self.lines.offset)
+
+    def restore(self, mark):
+        """
+        Set the position to a mark obtained with :meth:`mark`.
+        """
+        self.line_number, self.line_offset, self.offset = mark
+
+
 def annotate_data_source(original, annotated_variants,
                          original_filetype='vcf', **kwargs):
     """
@@ -125,7 +376,8 @@ def annotate_variants(original_variants, annotated_variants,
     :type global_frequency: bool
     :arg sample_frequency: List of samples to compute frequencies for.
     :type sample_frequency: list of Sample
-    :arg original_records: Number of records in original variants file.
+    :arg original_records: Number of records in original variants file. Can
+        be `None` if it is unknown, in which case no progress is reported.
     :type original_records: int
     :arg exclude_checksum: Checksum of data source(s) to exclude variation
         from.
@@ -273,15 +525,17 @@ def annotate_variants(original_variants, annotated_variants,
     current_record = len(reader._header_lines) + 1
 
     old_percentage = -1
-    for record in reader:
+    for record in timing.timed_iter('parse', reader, count=True):
         current_record += 1
-        percentage = min(int(current_record / original_records * 100), 99)
+        # Without the number of records, no progress is reported.
+        percentage = (min(int(current_record / original_records * 100), 99)
+                      if original_records else old_percentage)
         if percentage > old_percentage:
             # Todo: Task state updating should be defined in the task itself,
             #     perhaps we can give values using a callback.
             try:
                 current_task.update_state(state='PROGRESS',
-                                          meta={'percentage': percentage})
+                                          meta=progress_meta(percentage))
             except AttributeError:
                 # Hack for the unit tests were whe call this not from within
                 # a task.
@@ -353,7 +607,8 @@ def annotate_variants(original_variants, annotated_variants,
             record.add_info(q_name + "_VF_HET", q_result[1]['heterozygous'])
             record.add_info(q_name + "_VF_HOM", q_result[1]['homozygous'])
 
-        writer.write_record(record)
+        with timing.stage('output'):
+            writer.write_record(record)
 
 
 def annotate_regions(original_regions, annotated_variants,
@@ -378,7 +633,8 @@ def annotate_regions(original_regions, annotated_variants,
     :type global_frequency: bool
     :arg sample_frequency: List of samples to compute frequencies for.
     :type sample_frequency: list of Sample
-    :arg original_records: Number of records in original regions file.
+    :arg original_records: Number of records in original regions file. Can
+        be `None` if it is unknown, in which case no progress is reported.
     :type original_records: int
     :arg exclude_checksum: Checksum of data source(s) to exclude variation
         from.
@@ -554,14 +810,18 @@ def annotate_regions(original_regions, annotated_variants,
     annotated_variants.write('#' + '\t'.join(header_fields) + '\n')
 
     old_percentage = -1
-    for current_record, chromosome, begin, end in read_regions(original_regions):
-        percentage = min(int(current_record / original_records * 100), 99)
+    regions = timing.timed_iter('parse', read_regions(original_regions),
+                                count=True)
+    for current_record, chromosome, begin, end in regions:
+        # Without the number of records, no progress is reported.
+        percentage = (min(int(current_record / original_records * 100), 99)
+                      if original_records else old_percentage)
         if percentage > old_percentage:
             # Todo: Task state updating should be defined in the task itself,
             #     perhaps we can give values using a callback.
             try:
                 current_task.update_state(state='PROGRESS',
-                                          meta={'percentage': percentage})
+                                          meta=progress_meta(percentage))
             except AttributeError:
                 # Hack for the unit tests were whe call this not from within
                 # a task.
@@ -596,7 +856,7 @@ def annotate_regions(original_regions, annotated_variants,
                                              Observation.observed,
                                              Observation.id)
 
-        for observation in observations:
+        for observation in timing.timed_iter('query', observations):
             fields = [observation.chromosome, observation.position,
                       observation.reference, observation.observed]
 
@@ -663,17 +923,25 @@ def annotate_regions(original_regions, annotated_variants,
 
 
             # Todo: Stringify per value, not in one sweep.
-            annotated_variants.write('\t'.join(str(f) for f in fields) + '\n')
+            with timing.stage('output'):
+                annotated_variants.write(
+                    '\t'.join(str(f) for f in fields) + '\n')
 
 
 def read_observations(observations, filetype='vcf', skip_filtered=True,
-                      use_genotypes=True, prefer_genotype_likelihoods=False):
+                      use_genotypes=True, prefer_genotype_likelihoods=False,
+                      first_record=None, last_record=None, position=None):
     """
     Read variant observations from a file and yield them one by one.
 
-    :arg observations: Open handle to a file with variant observations.
+    Records are read in batches of :data:`NORMALIZE_BATCH_SIZE`, so the
+    observed alleles in a batch can be normalized at once (see
+    :func:`varda.utils.normalize_variants`).
+
+    :arg observations: Open handle to a file with variant observations,
+        optionally wrapped in :class:`RecordLines` (only for VCF).
     :type observations: file-like object
-    :kwarg filetype: Filetype (currently only ``vcf`` allowed).
+    :kwarg filetype: Filetype (``vcf`` or ``bcf``).
     :type filetype: str
     :kwarg skip_filtered: Whether or not to skip variants annotated as being
         filtered.
@@ -683,14 +951,44 @@ def read_observations(observations, filetype='vcf', skip_filtered=True,
     :kwarg prefer_genotype_likelihoods: Whether or not to prefer deriving
         genotypes from likelihoods (if available).
     :type prefer_genotype_likelihoods: bool
+    :kwarg first_record: Skip records before this record (one-based line
+        number). Ignored if `observations` is a :class:`RecordLines` and for
+        BCF.
+    :type first_record: int
+    :kwarg last_record: Stop reading after this record (one-based line
+        number). Ignored if `observations` is a :class:`RecordLines` and for
+        BCF.
+    :type last_record: int
+    :kwarg position: If given, this is updated to the position of the record
+        that observations are yielded for. Only for VCF, where `observations`
+        must be the :class:`RecordLines` the position is for.
+    :type position: RecordPosition
 
     :return: Generator yielding tuples (current_record, chromosome, position,
-        reference, observed, zygosity, support).
+        reference, observed, zygosity, support). For BCF, records are
+        numbered by their one-based position in the file.
     """
-    if filetype != 'vcf':
-        raise ReadError('Data must be in VCF format')
+    if filetype not in ('vcf', 'bcf'):
+        raise ReadError('Data must be in VCF or BCF format')
 
-    reader = vcf.Reader(observations)
+    if filetype == 'bcf':
+        try:
+            reader = bcf_reader.Reader(observations)
+        except bcf_reader.InvalidBCF as e:
+            raise ReadError(str(e))
+        records = reader
+    else:
+        # Records outside the requested range are skipped before they are
+        # parsed.
+        if isinstance(observations, RecordLines):
+            lines = observations
+        else:
+            lines = RecordLines(observations, first_record=first_record,
+                                last_record=last_record)
+        if current_app.conf['VCF_READER'] == 'pyvcf':
+            records = vcf.Reader(lines)
+        else:
+            records = vcf_reader.Reader(lines)
 
     # Todo: We could do an educated guess for optimal import parameters based
     #     on the contents of the VCF file. For example, with samtools VCF
@@ -704,54 +1002,129 @@ def read_observations(observations, filetype='vcf', skip_filtered=True,
     #
     #     [1] http://www.biostars.org/p/12354/
 
-    # Number of lines read (i.e. comparable to what is reported by
-    # ``varda.utils.digest``).
-    current_record = len(reader._header_lines) + 1
+    def batches():
+        # Only the fields we need are kept for records in a batch, not the
+        # (possibly large) records themselves.
+        batch = []
+        # Records are parsed (VCF) or decoded (BCF) lazily, so malformed
+        # data can be found when reading any of their values.
+        try:
+            for record in records:
+                # Number of lines read (i.e. comparable to what is reported by
+                # ``varda.utils.digest``), or number of BCF records read.
+                current_record = (reader.record_number if filetype == 'bcf'
+                                  else lines.line_number)
 
-    for record in reader:
-        current_record += 1
+                if skip_filtered and record.FILTER:
+                    continue
 
-        if skip_filtered and record.FILTER:
-            continue
+                if 'SV' in record.INFO:
+                    # For now we ignore these, reference is likely to be larger
+                    # than the maximum of 200 by the database schema.
+                    # Example use of this type are large deletions in 1000
+                    # Genomes.
+                    continue
 
-        if 'SV' in record.INFO:
-            # For now we ignore these, reference is likely to be larger than
-            # the maximum of 200 by the database schema.
-            # Example use of this type are large deletions in 1000 Genomes.
-            continue
+                mark = position.mark() if position is not None else None
+                batch.append((current_record, mark, record_alleles(
+                    record, use_genotypes=use_genotypes,
+                    prefer_genotype_likelihoods=prefer_genotype_likelihoods)))
+                if len(batch) >= NORMALIZE_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        except (IndexError, ValueError) as e:
+            # This includes bcf_reader.InvalidBCF.
+            raise ReadError(str(e))
+
+    for batch in batches():
+        normalized = normalize_observations([alleles for _, _, alleles
+                                             in batch])
+        for (current_record, mark, _), observations in zip(batch,
+                                                             normalized):
+            if position is not None:
+                position.restore(mark)
+            for observation in observations:
+                yield (current_record,) + observation
+
+    if position is not None:
+        position.restore(position.mark())
+
+
+def read_record_observations(record, use_genotypes=True,
+                             prefer_genotype_likelihoods=False):
+    """
+    Read variant observations from a VCF or BCF record.
 
-        # For each ALT, store sample count per zygosity (het, hom, or unkown).
-        # For a diploid chromosome, the result will be something like:
-        #
-        #     # - first alt: 327 het, 7 unknown
-        #     # - second alt: 73 het
-        #     # - third alt: 154 hom, 561 het
-        #     alt_support =
-        #         [{'heterozygous': 327, None: 7},
-        #          {'heterozygous': 73},
-        #          {'homozygous': 154, 'heterozygous': 561}]
-        #
-        # The None value is used for the unknown genotype.
-        alt_support = [Counter() for _ in record.ALT]
+    :arg record: Record to read observations from.
+    :type record: vcf.model._Record
+    :kwarg use_genotypes: Whether or not to use genotypes (if available).
+    :type use_genotypes: bool
+    :kwarg prefer_genotype_likelihoods: Whether or not to prefer deriving
+        genotypes from likelihoods (if available).
+    :type prefer_genotype_likelihoods: bool
+
+    :return: List of tuples (chromosome, position, reference, observed,
+        zygosity, support).
+    """
+    return normalize_observations([record_alleles(
+        record, use_genotypes=use_genotypes,
+        prefer_genotype_likelihoods=prefer_genotype_likelihoods)])[0]
 
-        # Todo: Use constants for zygosity, re-use them for a database enum.
 
-        # In the case where we don't have genotypes or don't want to use them,
-        # we look for a GTC (genotype counts) field containing, well, a count
-        # for each genotype.
-        # Our last resort is to just count the number of samples and store an
-        # unknown zygosity. But only if there is exactly one ALT.
+def record_alleles(record, use_genotypes=True,
+                   prefer_genotype_likelihoods=False):
+    """
+    Read the alleles observed in a VCF or BCF record with their support.
 
-        if use_genotypes and record.samples:
-            for call in record.samples:
-                try:
-                    genotype = read_genotype(call, prefer_genotype_likelihoods)
-                except NoGenotypesInRecord:
-                    # Exception will be raised for all calls in this record,
-                    # so we can define the aggregate result and break.
-                    if len(record.ALT) == 1:
-                        alt_support = [{None: len(record.samples)}]
-                    break
+    :arg record: Record to read alleles from.
+    :type record: vcf.model._Record
+    :kwarg use_genotypes: Whether or not to use genotypes (if available).
+    :type use_genotypes: bool
+    :kwarg prefer_genotype_likelihoods: Whether or not to prefer deriving
+        genotypes from likelihoods (if available).
+    :type prefer_genotype_likelihoods: bool
+
+    :return: Tuple (chromosome, position, reference, alleles) where
+        `alleles` is a list of tuples (observed, support) and `support` is a
+        dictionary with the number of samples per zygosity.
+    """
+    # For each ALT, store sample count per zygosity (het, hom, or unkown).
+    # For a diploid chromosome, the result will be something like:
+    #
+    #     # - first alt: 327 het, 7 unknown
+    #     # - second alt: 73 het
+    #     # - third alt: 154 hom, 561 het
+    #     alt_support =
+    #         [{'heterozygous': 327, None: 7},
+    #          {'heterozygous': 73},
+    #          {'homozygous': 154, 'heterozygous': 561}]
+    #
+    # The None value is used for the unknown genotype.
+    alt_support = [Counter() for _ in record.ALT]
+
+    # Todo: Use constants for zygosity, re-use them for a database enum.
+
+    # In the case where we don't have genotypes or don't want to use them,
+    # we look for a GTC (genotype counts) field containing, well, a count
+    # for each genotype.
+    # Our last resort is to just count the number of samples and store an
+    # unknown zygosity. But only if there is exactly one ALT.
+
+    if use_genotypes and record.samples:
+        try:
+            # Vectorized counting over all samples at once, if possible.
+            genotype_counts = count_genotypes(record,
+                                              prefer_genotype_likelihoods)
+            if genotype_counts is not None:
+                alt_support = genotype_counts
+                calls = []
+            else:
+                calls = record.samples
+
+            for call in calls:
+                genotype = read_genotype(call, prefer_genotype_likelihoods)
 
                 if genotype:
                     counts = Counter(a for a in genotype)
@@ -763,72 +1136,132 @@ def read_observations(observations, filetype='vcf', skip_filtered=True,
                     for index, count in counts.items():
                         if index > 0:
                             alt_support[index - 1][zygosity] += 1
-
-        elif 'GTC' in record.INFO:
-            # All possible genotypes given alleles and call ploidy. Example
-            # (diploid, two alt alleles):
-            #
-            #     genotypes = [(0, 0), (0, 1), (1, 1), (0, 2), (1, 2), (2, 2)]
-            #
-            # Todo: Make a function out of this, it is also used in the
-            #     read_genotype function.
-            # Todo: We could deduce ploidy from len(record.ALT) and
-            #     len(record.INFO['GTC'] but for now we don't bother.
-            ploidy = 2
-            genotypes = sorted(itertools.combinations_with_replacement(
-                                 range(len(record.ALT) + 1), ploidy),
-                               key=lambda g: g[::-1])
-
-            for genotype, sample_count in zip(genotypes, record.INFO['GTC']):
-                if sample_count < 1:
-                    continue
-                counts = Counter(a for a in genotype)
-                if len(counts) > 1:
-                    zygosity = 'heterozygous'
-                else:
-                    zygosity = 'homozygous'
-                for index, count in counts.items():
-                    if index > 0:
-                        alt_support[index - 1][zygosity] += sample_count
-
-        elif len(record.ALT) == 1:
-            if record.samples is None:
-                alt_support = [{None: 1}]
-            else:
+        except NoGenotypesInRecord:
+            # Exception will be raised for all calls in this record, so
+            # we can define the aggregate result.
+            if len(record.ALT) == 1:
                 alt_support = [{None: len(record.samples)}]
 
-        for index, allele in enumerate(record.ALT):
-            try:
-                chromosome, position, reference, observed = normalize_variant(
-                    record.CHROM, record.POS, record.REF, str(allele))
-            except ReferenceMismatch as e:
-                logger.info('Reference mismatch: %s', str(e))
-                if current_app.conf['REFERENCE_MISMATCH_ABORT']:
-                    raise ReadError(str(e))
+    elif 'GTC' in record.INFO:
+        # All possible genotypes given alleles and call ploidy. Example
+        # (diploid, two alt alleles):
+        #
+        #     genotypes = [(0, 0), (0, 1), (1, 1), (0, 2), (1, 2), (2, 2)]
+        #
+        # Todo: Make a function out of this, it is also used in the
+        #     read_genotype function.
+        # Todo: We could deduce ploidy from len(record.ALT) and
+        #     len(record.INFO['GTC'] but for now we don't bother.
+        ploidy = 2
+        genotypes = sorted(itertools.combinations_with_replacement(
+                             range(len(record.ALT) + 1), ploidy),
+                           key=lambda g: g[::-1])
+
+        for genotype, sample_count in zip(genotypes, record.INFO['GTC']):
+            if sample_count < 1:
                 continue
+            counts = Counter(a for a in genotype)
+            if len(counts) > 1:
+                zygosity = 'heterozygous'
+            else:
+                zygosity = 'homozygous'
+            for index, count in counts.items():
+                if index > 0:
+                    alt_support[index - 1][zygosity] += sample_count
+
+    elif len(record.ALT) == 1:
+        if record.samples is None:
+            alt_support = [{None: 1}]
+        else:
+            alt_support = [{None: len(record.samples)}]
+
+    return record.CHROM, record.POS, record.REF, [
+        (str(allele), support) for allele, support
+        in zip(record.ALT, alt_support) if str(allele) not in NON_REF_ALLELES]
+
+
+def normalize_observations(records):
+    """
+    Normalize the alleles observed in a batch of records.
+
+    :arg records: Alleles per record as returned by :func:`record_alleles`.
+    :type records: list(tuple)
+
+    :return: For each record, a list of tuples (chromosome, position,
+        reference, observed, zygosity, support).
+    :rtype: list(list(tuple))
+    """
+    variants = []
+    supports = []
+    for i, (chromosome, position, reference, alleles) in enumerate(records):
+        for observed, support in alleles:
+            variants.append((chromosome, position, reference, observed))
+            supports.append((i, support))
+
+    observations = [[] for _ in records]
+    for (i, support), (variant, error) in zip(supports,
+                                              normalize_variants(variants)):
+        if error is not None:
+            logger.info('Reference mismatch: %s', str(error))
+            if current_app.conf['REFERENCE_MISMATCH_ABORT']:
+                raise ReadError(str(error))
+            continue
+        chromosome, position, reference, observed = variant
+
+        # Todo: Ignore or abort?
+        if len(reference) > 200 or len(observed) > 200:
+            continue
+
+        for zygosity, count in support.items():
+            observations[i].append((chromosome, position, reference,
+                                    observed, zygosity, count))
+    return observations
 
-            # Todo: Ignore or abort?
-            if len(reference) > 200 or len(observed) > 200:
-                continue
 
-            for zygosity, support in alt_support[index].items():
-                yield (current_record, chromosome, position, reference,
-                       observed, zygosity, support)
+def read_regions(regions, filetype='bed', min_depth=None):
+    """
+    Read regions from a file and yield them one by one.
+
+    For ``bedgraph`` files, the value of each record is the sequencing
+    depth and only records with at least `min_depth` are yielded. Together
+    with :class:`MergedRegions`, this converts a (per-base) depth track to
+    covered regions on the fly.
 
+    :arg regions: Open handle to a file with regions, optionally wrapped in
+        :class:`RecordLines`.
+    :type regions: file-like object
+    :kwarg filetype: Filetype (``bed`` or ``bedgraph``).
+    :type filetype: str
+    :kwarg min_depth: Minimum depth of a region (only for ``bedgraph``).
+    :type min_depth: float
+
+    :return: Generator yielding tuples (current_record, chromosome, begin,
+        end).
+    """
+    if filetype not in ('bed', 'bedgraph'):
+        raise ReadError('Data must be in BED or bedGraph format')
 
-def read_regions(regions, filetype='bed'):
-    if filetype != 'bed':
-        raise ReadError('Data must be in BED format')
+    if isinstance(regions, RecordLines):
+        lines = regions
+    else:
+        lines = RecordLines(regions)
 
-    for current_record, line in enumerate(regions):
+    for line in lines:
+        # Records are numbered zero-based here.
+        current_record = lines.line_number - 1
         fields = line.split()
-        if len(fields) < 1 or fields[0] == 'track':
+        if len(fields) < 1 or fields[0] in ('track', 'browser'):
             continue
         try:
+            if (filetype == 'bedgraph' and min_depth is not None and
+                float(fields[3]) < min_depth):
+                continue
             chromosome, begin, end = normalize_region(
                 fields[0], int(fields[1]), int(fields[2]))
         except (IndexError, ValueError):
-            raise ReadError('Invalid line in BED file: "%s"' % line)
+            raise ReadError('Invalid line in %s file: "%s"' %
+                            ('bedGraph' if filetype == 'bedgraph' else 'BED',
+                             line))
         except ReferenceMismatch as e:
             logger.info('Reference mismatch: %s', str(e))
             if current_app.conf['REFERENCE_MISMATCH_ABORT']:
@@ -839,6 +1272,581 @@ def read_regions(regions, filetype='bed'):
         yield current_record, chromosome, begin + 1, end
 
 
+class MergedRegions(object):
+    """
+    Iterator merging overlapping and adjacent regions.
+
+    Regions must be sorted by position and have all regions on a chromosome
+    together (see :func:`sort_regions` for unsorted regions). Merged regions
+    are yielded as soon as the next region does not touch them, so only one
+    region is held in memory.
+
+    If the regions are read from :class:`RecordLines`, the position of the
+    first record of the last yielded region is available in the same way as
+    on :class:`RecordLines`, so a checkpoint (see :func:`save_checkpoint`)
+    never falls inside a region that is not yet written.
+    """
+    def __init__(self, regions, lines=None):
+        """
+        :arg regions: Regions as yielded by :func:`read_regions`.
+        :type regions: iterator(tuple)
+        :arg lines: Lines the regions are read from.
+        :type lines: RecordLines
+        """
+        self.regions = regions
+        self.lines = lines
+        self.line_number = 0
+        self.line_offset = 0
+
+        #: Number of regions merged into another region.
+        self.merged = 0
+
+    @property
+    def offset(self):
+        return self.lines.offset
+
+    def __iter__(self):
+        chromosomes = set()
+        region = None
+        start = None
+
+        for record, chromosome, begin, end in self.regions:
+            if self.lines is not None:
+                position = self.lines.line_number, self.lines.line_offset
+            else:
+                position = None
+
+            if region is not None and region[1] == chromosome:
+                if begin < region[2]:
+                    raise UnsortedData('Regions on chromosome "%s" are not '
+                                       'sorted by position' % chromosome)
+                if begin <= region[3] + 1:
+                    region[0] = record
+                    region[3] = max(region[3], end)
+                    self.merged += 1
+                    continue
+            elif chromosome in chromosomes:
+                raise UnsortedData('Regions on chromosome "%s" are not '
+                                   'together' % chromosome)
+
+            if region is not None:
+                if start is not None:
+                    self.line_number, self.line_offset = start
+                yield tuple(region)
+            chromosomes.add(chromosome)
+            region = [record, chromosome, begin, end]
+            start = position
+
+        if region is not None:
+            if start is not None:
+                self.line_number, self.line_offset = start
+            yield tuple(region)
+        if self.lines is not None:
+            self.line_number = self.lines.line_number
+
+
+def sort_regions(regions, buffer_size=SORT_BUFFER_SIZE):
+    """
+    Sort regions by chromosome and position.
+
+    Regions are sorted in memory in chunks of `buffer_size`, which are
+    written to temporary files and merged.
+
+    :arg regions: Regions as yielded by :func:`read_regions`.
+    :type regions: iterator(tuple)
+    :kwarg buffer_size: Number of regions to sort in memory.
+    :type buffer_size: int
+
+    :return: Generator yielding the regions in sorted order.
+    """
+    def spill(chunk):
+        chunk.sort()
+        handle = tempfile.TemporaryFile()
+        for region in chunk:
+            handle.write('%s\t%d\t%d\t%d\n' % region)
+        handle.seek(0)
+        return handle
+
+    def unspill(handle):
+        for line in handle:
+            chromosome, begin, end, record = line.rstrip('\n').split('\t')
+            yield chromosome, int(begin), int(end), int(record)
+
+    handles = []
+    chunk = []
+    try:
+        for record, chromosome, begin, end in regions:
+            chunk.append((chromosome, begin, end, record))
+            if len(chunk) >= buffer_size:
+                handles.append(spill(chunk))
+                chunk = []
+
+        if handles:
+            if chunk:
+                handles.append(spill(chunk))
+            sorted_regions = heapq.merge(*[unspill(handle)
+                                           for handle in handles])
+        else:
+            chunk.sort()
+            sorted_regions = chunk
+
+        for chromosome, begin, end, record in sorted_regions:
+            yield record, chromosome, begin, end
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def read_gvcf(gvcf, skip_filtered=True, use_genotypes=True,
+              prefer_genotype_likelihoods=False, min_gq=None, min_dp=None):
+    """
+    Read variant observations and covered regions from a gVCF file in one
+    pass and yield them one by one.
+
+    Variant records are read as observations (see :func:`read_observations`)
+    and are also considered covered. Reference blocks (records without
+    observed alleles) are considered covered if all samples pass the given
+    thresholds.
+
+    Adjacent and overlapping regions are merged, so the regions are only as
+    fragmented as the coverage itself. The file must be sorted by position.
+
+    :arg gvcf: Open handle to a gVCF file, optionally wrapped in
+        :class:`RecordLines`.
+    :type gvcf: file-like object
+    :kwarg skip_filtered: Whether or not to skip records annotated as being
+        filtered.
+    :type skip_filtered: bool
+    :kwarg use_genotypes: Whether or not to use genotypes (if available).
+    :type use_genotypes: bool
+    :kwarg prefer_genotype_likelihoods: Whether or not to prefer deriving
+        genotypes from likelihoods (if available).
+    :type prefer_genotype_likelihoods: bool
+    :kwarg min_gq: Minimum genotype quality (GQ) for a reference block to be
+        covered.
+    :type min_gq: int
+    :kwarg min_dp: Minimum depth (MIN_DP, or DP if not available) for a
+        reference block to be covered.
+    :type min_dp: int
+
+    :return: Generator yielding tuples (kind, item) where kind is either
+        ``observation`` or ``region``. Observations are tuples as yielded by
+        :func:`read_observations` and regions are tuples as yielded by
+        :func:`read_regions` (but with one-based record numbers).
+    """
+    if isinstance(gvcf, RecordLines):
+        lines = gvcf
+    else:
+        lines = RecordLines(gvcf)
+
+    if current_app.conf['VCF_READER'] == 'pyvcf':
+        records = vcf.Reader(lines)
+    else:
+        records = vcf_reader.Reader(lines)
+
+    def passes(call, key, threshold):
+        try:
+            value = getattr(call.data, key)
+        except AttributeError:
+            # The field is not present in the record.
+            return True
+        return value is not None and value >= threshold
+
+    def covered(record):
+        for call in record.samples:
+            if min_gq is not None and not passes(call, 'GQ', min_gq):
+                return False
+            if min_dp is not None and not passes(
+                    call, 'MIN_DP' if 'MIN_DP' in record.FORMAT.split(':')
+                    else 'DP', min_dp):
+                return False
+        return True
+
+    # Region that might still be extended by the next record, as a list
+    # (record, chromosome, begin, end).
+    region = None
+
+    for record in records:
+        current_record = lines.line_number
+
+        if skip_filtered and record.FILTER:
+            continue
+
+        if all(allele is None or str(allele) in NON_REF_ALLELES
+               for allele in record.ALT):
+            # Reference block.
+            if not covered(record):
+                continue
+            end = record.INFO.get('END', record.POS)
+            if isinstance(end, list):
+                end = end[0]
+            observations = []
+        else:
+            if 'SV' in record.INFO:
+                # See read_observations.
+                continue
+            end = record.POS + max(1, len(record.REF)) - 1
+            observations = read_record_observations(
+                record, use_genotypes=use_genotypes,
+                prefer_genotype_likelihoods=prefer_genotype_likelihoods)
+
+        try:
+            chromosome, begin, end = normalize_region(record.CHROM,
+                                                      record.POS, end)
+        except ReferenceMismatch as e:
+            logger.info('Reference mismatch: %s', str(e))
+            if current_app.conf['REFERENCE_MISMATCH_ABORT']:
+                raise ReadError(str(e))
+            continue
+
+        if (region is not None and region[1] == chromosome and
+            begin <= region[3] + 1):
+            region[0] = current_record
+            region[3] = max(region[3], end)
+        else:
+            if region is not None:
+                yield 'region', tuple(region)
+            region = [current_record, chromosome, begin, end]
+
+        for observation in observations:
+            yield 'observation', (current_record,) + observation
+
+    if region is not None:
+        yield 'region', tuple(region)
+
+
+def write_rows(writer, rows, records, checkpoint=None, first_record=1):
+    """
+    Write rows to the database in batches, committing after each batch.
+
+    Batches end on record boundaries, i.e., all rows read from a record are
+    committed in the same batch.
+
+    :arg writer: Writer for the destination table, see :mod:`varda.bulk`.
+    :type writer: varda.bulk.BulkWriter
+    :arg rows: Tuples `(record, row)` where `record` is the number of the
+        record in the data source the row was read from.
+    :type rows: iterator(tuple)
+    :arg records: Number of records in the data source. Can be `None` if it
+        is not yet calculated, in which case no progress is reported.
+    :type records: int
+    :kwarg checkpoint: Called before each commit with argument `True` if all
+        rows are written and `False` otherwise. In the latter case, the first
+        row of the next batch is read already.
+    :type checkpoint: function
+    :kwarg first_record: Number of the first record, progress is reported
+        relative to this record (e.g., when importing a shard, `records` is
+        the number of records in the shard).
+    :type first_record: int
+
+    :return: Number of rows written.
+    :rtype: int
+    """
+    def report_progress(rows):
+        old_percentage = -1
+        for record, row in rows:
+            if not records:
+                yield record, row
+                continue
+            # Task progress is updated in whole percentages, so for a maximum
+            # of 100 times per task.
+            percentage = min(int((record - first_record + 1) / records * 100),
+                             99)
+            if percentage > old_percentage:
+                current_task.update_state(state='PROGRESS',
+                                          meta=progress_meta(percentage))
+                old_percentage = percentage
+            yield record, row
+
+    # Reading rows is lazy, so time spent in the writer pulling rows is
+    # attributed to parsing (or to a more specific stage further down the
+    # pipeline).
+    rows = timing.timed_iter('parse', report_progress(rows), count=True)
+    pending = []
+
+    def batch():
+        # Rows are passed to the writer lazily, so a streaming writer does not
+        # have to hold them in memory. The first row after the batch is kept
+        # in `pending`.
+        count = 0
+        previous_record = None
+        while True:
+            if pending:
+                record, row = pending.pop()
+            else:
+                try:
+                    record, row = next(rows)
+                except StopIteration:
+                    return
+            if count >= DB_BUFFER_SIZE and record != previous_record:
+                pending.append((record, row))
+                return
+            previous_record = record
+            count += 1
+            yield row
+
+    written = 0
+    while True:
+        with timing.stage('write'):
+            written += writer.write(batch())
+            if checkpoint is not None:
+                checkpoint(not pending)
+            db.session.commit()
+        if not pending:
+            return written
+
+
+def variation_shards(data_source, sharding):
+    """
+    Split a data source with variation into shards to be imported in
+    parallel.
+
+    :arg data_source: Data source to split.
+    :type data_source: DataSource
+    :arg sharding: Split by ``chromosome`` or by fixed ranges of ``records``
+        (of size given by the `IMPORT_SHARD_RECORDS` configuration setting).
+    :type sharding: str
+
+    :return: List of tuples `(first_record, last_record, first_offset)`
+        defining the shards, records are numbered by their one-based line
+        number and `first_offset` is the offset of `first_record` in the
+        (uncompressed) data.
+    :rtype: list(tuple(int, int, int))
+    """
+    if sharding not in ('records', 'chromosome'):
+        raise ValueError('Unknown sharding: %s' % sharding)
+
+    try:
+        # If the data can be indexed, the index has the offset of the first
+        # record on each chromosome.
+        if sharding == 'chromosome':
+            index = data_source.index()
+            if index is not None:
+                return [(first_record, last_record, offset) for
+                        _, first_record, last_record, offset, _
+                        in index.chromosomes]
+    except DataUnavailable as e:
+        raise TaskError(e.code, e.message)
+
+    # Shards are found in a single pass over the data, recording the offset
+    # of the first record of each shard so the shards can seek to it instead
+    # of reading all data before it.
+    size = current_app.conf['IMPORT_SHARD_RECORDS']
+    shards = []
+    chromosome = None
+    try:
+        data = data_source.data()
+    except DataUnavailable as e:
+        raise TaskError(e.code, e.message)
+    with data as handle:
+        lines = RecordLines(handle)
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            if sharding == 'records':
+                new_shard = (not shards or
+                             lines.line_number - shards[-1][0] >= size)
+            else:
+                current = line.split('\t', 1)[0]
+                new_shard = current != chromosome
+                chromosome = current
+            if new_shard:
+                shards.append([lines.line_number, lines.line_number,
+                               lines.line_offset])
+            else:
+                shards[-1][1] = lines.line_number
+    return [tuple(shard) for shard in shards]
+
+
+def observation_order():
+    """
+    Columns to sort observations by when they are published, according to
+    the `IMPORT_SORT_OBSERVATIONS` configuration setting.
+
+    :return: Column names, or `None` if observations are not sorted.
+    :rtype: tuple(str)
+    """
+    if current_app.conf['IMPORT_SORT_OBSERVATIONS']:
+        return 'chromosome', 'position'
+    return None
+
+
+def save_checkpoint(instance, lines):
+    """
+    Create a checkpoint function for :func:`write_rows` storing the position
+    of an import in `instance`.
+
+    :arg instance: Variation or coverage that is imported.
+    :type instance: Variation or Coverage
+    :arg lines: Lines the imported rows are read from.
+    :type lines: RecordLines
+
+    :return: Checkpoint function.
+    :rtype: function
+    """
+    def checkpoint(done):
+        # The checkpoint is committed in the same transaction as the rows, so
+        # the rows in the database always match the records up to it.
+        if done:
+            instance.checkpoint_record = lines.line_number
+            instance.checkpoint_offset = lines.offset
+        else:
+            # The first record of the next batch is read already.
+            instance.checkpoint_record = lines.line_number - 1
+            instance.checkpoint_offset = lines.line_offset
+    return checkpoint
+
+
+def clear_checkpoint(instance):
+    """
+    Remove the checkpoint of an import.
+
+    :arg instance: Variation or coverage that is imported.
+    :type instance: Variation or Coverage
+    """
+    instance.checkpoint_record = None
+    instance.checkpoint_offset = None
+
+
+def import_observations(variation, staging, first_record=None,
+                        last_record=None, first_offset=None, checkpoint=False,
+                        coverage=None, coverage_staging=None):
+    """
+    Read observations from the data source of a variation and write them to
+    a staging table.
+
+    For gVCF data sources, regions for `coverage` are read in the same pass
+    and written to `coverage_staging`.
+
+    :arg variation: Variation to import observations for.
+    :type variation: Variation
+    :arg staging: Staging table to write the observations to.
+    :type staging: varda.bulk.StagingTable
+    :kwarg first_record: Skip records before this record.
+    :type first_record: int
+    :kwarg last_record: Stop reading after this record.
+    :type last_record: int
+    :kwarg first_offset: Offset of `first_record` in the data. If not given,
+        it is looked up in the data source index (if any).
+    :type first_offset: int
+    :kwarg checkpoint: Whether or not to resume the import from the
+        checkpoint stored in `variation` (if any) and store a checkpoint
+        after each batch.
+    :type checkpoint: bool
+    :kwarg coverage: Coverage to import regions for (only for gVCF). If
+        `None`, no regions are imported.
+    :type coverage: Coverage
+    :kwarg coverage_staging: Staging table to write the regions to.
+    :type coverage_staging: varda.bulk.StagingTable
+
+    :return: Tuple of the number of observations (and regions) imported and
+        the number of observations aggregated into another observation.
+    :rtype: tuple(int, int)
+    """
+    data_source = variation.data_source
+
+    # Without a digest, the data is read through a DigestReader which does
+    # not support seeking.
+    if not data_source.checksum:
+        first_offset = None
+    shard_start = first_record or 1
+    if checkpoint and variation.checkpoint_record is not None:
+        first_record = variation.checkpoint_record + 1
+        first_offset = variation.checkpoint_offset
+    elif (first_record is not None and first_offset is None and
+          data_source.checksum):
+        index = data_source.index(build=False)
+        if index is not None:
+            first_offset = index.record_offset(first_record)
+
+    # The data is opened right before reading it, so its decompression
+    # threads are not left running if anything fails before that.
+    try:
+        data = data_source.data()
+    except DataUnavailable as e:
+        raise TaskError(e.code, e.message)
+
+    # If the digest is not yet known, calculate it while reading the data so
+    # we don't have to read it twice.
+    if not data_source.checksum:
+        data = DigestReader(data, **digest_options(data_source.filetype))
+
+    # Observations are written in batches directly on the staging table,
+    # bypassing the ORM. Constructing an Observation instance for every row
+    # and flushing them from the session is slow and its memory usage keeps
+    # growing with the size of the import (tested with psycopg2 2.4.5 and
+    # SQLAlchemy 0.7.8), even with session.expire_all() or
+    # session.expunge_all() calls.
+    #
+    # Since every batch is committed, a simple session.rollback() is not
+    # enough to undo a failed import. Therefore we use the CleanTask base
+    # class to register a cleanup handler discarding the staging table.
+    try:
+        with data as observations:
+            observations = timing.timed_reader('decompress', observations)
+            if data_source.filetype == 'bcf':
+                # BCF records are not lines, so we cannot report progress or
+                # save checkpoints in terms of line numbers.
+                lines = observations
+                records = None
+                checkpoint = False
+                position = None
+            else:
+                lines = RecordLines(observations, first_record=first_record,
+                                    last_record=last_record,
+                                    first_offset=first_offset)
+                records = data_source.records
+                if last_record is not None:
+                    # Progress of a shard is relative to its own records.
+                    records = last_record - shard_start + 1
+                # Records are read ahead of the observations that are
+                # written, so the checkpoint uses the position of the record
+                # that is currently written.
+                position = RecordPosition(lines)
+            # Identical observations (e.g., after normalization of equivalent
+            # indels on neighbouring records) are written as one.
+            observation_writer = AggregatingWriter(
+                staging.writer(), staging.columns, 'support')
+            if data_source.filetype == 'gvcf':
+                # Regions are merged over record boundaries, so they cannot
+                # be checkpointed per batch.
+                checkpoint = False
+                writers = {'observation': observation_writer}
+                if coverage is not None:
+                    writers['region'] = coverage_staging.writer()
+                writer = SplitWriter(writers)
+                rows = gvcf_rows(
+                    variation.id, coverage.id if coverage is not None else None,
+                    read_gvcf(lines,
+                              skip_filtered=variation.skip_filtered,
+                              use_genotypes=variation.use_genotypes,
+                              prefer_genotype_likelihoods=variation.prefer_genotype_likelihoods,
+                              min_gq=current_app.conf['GVCF_MIN_GQ'],
+                              min_dp=current_app.conf['GVCF_MIN_DP']))
+            else:
+                writer = observation_writer
+                rows = observation_rows(
+                    variation.id,
+                    read_observations(lines,
+                                      filetype=data_source.filetype,
+                                      skip_filtered=variation.skip_filtered,
+                                      use_genotypes=variation.use_genotypes,
+                                      prefer_genotype_likelihoods=variation.prefer_genotype_likelihoods,
+                                      position=position))
+            count = write_rows(
+                writer, rows, records,
+                checkpoint=save_checkpoint(variation, position) if checkpoint
+                else None,
+                first_record=shard_start)
+            if isinstance(data, DigestReader):
+                data_source.checksum, data_source.records = data.digest()
+                db.session.commit()
+    except ReadError as e:
+        raise TaskError('invalid_observations', str(e))
+
+    return count, observation_writer.aggregated
+
+
 @celery.task(base=CleanTask)
 def import_variation(variation_id):
     """
@@ -846,7 +1854,8 @@ def import_variation(variation_id):
     """
     logger.info('Started task: import_variation(%d)', variation_id)
 
-    current_task.update_state(state='PROGRESS', meta={'percentage': 0})
+    timer = start_timing()
+    current_task.update_state(state='PROGRESS', meta=progress_meta(0))
 
     variation = Variation.query.get(variation_id)
     if variation is None:
@@ -860,99 +1869,240 @@ def import_variation(variation_id):
                         'by another task instance')
 
     data_source = variation.data_source
+    sharding = current_app.conf['IMPORT_SHARDING']
+
+    # Shards are defined by line numbers, which BCF does not have. Regions
+    # read from gVCF are merged over the entire file.
+    if data_source.filetype in ('bcf', 'gvcf'):
+        sharding = None
+
+    # Coverage of a gVCF data source is imported in the same pass.
+    coverage = None
+    if data_source.filetype == 'gvcf' and variation.sample.coverage_profile:
+        coverage = data_source.coverages.filter_by(
+            sample_id=variation.sample_id).first()
+        if coverage is None:
+            coverage = Coverage(variation.sample, data_source)
+            db.session.add(coverage)
+        elif coverage.task_done:
+            raise TaskError('coverage_imported', 'Coverage already imported')
+        coverage.task_uuid = current_task.request.id
+        db.session.commit()
 
-    # Calculate data digest if it is not yet known.
+    # The data digest is usually calculated on upload. Otherwise, it is
+    # calculated during the import, unless we need the number of records up
+    # front for dividing the import in shards, or we resume the import from
+    # a checkpoint.
     # Todo: Can we somehow factor this out into a separate (singleton) task,
     #     on which we wait?
     #     Waiting synchronously is not a good idea, since we would be holding
     #     the worker process, but I think retrying after some countdown would
     #     be the solution?
     #     self.apply_async(countdown=SOME_CONFIGURATION_VARIABLE)
-    if not data_source.checksum:
+    if not data_source.checksum and (sharding or
+                                     variation.checkpoint_record is not None):
         with data_source.data() as data:
-            data_source.checksum, data_source.records = digest(data)
+            data_source.checksum, data_source.records = digest(
+                data, **digest_options(data_source.filetype))
         db.session.commit()
 
-    # Check if checksum is not in imported data sources.
-    if DataSource.query.filter_by(checksum=data_source.checksum
-                                  ).join(Variation).filter_by(task_done=True
-                                                              ).count() > 0:
-        raise TaskError('duplicate_data_source',
-                        'Identical data source already imported')
+    def check_duplicate():
+        # Check if checksum is not in imported data sources.
+        if DataSource.query.filter_by(checksum=data_source.checksum
+                                      ).join(Variation).filter_by(task_done=True
+                                                                  ).count() > 0:
+            raise TaskError('duplicate_data_source',
+                            'Identical data source already imported')
+
+    checked = bool(data_source.checksum)
+    if checked:
+        check_duplicate()
+
+    # Observations are collected in a staging table and published when the
+    # import is complete.
+    staging = observation_staging(variation.id)
+    coverage_staging = None
+    if coverage is not None:
+        coverage_staging = region_staging(coverage.id)
 
     def delete_observations():
+        staging.discard()
         variation.observations.delete()
+        if coverage is not None:
+            coverage_staging.discard()
+            coverage.regions.delete()
+        clear_checkpoint(variation)
         db.session.commit()
-    current_task.register_cleanup(current_task.request.id,
-                                  delete_observations)
 
-    # In case we are retrying after a failed import, delete any existing
-    # observations for this variation.
-    delete_observations()
+    def cleanup():
+        # After an unexpected error, observations up to the checkpoint are
+        # kept so a retry can resume the import from there.
+        db.session.rollback()
+        if variation.checkpoint_record is None:
+            delete_observations()
+    current_task.register_cleanup(current_task.request.id, cleanup)
+
+    # The staging table can be empty after a database crash (if unlogged),
+    # in which case we just start over.
+    if (variation.checkpoint_record is not None and not sharding and
+        staging.exists() and not staging.is_empty()):
+        # Observations up to the checkpoint are already imported.
+        logger.info('Resuming task: import_variation(%d) after record %d',
+                    variation_id, variation.checkpoint_record)
+    else:
+        # In case we are retrying after a failed import, delete any existing
+        # observations for this variation.
+        delete_observations()
+        staging.create()
+        if coverage is not None:
+            coverage_staging.create()
+        db.session.commit()
+
+    if sharding:
+        shards = variation_shards(data_source, sharding)
+        if len(shards) > 1:
+            # Shards are imported by parallel subtasks in the same staging
+            # table. The callback publishes the observations and is only
+            # called if all shards succeeded. If the import is restarted
+            # meanwhile, the callback and errback leave the new import alone.
+            header = [import_variation_shard.s(variation.id, first, last,
+                                               offset).set(
+                                                   task_id=str(uuid.uuid4()))
+                      for first, last, offset in shards]
+            callback = finish_variation_import.s(variation.id,
+                                                 variation.task_uuid)
+            callback.link_error(abort_variation_import.si(
+                variation.id, variation.task_uuid))
+            result = chord(header)(callback)
+            logger.info('Dispatched task: import_variation(%d) in %d shards',
+                        variation_id, len(shards))
+            # From now on, the import is monitored through the shards and the
+            # callback (see `task_result`).
+            return timing_result(
+                timer, shards=[shard.options['task_id'] for shard in header],
+                callback=result.id)
 
     try:
-        data = data_source.data()
-    except DataUnavailable as e:
-        raise TaskError(e.code, e.message)
+        count, aggregated = import_observations(
+            variation, staging, checkpoint=True, coverage=coverage,
+            coverage_staging=coverage_staging)
+        if not checked:
+            check_duplicate()
+    except TaskError:
+        # Resuming does not help if the data cannot be imported.
+        delete_observations()
+        raise
+
+    # Observations become visible at once, in the same transaction as
+    # marking the import done.
+    staging.publish(order_by=observation_order())
+    if coverage is not None:
+        coverage_staging.publish()
+        coverage.task_done = True
+    current_task.update_state(state='PROGRESS', meta=progress_meta(100))
+    variation.task_done = True
+    clear_checkpoint(variation)
+    db.session.commit()
 
-    # Remember that this only makes sense if autocommit and autoflush are off,
-    # which is the default for flask-sqlalchemy.
-    # Related discussion: https://groups.google.com/forum/?fromgroups=#!topic/sqlalchemy/ZD5RNfsmQmU
+    logger.info('Finished task: import_variation(%d), %d observations (%d '
+                'aggregated)', variation_id, count, aggregated)
+    return timing_result(timer, observations=count, aggregated=aggregated)
 
-    # Alternative solution might be to dump all observations to a file and
-    # import from that. It would not have memory problems and is probably
-    # faster, but really not portable.
-    # A better option is probably to bypass part of the ORM like discussed in
-    # this presentation:
-    #
-    # https://speakerdeck.com/rwarren/a-brief-intro-to-profiling-in-python
-    #
-    # Not sure if this would solve any memory problems, but it's probably a
-    # lot faster than what we do now.
 
-    try:
-        with data as observations:
-            old_percentage = -1
-            for i, (record, chromosome, position, reference, observed, zygosity, support) \
-                    in enumerate(read_observations(observations,
-                                                   filetype=data_source.filetype,
-                                                   skip_filtered=variation.skip_filtered,
-                                                   use_genotypes=variation.use_genotypes,
-                                                   prefer_genotype_likelihoods=variation.prefer_genotype_likelihoods)):
-                # Task progress is updated in whole percentages, so for a
-                # maximum of 100 times per task.
-                percentage = min(int(record / data_source.records * 100), 99)
-                if percentage > old_percentage:
-                    current_task.update_state(state='PROGRESS',
-                                              meta={'percentage': percentage})
-                    old_percentage = percentage
-                observation = Observation(variation, chromosome, position,
-                                          reference, observed,
-                                          zygosity=zygosity, support=support)
-                db.session.add(observation)
-                if i % DB_BUFFER_SIZE == DB_BUFFER_SIZE - 1:
-                    db.session.flush()
-                    db.session.commit()
-                    # Todo: In principle I think calling session.flush() once
-                    #     every N records should work perfectly. We could then
-                    #     just do a session.rollback() on error.
-                    #     Unfortunately, session.flush() does not prevent the
-                    #     memory usage from increasing (even with expire_all()
-                    #     or expunge_all() calls). So in practice we cannot
-                    #     use it (tested with psycopg2 2.4.5 and SQLAlchemy
-                    #     0.7.8).
-                    #     As an alternative, we call session.commit() but the
-                    #     problem is that a simple session.rollback() is not
-                    #     enough. Therefore we use the CleanTask base class
-                    #     to register a cleanup handler.
-    except ReadError as e:
-        raise TaskError('invalid_observations', str(e))
+@celery.task(base=CleanTask)
+def import_variation_shard(variation_id, first_record, last_record,
+                           first_offset=None):
+    """
+    Import part of a variation as observations.
+
+    Only records `first_record` through `last_record` (inclusive) of the data
+    source are imported. If `first_offset` is given, reading starts at this
+    offset of `first_record` in the data.
+    """
+    logger.info('Started task: import_variation_shard(%d, %d, %d)',
+                variation_id, first_record, last_record)
+
+    start_timing()
+    current_task.update_state(state='PROGRESS', meta=progress_meta(0))
+
+    variation = Variation.query.get(variation_id)
+    if variation is None:
+        raise TaskError('variation_not_found', 'Variation not found')
+
+    staging = observation_staging(variation.id)
+
+    # Observations are not linked to the shard they were imported by, so
+    # they cannot be removed here without affecting the other shards. After
+    # all shards have finished, the chord errback removes the staging table
+    # with the observations of the entire variation.
+    current_task.register_cleanup(current_task.request.id,
+                                  db.session.rollback)
+
+    count, aggregated = import_observations(variation, staging,
+                                            first_record=first_record,
+                                            last_record=last_record,
+                                            first_offset=first_offset)
+
+    logger.info('Finished task: import_variation_shard(%d, %d, %d), %d '
+                'observations (%d aggregated)', variation_id, first_record,
+                last_record, count, aggregated)
+    return count, aggregated
+
+
+@celery.task
+def finish_variation_import(counts, variation_id, task_uuid):
+    """
+    Mark a variation imported in shards as done.
+
+    This is called as chord callback after all shards were imported
+    successfully, with the number of observations imported and aggregated by
+    each shard.
 
-    current_task.update_state(state='PROGRESS', meta={'percentage': 100})
+    Nothing is done if the import was restarted by another task than
+    `task_uuid` in the meantime.
+    """
+    variation = Variation.query.get(variation_id)
+    if variation is None:
+        raise TaskError('variation_not_found', 'Variation not found')
+
+    if variation.task_uuid != task_uuid:
+        logger.info('Ignored task: finish_variation_import(%d), import was '
+                    'restarted', variation_id)
+        return
+
+    observation_staging(variation.id).publish(order_by=observation_order())
     variation.task_done = True
     db.session.commit()
 
-    logger.info('Finished task: import_variation(%d)', variation_id)
+    count = sum(c for c, _ in counts)
+    aggregated = sum(a for _, a in counts)
+    logger.info('Finished task: import_variation(%d), %d observations (%d '
+                'aggregated) in %d shards', variation_id, count, aggregated,
+                len(counts))
+    return {'observations': count, 'aggregated': aggregated}
+
+
+@celery.task
+def abort_variation_import(variation_id, task_uuid):
+    """
+    Discard observations of a variation import in shards that failed.
+
+    This is called as errback for the chord callback, after all shards have
+    finished, so it also removes observations imported by the shards that
+    succeeded (by removing the staging table).
+
+    Nothing is done if the import was restarted by another task than
+    `task_uuid` in the meantime, since the staging table is then used by the
+    new import.
+    """
+    variation = Variation.query.get(variation_id)
+    if variation is None or variation.task_uuid != task_uuid:
+        return
+
+    observation_staging(variation.id).discard()
+    db.session.commit()
+
+    logger.info('Aborted task: import_variation(%d)', variation_id)
 
 
 @celery.task(base=CleanTask)
@@ -962,7 +2112,8 @@ def import_coverage(coverage_id):
     """
     logger.info('Started task: import_coverage(%d)', coverage_id)
 
-    current_task.update_state(state='PROGRESS', meta={'percentage': 0})
+    timer = start_timing()
+    current_task.update_state(state='PROGRESS', meta=progress_meta(0))
 
     coverage = Coverage.query.get(coverage_id)
     if coverage is None:
@@ -977,56 +2128,132 @@ def import_coverage(coverage_id):
 
     data_source = coverage.data_source
 
-    # Calculate data digest if it is not yet known.
-    if not data_source.checksum:
+    def check_duplicate():
+        # Check if checksum is not in imported data sources.
+        if DataSource.query.filter_by(checksum=data_source.checksum
+                                      ).join(Coverage).filter_by(task_done=True
+                                                                 ).count() > 0:
+            raise TaskError('duplicate_data_source',
+                            'Identical data source already imported')
+
+    # If the data digest is not yet known, it is calculated during the
+    # import, unless we are resuming the import from a checkpoint.
+    if not data_source.checksum and coverage.checkpoint_record is not None:
         with data_source.data() as data:
             data_source.checksum, data_source.records = digest(data)
         db.session.commit()
 
-    # Check if checksum is not in imported data sources.
-    if DataSource.query.filter_by(checksum=data_source.checksum
-                                  ).join(Coverage).filter_by(task_done=True
-                                                             ).count() > 0:
-        raise TaskError('duplicate_data_source',
-                        'Identical data source already imported')
+    checked = bool(data_source.checksum)
+    if checked:
+        check_duplicate()
+
+    # Regions are collected in a staging table and published when the
+    # import is complete.
+    staging = region_staging(coverage.id)
 
     def delete_regions():
+        staging.discard()
         coverage.regions.delete()
+        clear_checkpoint(coverage)
         db.session.commit()
-    current_task.register_cleanup(current_task.request.id, delete_regions)
 
-    # In case we are retrying after a failed import, delete any existing
-    # regions for this coverage.
-    delete_regions()
+    def cleanup():
+        # After an unexpected error, regions up to the checkpoint are kept so
+        # a retry can resume the import from there.
+        db.session.rollback()
+        if coverage.checkpoint_record is None:
+            delete_regions()
+    current_task.register_cleanup(current_task.request.id, cleanup)
+
+    # The staging table can be empty after a database crash (if unlogged),
+    # in which case we just start over.
+    first_record = first_offset = None
+    if (coverage.checkpoint_record is not None and staging.exists() and
+        not staging.is_empty()):
+        # Regions up to the checkpoint are already imported.
+        logger.info('Resuming task: import_coverage(%d) after record %d',
+                    coverage_id, coverage.checkpoint_record)
+        first_record = coverage.checkpoint_record + 1
+        first_offset = coverage.checkpoint_offset
+    else:
+        # In case we are retrying after a failed import, delete any existing
+        # regions for this coverage.
+        delete_regions()
+        staging.create()
+        db.session.commit()
 
-    try:
-        data = data_source.data()
-    except DataUnavailable as e:
-        raise TaskError(e.code, e.message)
+    min_depth = current_app.conf['BEDGRAPH_MIN_DEPTH']
+
+    def import_regions(sort=False):
+        # Overlapping and adjacent regions are merged before they are
+        # written. Unsorted regions are sorted first, in which case we
+        # cannot save checkpoints.
+        try:
+            data = data_source.data()
+        except DataUnavailable as e:
+            raise TaskError(e.code, e.message)
+
+        if not checked:
+            data = DigestReader(data)
 
-    try:
         with data as regions:
-            old_percentage = -1
-            for i, (record, chromosome, begin, end) \
-                    in enumerate(read_regions(regions,
-                                              filetype=data_source.filetype)):
-                percentage = min(int(record / data_source.records * 100), 99)
-                if percentage > old_percentage:
-                    current_task.update_state(state='PROGRESS',
-                                              meta={'percentage': percentage})
-                    old_percentage = percentage
-                db.session.add(Region(coverage, chromosome, begin, end))
-                if i % DB_BUFFER_SIZE == DB_BUFFER_SIZE - 1:
-                    db.session.flush()
-                    db.session.commit()
+            regions = timing.timed_reader('decompress', regions)
+            if sort:
+                merged = MergedRegions(sort_regions(
+                    read_regions(regions, filetype=data_source.filetype,
+                                 min_depth=min_depth)))
+                checkpoint = None
+                records = None
+            else:
+                lines = RecordLines(regions, first_record=first_record,
+                                    first_offset=first_offset)
+                merged = MergedRegions(
+                    read_regions(lines, filetype=data_source.filetype,
+                                 min_depth=min_depth), lines)
+                checkpoint = save_checkpoint(coverage, merged)
+                records = data_source.records
+            count = write_rows(staging.writer(),
+                               region_rows(coverage.id, merged), records,
+                               checkpoint=checkpoint)
+            if not checked:
+                data_source.checksum, data_source.records = data.digest()
+                db.session.commit()
+        return count, merged.merged
+
+    try:
+        try:
+            count, merged = import_regions()
+        except UnsortedData as e:
+            logger.info('Sorting regions for task: import_coverage(%d): %s',
+                        coverage_id, str(e))
+            staging.truncate()
+            clear_checkpoint(coverage)
+            db.session.commit()
+            first_record = first_offset = None
+            count, merged = import_regions(sort=True)
     except ReadError as e:
+        # Resuming does not help if the data cannot be imported.
+        delete_regions()
         raise TaskError('invalid_regions', str(e))
 
-    current_task.update_state(state='PROGRESS', meta={'percentage': 100})
+    if not checked:
+        try:
+            check_duplicate()
+        except TaskError:
+            delete_regions()
+            raise
+
+    # Regions become visible at once, in the same transaction as marking the
+    # import done.
+    staging.publish()
+    current_task.update_state(state='PROGRESS', meta=progress_meta(100))
     coverage.task_done = True
+    clear_checkpoint(coverage)
     db.session.commit()
 
-    logger.info('Finished task: import_coverage(%d)', coverage_id)
+    logger.info('Finished task: import_coverage(%d), %d regions (%d merged)',
+                coverage_id, count, merged)
+    return timing_result(timer, regions=count, merged=merged)
 
 
 @celery.task
@@ -1039,7 +2266,8 @@ def write_annotation(annotation_id):
     """
     logger.info('Started task: write_annotation(%d)', annotation_id)
 
-    current_task.update_state(state='PROGRESS', meta={'percentage': 0})
+    timer = start_timing()
+    current_task.update_state(state='PROGRESS', meta=progress_meta(0))
 
     annotation = Annotation.query.get(annotation_id)
     if annotation is None:
@@ -1055,39 +2283,53 @@ def write_annotation(annotation_id):
     original_data_source = annotation.original_data_source
     annotated_data_source = annotation.annotated_data_source
 
-    # Calculate data digest if it is not yet known.
+    # Calculate data digest if it is not yet known. We need the checksum
+    # before annotating, to exclude the data source itself from the
+    # frequencies.
     if not original_data_source.checksum:
         with original_data_source.data() as data:
             (original_data_source.checksum,
-             original_data_source.records) = digest(data)
+             original_data_source.records) = digest(
+                 data, **digest_options(original_data_source.filetype))
         db.session.commit()
 
+    # The number of records in a region is not known from the index, so no
+    # progress is reported when annotating only a region.
+    if annotation.region is None:
+        original_records = original_data_source.records
+    else:
+        original_records = None
+
     try:
-        original_data = original_data_source.data()
-        annotated_data = annotated_data_source.data_writer()
+        original_data = original_data_source.data(region=annotation.region)
     except DataUnavailable as e:
         raise TaskError(e.code, e.message)
 
-    try:
-        with original_data as original, \
-                annotated_data as annotated_variants:
-            annotate_data_source(original, annotated_variants,
-                                 original_filetype=original_data_source.filetype,
-                                 annotated_filetype=annotated_data_source.filetype,
-                                 global_frequency=annotation.global_frequency,
-                                 sample_frequency=annotation.sample_frequency,
-                                 original_records=original_data_source.records,
-                                 exclude_checksum=original_data_source.checksum,
-                                 group_query=annotation.group_query)
-    except ReadError as e:
-        annotated_data_source.empty()
-        raise TaskError('invalid_data_source', str(e))
-
-    current_task.update_state(state='PROGRESS', meta={'percentage': 100})
+    with original_data as original:
+        try:
+            annotated_data = annotated_data_source.data_writer()
+        except DataUnavailable as e:
+            raise TaskError(e.code, e.message)
+        try:
+            with annotated_data as annotated_variants:
+                annotate_data_source(original, annotated_variants,
+                                     original_filetype=original_data_source.filetype,
+                                     annotated_filetype=annotated_data_source.filetype,
+                                     global_frequency=annotation.global_frequency,
+                                     sample_frequency=annotation.sample_frequency,
+                                     original_records=original_records,
+                                     exclude_checksum=original_data_source.checksum,
+                                     group_query=annotation.group_query)
+        except ReadError as e:
+            annotated_data_source.empty()
+            raise TaskError('invalid_data_source', str(e))
+
+    current_task.update_state(state='PROGRESS', meta=progress_meta(100))
     annotation.task_done = True
     db.session.commit()
 
     logger.info('Finished task: write_annotation(%d)', annotation_id)
+    return timing_result(timer)
 
 
 @celery.task
@@ -0,0 +1,270 @@
+"""
+Breakdown of task running time per stage.
+
+A :class:`StageTimer` accumulates wall and CPU time for named stages, such
+as parsing records or writing to the database. Stages can be nested, time is
+always attributed to the innermost stage only. Since our pipelines consist
+of lazily chained generators, this means that for example the time spent
+reading lines while iterating over parsed records is not counted as
+parsing.
+
+The timer is activated for the current thread with :func:`start` (tasks do
+this if the ``TASK_TIMING`` configuration setting is enabled). Code
+that is not run from a timed task can use :func:`timed` and friends without
+any cost beyond a lookup of the active timer.
+
+.. note:: CPU time is measured for the entire process, so it includes time
+    spent in background threads (for example decompressing data).
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from __future__ import division
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def clock():
+    """
+    Current wall and CPU time.
+
+    :return: Tuple of wall time and CPU time, both in seconds.
+    :rtype: (float, float)
+    """
+    return time.time(), time.clock()
+
+
+class StageTimer(object):
+    """
+    Accumulate wall and CPU time per stage.
+    """
+    def __init__(self, clock=clock):
+        """
+        :kwarg clock: Function returning the current wall and CPU time, see
+            :func:`clock`.
+        :type clock: function
+        """
+        #: Wall and CPU time per stage.
+        self.stages = OrderedDict()
+
+        #: Number of rows (or records) processed.
+        self.rows = 0
+
+        self._clock = clock
+        self._stack = []
+        self._last = self._clock()
+        self.started = self._last[0]
+
+    def _switch(self):
+        wall, cpu = self._clock()
+        if self._stack:
+            stage = self._stack[-1]
+            total_wall, total_cpu = self.stages.get(stage, (0, 0))
+            self.stages[stage] = (total_wall + wall - self._last[0],
+                                  total_cpu + cpu - self._last[1])
+        self._last = wall, cpu
+
+    def enter(self, stage):
+        """
+        Start attributing time to `stage`, until :meth:`exit` is called.
+        """
+        self._switch()
+        self._stack.append(stage)
+
+    def exit(self):
+        """
+        Stop attributing time to the current stage.
+        """
+        self._switch()
+        self._stack.pop()
+
+    def count(self, rows):
+        """
+        Add to the number of rows processed.
+        """
+        self.rows += rows
+
+    def meta(self):
+        """
+        Timing breakdown for use in task metadata.
+
+        :return: Dictionary with the wall and CPU time (in seconds) for each
+            stage, total wall time, number of rows, and rows per second.
+        :rtype: dict
+        """
+        self._switch()
+        wall = self._last[0] - self.started
+        return {'stages': dict((stage, {'wall': round(stage_wall, 3),
+                                        'cpu': round(stage_cpu, 3)})
+                               for stage, (stage_wall, stage_cpu)
+                               in self.stages.items()),
+                'wall': round(wall, 3),
+                'rows': self.rows,
+                'rows_per_second': round(self.rows / wall, 1) if wall else None}
+
+
+def start(clock=clock):
+    """
+    Activate a new timer for the current thread.
+
+    :kwarg clock: Function returning the current wall and CPU time, see
+        :func:`clock`.
+    :type clock: function
+
+    :return: The new timer.
+    :rtype: StageTimer
+    """
+    _local.timer = StageTimer(clock=clock)
+    return _local.timer
+
+
+def stop():
+    """
+    Deactivate the timer for the current thread.
+    """
+    _local.timer = None
+
+
+def current():
+    """
+    Get the active timer for the current thread.
+
+    :return: The active timer, or `None` if there is none.
+    :rtype: StageTimer
+    """
+    return getattr(_local, 'timer', None)
+
+
+def timed(stage, function):
+    """
+    Attribute the time of all calls to `function` to `stage`.
+
+    :return: Wrapped function, or `function` itself if no timer is active.
+    """
+    timer = current()
+    if timer is None:
+        return function
+
+    def timed_function(*args, **kwargs):
+        timer.enter(stage)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer.exit()
+    return timed_function
+
+
+def timed_stage(stage):
+    """
+    Decorator attributing the time of all calls to the decorated function to
+    `stage`, if a timer is active at the time of the call.
+    """
+    def decorator(function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            timer = current()
+            if timer is None:
+                return function(*args, **kwargs)
+            timer.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.exit()
+        return timed_function
+    return decorator
+
+
+@contextmanager
+def stage(name):
+    """
+    Context manager attributing the time of its block to stage `name`.
+    """
+    timer = current()
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+def timed_iter(stage, iterable, count=False):
+    """
+    Attribute the time of iterating over `iterable` to `stage`.
+
+    :kwarg count: If `True`, add the items to the number of rows processed.
+    :type count: bool
+
+    :return: Iterator over `iterable`.
+    """
+    timer = current()
+    if timer is None:
+        return iter(iterable)
+    return _timed_iter(timer, stage, iter(iterable), count=count)
+
+
+def _timed_iter(timer, stage, iterator, count=False):
+    while True:
+        timer.enter(stage)
+        try:
+            item = next(iterator)
+        finally:
+            timer.exit()
+        if count:
+            timer.rows += 1
+        yield item
+
+
+class TimedReader(object):
+    """
+    File-like wrapper attributing the time of reading to a stage.
+    """
+    def __init__(self, data, stage, timer):
+        self.data = data
+        self.stage = stage
+        self.timer = timer
+
+    def read(self, *args):
+        self.timer.enter(self.stage)
+        try:
+            return self.data.read(*args)
+        finally:
+            self.timer.exit()
+
+    def readline(self, *args):
+        self.timer.enter(self.stage)
+        try:
+            return self.data.readline(*args)
+        finally:
+            self.timer.exit()
+
+    def __iter__(self):
+        return _timed_iter(self.timer, self.stage, iter(self.data))
+
+    def __getattr__(self, name):
+        return getattr(self.data, name)
+
+
+def timed_reader(stage, data):
+    """
+    Attribute the time of reading from `data` to `stage`.
+
+    :return: Wrapped file-like object, or `data` itself if no timer is
+        active.
+    """
+    timer = current()
+    if timer is None:
+        return data
+    return TimedReader(data, stage, timer)
@@ -12,16 +12,25 @@ Various utilities for Varda.
 from __future__ import division
 
 import collections
-import hashlib
 import itertools
 import json
 
 from flask import current_app
+import numpy as np
 from sqlalchemy.sql import func
 
-from . import db, genome
+from . import bcf_reader, contigs, db, genome, timing
 from .models import Coverage, DataSource, Observation, Region, Sample, Variation, Group
 from .region_binning import all_bins
+from .streams import Digest, read_chunks
+
+
+# Number of bases to compare at once when moving indels to the left.
+MOVE_LEFT_BLOCK_SIZE = 64
+
+# Minimum number of single-base references on a chromosome to check them
+# with NumPy instead of one by one when normalizing variants in batch.
+VECTORIZE_MIN_VARIANTS = 32
 
 
 class ReferenceMismatch(Exception):
@@ -39,28 +48,22 @@ class NoGenotypesInRecord(Exception):
     pass
 
 
-def digest(data):
+def digest(data, gzipped=False, counter=None):
     """
     Given a file-like object opened for reading, calculate a digest as SHA1
     checksum and number of records.
 
     Calculating the number of records is done in a naive way by counting the
-    number of lines in the file, and as such includes empty and header lines.
-    """
-    def read_chunks(data, chunksize=0xf00000):
-        # Default chunksize is 16 megabytes.
-        while True:
-            chunk = data.read(chunksize)
-            if not chunk:
-                break
-            yield chunk
-
-    sha1 = hashlib.sha1()
-    records = 0
+    number of lines in the file, and as such includes empty and header lines,
+    unless a record counter is given.
+
+    See also :class:`varda.streams.Digest` for calculating a digest
+    incrementally, and for the `gzipped` and `counter` arguments.
+    """
+    result = Digest(gzipped=gzipped, counter=counter)
     for chunk in read_chunks(data):
-        sha1.update(chunk)
-        records += chunk.count('\n')
-    return sha1.hexdigest(), records
+        result.update(chunk)
+    return result.checksum, result.records
 
 
 def chromosome_compare_key(chromosome):
@@ -83,41 +86,19 @@ def chromosome_compare_key(chromosome):
 def normalize_chromosome(chromosome):
     """
     Try to get normalized chromosome name by reference lookup.
-    """
-    # Todo: Define these aliases in settings.
-    # Todo: Also have mappings between contig names on UCSC and GRCh37, like
-    #     contig GL000202.1 etcetera.
-    chromosome_aliases = [['M', 'MT', 'NC_012920.1', 'NC_012920_1',
-                           'NC_012920', 'chrM', 'chrMT']]
-
-    if not genome:
-        for aliases in chromosome_aliases:
-            if chromosome in aliases:
-                return aliases[0]
-        if chromosome.startswith('chr'):
-            return chromosome[3:]
-        return chromosome
-
-    if chromosome in genome:
-        return chromosome
 
-    if chromosome.startswith('chr'):
-        if chromosome[3:] in genome:
-            return chromosome[3:]
-    else:
-        if 'chr' + chromosome in genome:
-            return 'chr' + chromosome
-
-    for aliases in chromosome_aliases:
-        if chromosome in aliases:
-            for alias in aliases:
-                if alias in genome:
-                    return alias
+    See :class:`varda.contigs.ContigResolver` and the ``CHROMOSOME_ALIASES``
+    configuration setting.
+    """
+    normalized = contigs.resolve(chromosome)
+    if normalized is not None:
+        return normalized
 
     raise ReferenceMismatch('Chromosome "%s" not in reference genome' %
                             chromosome)
 
 
+@timing.timed_stage('normalize')
 def normalize_region(chromosome, begin, end):
     """
     Use reference to normalize chromosome name and validate location.
@@ -137,7 +118,7 @@ def normalize_region(chromosome, begin, end):
     # Todo: Probably raise an exception if begin > end.
 
     if genome:
-        if end > len(genome[chromosome]):
+        if end > genome.lengths[chromosome]:
             raise ReferenceMismatch('Position %d does not exist on chromosome'
                                     ' "%s" in reference genome' %
                                     (end, chromosome))
@@ -145,6 +126,7 @@ def normalize_region(chromosome, begin, end):
     return chromosome, begin, end
 
 
+@timing.timed_stage('normalize')
 def normalize_variant(chromosome, position, reference, observed):
     """
     Use reference to create a normalized representation of the variant.
@@ -168,35 +150,133 @@ def normalize_variant(chromosome, position, reference, observed):
 
     chromosome = normalize_chromosome(chromosome)
 
-    if genome:
-        if position > len(genome[chromosome]):
-            raise ReferenceMismatch('Position %d does not exist on chromosome'
-                                    ' "%s" in reference genome' %
-                                    (position, chromosome))
-        if (genome[chromosome][position - 1
-                               :position + len(reference) - 1].upper() !=
-            reference):
-            raise ReferenceMismatch('Sequence "%s" does not match reference'
-                                    ' genome on "%s" at position %d' %
-                                    (reference, chromosome, position))
+    if not genome:
+        return _normalize_checked(None, chromosome, position, reference,
+                                  observed)
+
+    contig = genome.contig(chromosome)
+    _check_reference(contig, chromosome, position, reference)
+    return _normalize_checked(contig, chromosome, position, reference,
+                              observed)
+
+
+@timing.timed_stage('normalize')
+def normalize_variants(variants):
+    """
+    Use reference to create normalized representations of a batch of
+    variants.
+
+    The result is the same as calling :func:`normalize_variant` on each
+    variant, but reference sequences are checked per chromosome in order of
+    position, single-base references with one NumPy lookup per chromosome,
+    and substitutions of one base are not trimmed or moved.
+
+    :arg variants: Variants as tuples of `chromosome`, `position`,
+        `reference`, `observed` (see :func:`normalize_variant`).
+    :type variants: iterable(tuple)
+
+    :return: For each variant (in the same order), a tuple of its normalized
+        representation (or `None`) and a :exc:`ReferenceMismatch` (or `None`
+        if the variant matches the reference).
+    :rtype: list((tuple, ReferenceMismatch))
+    """
+    variants = [(chromosome, position, reference.upper(), observed.upper())
+                for chromosome, position, reference, observed in variants]
+    results = [None] * len(variants)
+
+    by_chromosome = collections.defaultdict(list)
+    for i, (chromosome, position, reference, observed) in enumerate(variants):
+        try:
+            by_chromosome[normalize_chromosome(chromosome)].append(i)
+        except ReferenceMismatch as e:
+            results[i] = None, e
+
+    for chromosome, indices in by_chromosome.items():
+        contig = genome.contig(chromosome) if genome else None
+
+        if contig is not None:
+            indices.sort(key=lambda i: variants[i][1])
+            matches = _check_single_bases(contig, [variants[i]
+                                                   for i in indices])
+        else:
+            matches = [True] * len(indices)
+
+        for i, match in zip(indices, matches):
+            _, position, reference, observed = variants[i]
+            try:
+                if not match:
+                    _check_reference(contig, chromosome, position, reference)
+                if (len(reference) == len(observed) == 1 and
+                    reference != observed):
+                    results[i] = (chromosome, position, reference,
+                                  observed), None
+                else:
+                    results[i] = _normalize_checked(
+                        contig, chromosome, position, reference,
+                        observed), None
+            except ReferenceMismatch as e:
+                results[i] = None, e
+
+    return results
+
+
+def _check_single_bases(contig, variants):
+    """
+    Check single-base references of variants on a contig at once.
+
+    :return: For each variant, `True` if it has a single-base reference
+        matching `contig` and `False` if it must be checked by
+        :func:`_check_reference`.
+    :rtype: list(bool)
+    """
+    single = [1 <= position <= len(contig) and len(reference) == 1
+              for _, position, reference, _ in variants]
+    if sum(single) < VECTORIZE_MIN_VARIANTS:
+        return [False] * len(variants)
+
+    positions = np.array([variant[1] for variant, s in zip(variants, single)
+                          if s], dtype=np.int64)
+    references = np.array([variant[2] for variant, s in zip(variants, single)
+                           if s], dtype='S1')
+    matches = iter(contig.take(positions - 1) == references)
+    return [s and bool(next(matches)) for s in single]
+
+
+def _check_reference(contig, chromosome, position, reference):
+    """
+    Check `reference` against the reference genome, raise
+    :exc:`ReferenceMismatch` if it does not match.
+    """
+    if position > len(contig):
+        raise ReferenceMismatch('Position %d does not exist on chromosome'
+                                ' "%s" in reference genome' %
+                                (position, chromosome))
+    if contig[position - 1:position + len(reference) - 1] != reference:
+        raise ReferenceMismatch('Sequence "%s" does not match reference'
+                                ' genome on "%s" at position %d' %
+                                (reference, chromosome, position))
+
 
+def _normalize_checked(contig, chromosome, position, reference, observed):
+    """
+    Trim and move a variant with uppercase sequences that is checked against
+    the reference genome (if any).
+    """
     prefix, reference, observed, _ = trim_common(reference, observed)
     position += prefix
 
     # Todo: If reference == observed == '', there is no variant. Probably
     #     raise an exception in that case.
 
-    if not genome:
+    if contig is None:
         return chromosome, position, reference, observed
 
     # Insertions and deletions can be moved to the left by looking for cyclic
     # permutations.
     if reference == '':
-        position, observed = move_left(genome[chromosome], position, observed)
-        observed = observed.upper()
+        position, observed = move_left(contig, position, observed)
     elif observed == '':
-        position, reference = move_left(genome[chromosome], position, reference)
-        reference = reference.upper()
+        position, reference = move_left(contig, position, reference)
 
     return chromosome, position, reference, observed
 
@@ -243,7 +323,7 @@ def trim_common(s1, s2):
     return prefix, s1[prefix:], s2[prefix:], suffix
 
 
-def move_left(context, position, sequence):
+def move_left(context, position, sequence, block_size=MOVE_LEFT_BLOCK_SIZE):
     """
     Move `sequence` as far as possible to the left, starting at `position`
     (one-based) in `context`, while staying in cyclic permutations.
@@ -272,21 +352,52 @@ def move_left(context, position, sequence):
     :type position: int
     :arg sequence: Sequence to find cyclic permutations of in `context`.
     :type sequence: str
+    :kwarg block_size: Number of bases to compare at once. Rounded to a
+        multiple of the length of `sequence`.
+    :type block_size: int
 
     :return: A tuple (permutation, position) being the resulting cyclic
         permutation of `sequence` and its position in `context`.
     :rtype: (str, int)
     """
-    def lookup(p):
-        if position <= p < position + len(sequence):
-            return sequence[p - position].upper()
-        return context[p - 1].upper()
+    # We can move one base to the left if the base before `sequence` is the
+    # same as its last base. Repeating this, the move is the length of the
+    # longest common suffix of the context before `sequence` and the context
+    # ending with `sequence`, i.e., of `window[:-length]` and `window` where
+    # `window` is the context before `sequence` followed by `sequence`. We
+    # compare these in blocks of whole periods of `sequence`, reading context
+    # as needed.
+    length = len(sequence)
+    if not length:
+        # Any position is a cyclic permutation of the empty sequence.
+        return min(position, 1), sequence
+
+    step = length * max(1, block_size // length)
+    sequence_upper = sequence.upper()
+    window = sequence_upper
+    read = 0
 
     move = 0
-    while (position - move > 1 and
-           lookup(position - move - 1) ==
-           lookup(position + len(sequence) - move - 1)):
-        move += 1
+    while move < position - 1:
+        size = min(step, position - 1 - move)
+        while read < move + size:
+            begin = max(0, position - 1 - read - 4 * step)
+            block = context[begin:position - 1 - read].upper()
+            if not block:
+                raise IndexError('Position %d is outside context' % position)
+            read += len(block)
+            window = block + window
+        end = len(window) - move
+        left = window[end - length - size:end - length]
+        right = window[end - size:end]
+        if left == right:
+            move += size
+            continue
+        i = size - 1
+        while left[i] == right[i]:
+            move += 1
+            i -= 1
+        break
 
     if not move:
         # Note: This case is only needed because the general case fails for
@@ -350,6 +461,173 @@ def read_genotype(call, prefer_likelihoods=False):
         return [int(a) for a in call.gt_alleles]
 
 
+def count_genotypes(record, prefer_likelihoods=False):
+    """
+    Count zygosity per variant allele over all samples in a record.
+
+    This is a vectorized equivalent of calling :func:`read_genotype` for each
+    call in the record and counting the resulting genotypes. Genotypes of all
+    samples are parsed into one integer array (samples x ploidy) and counted
+    with NumPy reductions, which is much faster on records with many samples.
+
+    Only records read with :mod:`varda.vcf_reader` give access to the
+    unparsed sample values, and records read with :mod:`varda.bcf_reader`
+    to the binary sample values. For other records, and for irregular
+    records (e.g., mixed ploidy or partially missing values), `None` is
+    returned and the caller should fall back to :func:`read_genotype`.
+
+    :arg record: VCF or BCF record.
+    :type record: varda.vcf_reader.Record or varda.bcf_reader.Record
+    :arg prefer_likelihoods: Whether or not to prefer deriving genotypes from
+        likelihoods (if available).
+    :type prefer_likelihoods: bool
+
+    :return: For each ALT, the number of samples per zygosity
+        (``heterozygous`` or ``homozygous``) with that allele in their
+        genotype, or `None` if the record cannot be handled.
+    :rtype: list(collections.Counter)
+    :raise NoGenotypesInRecord: If the record has no genotype information.
+    """
+    try:
+        fields = record.format_keys
+    except AttributeError:
+        return None
+
+    if not any(x in fields for x in ('GT', 'GL', 'PL')):
+        raise NoGenotypesInRecord('The record has no genotypes defined and '
+                                  'nothing to derive them from')
+
+    alleles = len(record.ALT) + 1
+
+    if 'GT' in fields:
+        if hasattr(record, 'sample_array'):
+            result = _genotype_array_binary(record)
+        else:
+            result = _genotype_array(record)
+        if result is None:
+            return None
+        genotypes, uncalled = result
+        ploidy = genotypes.shape[1]
+    else:
+        ploidy = 2
+        uncalled = 0
+
+    if ((prefer_likelihoods or 'GT' not in fields) and
+        ('GL' in fields or 'PL' in fields)):
+        # Calls without GT are assumed to be diploid.
+        if uncalled and ploidy != 2:
+            return None
+
+        # All possible genotypes given alleles and ploidy (see
+        # :func:`read_genotype`).
+        possible_genotypes = np.array(sorted(
+            itertools.combinations_with_replacement(range(alleles), ploidy),
+            key=lambda g: g[::-1]), dtype=int)
+
+        key = 'PL' if 'PL' in fields else 'GL'
+        if hasattr(record, 'sample_array'):
+            likelihoods = record.sample_array(key).astype(float)
+            if np.isnan(likelihoods).any() or \
+                    (likelihoods <= bcf_reader.END_OF_VECTOR).any():
+                return None
+        else:
+            likelihoods = _likelihood_array(record, key)
+            if likelihoods is None:
+                return None
+        if likelihoods.shape[1] < len(possible_genotypes):
+            return None
+        likelihoods = likelihoods[:, :len(possible_genotypes)]
+
+        if key == 'PL':
+            genotypes = possible_genotypes[likelihoods.argmin(axis=1)]
+        else:
+            genotypes = possible_genotypes[likelihoods.argmax(axis=1)]
+
+    if genotypes.size and genotypes.max() >= alleles:
+        return None
+
+    # Samples x alleles, true where the allele is in the sample genotype.
+    present = (genotypes[:, :, np.newaxis] ==
+               np.arange(1, alleles)).any(axis=1)
+    heterozygous = (genotypes != genotypes[:, :1]).any(axis=1)
+
+    alt_support = []
+    for het, hom in zip((present & heterozygous[:, np.newaxis]).sum(axis=0),
+                        (present & ~heterozygous[:, np.newaxis]).sum(axis=0)):
+        support = collections.Counter()
+        if het:
+            support['heterozygous'] = int(het)
+        if hom:
+            support['homozygous'] = int(hom)
+        alt_support.append(support)
+    return alt_support
+
+
+def _genotype_array(record):
+    """
+    Parse the GT values of all called samples in a VCF record into an array
+    (samples x ploidy).
+
+    :return: Tuple of the array and the number of uncalled samples, or `None`
+        if the record is irregular.
+    """
+    values = record.sample_values('GT')
+    called = [value for value in values
+              if value not in (None, '.', './.')]
+    ploidies = set(value.count('/') + value.count('|') + 1
+                   for value in called)
+    if len(ploidies) > 1:
+        return None
+    ploidy = ploidies.pop() if ploidies else 2
+    try:
+        genotypes = np.array(
+            ' '.join(called).replace('|', ' ').replace('/', ' ').split(),
+            dtype=int).reshape(len(called), ploidy)
+    except ValueError:
+        return None
+    return genotypes, len(values) - len(called)
+
+
+def _genotype_array_binary(record):
+    """
+    Like :func:`_genotype_array`, but for a BCF record.
+    """
+    values = record.sample_array('GT')
+    # Alleles are encoded as (allele + 1) << 1 | phased, zero is missing.
+    present = values != bcf_reader.END_OF_VECTOR
+    known = present & (values != bcf_reader.MISSING) & (values >> 1 > 0)
+    called = known.any(axis=1)
+    if (known[called] != present[called]).any():
+        return None
+    ploidies = set(present[called].sum(axis=1))
+    if len(ploidies) > 1:
+        return None
+    ploidy = ploidies.pop() if ploidies else 2
+    genotypes = (values[called][:, :ploidy] >> 1) - 1
+    return genotypes, int((~called).sum())
+
+
+def _likelihood_array(record, key):
+    """
+    Parse the PL or GL values of all samples in a VCF record into an array
+    (samples x genotypes).
+
+    :return: Array of likelihoods, or `None` if the record is irregular.
+    """
+    values = record.sample_values(key)
+    if None in values:
+        return None
+    lengths = set(value.count(',') + 1 for value in values)
+    if len(lengths) != 1:
+        return None
+    try:
+        return np.array(','.join(values).split(','),
+                        dtype=float).reshape(len(values), lengths.pop())
+    except ValueError:
+        return None
+
+
+@timing.timed_stage('query')
 def calculate_frequency(chromosome, position, reference, observed,
                         sample=None, exclude_checksum=None,
                         group=None, inverse=False):
@@ -0,0 +1,293 @@
+"""
+Streaming VCF reader optimized for importing observations.
+
+The ``vcf.Reader`` class from PyVCF fully parses every record, including the
+INFO column and all fields of every sample call. For importing observations
+we need only a few of these values, so this module provides a reader which
+splits only the columns we need and parses INFO entries and sample calls
+lazily, on first access.
+
+Records and calls mimic (a subset of) the interface of the PyVCF
+``vcf.model._Record`` and ``vcf.model._Call`` classes. Values are parsed
+exactly as PyVCF would parse them, so both readers can be used
+interchangeably by :func:`varda.tasks.read_observations`.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from vcf.parser import (_vcf_metadata_parser, RESERVED_FORMAT, RESERVED_INFO)
+
+
+def _map(func, values):
+    """
+    Like `map`, but make missing values `None`.
+    """
+    return [func(value) if value != '.' else None for value in values]
+
+
+def _parse_number(entry_type, value):
+    if entry_type == 'Integer':
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if entry_type in ('Float', 'Numeric'):
+        return float(value)
+    return value
+
+
+class Info(object):
+    """
+    Values in the INFO column of a record, parsed on first access.
+    """
+    __slots__ = ('_raw', '_entries', '_infos')
+
+    def __init__(self, raw, infos):
+        self._raw = raw
+        self._entries = None
+        self._infos = infos
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if self._raw != '.':
+                for entry in self._raw.split(';'):
+                    key, separator, value = entry.partition('=')
+                    self._entries[key] = value if separator else None
+        return self._entries
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+
+        try:
+            entry_type = self._infos[key].type
+        except KeyError:
+            try:
+                entry_type = RESERVED_INFO[key]
+            except KeyError:
+                entry_type = 'String' if value is not None else 'Flag'
+
+        if entry_type == 'Flag' or value is None:
+            return True
+
+        values = value.split(',')
+        if entry_type == 'Integer':
+            try:
+                parsed = _map(int, values)
+            except ValueError:
+                parsed = _map(float, values)
+        elif entry_type == 'Float':
+            parsed = _map(float, values)
+        else:
+            parsed = _map(str, values)
+
+        try:
+            if self._infos[key].num == 1:
+                return parsed[0]
+        except KeyError:
+            pass
+        return parsed
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+class CallData(object):
+    """
+    Values of the fields of a sample call, parsed on first access.
+    """
+    __slots__ = ('_format', '_values', '_formats')
+
+    def __init__(self, format, values, formats):
+        self._format = format
+        self._values = values
+        self._formats = formats
+
+    def __getattr__(self, key):
+        try:
+            index = self._format.index(key)
+        except ValueError:
+            raise AttributeError(key)
+        try:
+            value = self._values[index]
+        except IndexError:
+            return None
+
+        if value == '.' or value == './.':
+            return None
+
+        try:
+            entry_type = self._formats[key].type
+            entry_num = self._formats[key].num
+        except KeyError:
+            entry_num = None
+            entry_type = RESERVED_FORMAT.get(key, 'String')
+
+        if entry_num == 1 or ',' not in value:
+            return _parse_number(entry_type, value)
+
+        values = value.split(',')
+        if entry_type == 'Integer':
+            try:
+                return _map(int, values)
+            except ValueError:
+                return _map(float, values)
+        if entry_type in ('Float', 'Numeric'):
+            return _map(float, values)
+        return values
+
+
+class Call(object):
+    """
+    A genotype call for one sample in a record.
+    """
+    __slots__ = ('site', 'sample', '_raw', '_formats', '_data')
+
+    def __init__(self, site, sample, raw, formats):
+        self.site = site
+        self.sample = sample
+        self._raw = raw
+        self._formats = formats
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = CallData(self.site.format_keys, self._raw.split(':'),
+                                  self._formats)
+        return self._data
+
+    @property
+    def gt_nums(self):
+        if 'GT' not in self.site.format_keys:
+            return None
+        return self.data.GT
+
+    @property
+    def called(self):
+        if 'GT' not in self.site.format_keys:
+            return None
+        return self.data.GT is not None
+
+    @property
+    def gt_alleles(self):
+        gt = self.gt_nums
+        if gt is None:
+            raise AttributeError('gt_alleles')
+        return gt.split('|' if '|' in gt else '/')
+
+
+class Record(object):
+    """
+    A record (line) in a VCF file.
+    """
+    __slots__ = ('CHROM', 'POS', 'REF', 'ALT', 'FILTER', 'INFO', 'FORMAT',
+                 'format_keys', 'sample_data', '_samples', '_reader')
+
+    def __init__(self, reader, fields):
+        self._reader = reader
+        self.CHROM = fields[0]
+        self.POS = int(fields[1])
+        self.REF = fields[3]
+        self.ALT = _map(str, fields[4].split(','))
+
+        filters = fields[6]
+        if filters == '.':
+            self.FILTER = None
+        elif filters == 'PASS':
+            self.FILTER = []
+        else:
+            self.FILTER = filters.split(';')
+
+        self.INFO = Info(fields[7], reader.infos)
+
+        try:
+            self.FORMAT = fields[8]
+        except IndexError:
+            self.FORMAT = None
+        self.format_keys = self.FORMAT.split(':') if self.FORMAT else []
+
+        #: Unparsed sample columns.
+        self.sample_data = fields[9] if len(fields) > 9 else ''
+        self._samples = None
+
+    @property
+    def samples(self):
+        """
+        List of :class:`Call` objects, one for each sample.
+        """
+        if self._samples is None:
+            if self.FORMAT is None:
+                self._samples = []
+            else:
+                self._samples = [
+                    Call(self, sample, raw, self._reader.formats)
+                    for sample, raw in zip(self._reader.samples,
+                                           self.sample_data.split('\t'))]
+        return self._samples
+
+    def sample_values(self, key):
+        """
+        Unparsed values of a FORMAT field for all samples, without
+        constructing :class:`Call` objects.
+
+        :arg key: FORMAT field, must be present in :attr:`FORMAT`.
+        :type key: str
+
+        :return: Value for each sample (`None` if missing from the call).
+        :rtype: list(str)
+        """
+        index = self.format_keys.index(key)
+        values = []
+        for raw in self.sample_data.split('\t')[:len(self._reader.samples)]:
+            fields = raw.split(':')
+            values.append(fields[index] if index < len(fields) else None)
+        return values
+
+
+class Reader(object):
+    """
+    Reader for VCF files, an iterator returning :class:`Record` objects.
+    """
+    def __init__(self, lines):
+        """
+        :arg lines: Open handle to a VCF file.
+        :type lines: iterator(str)
+        """
+        self.lines = iter(lines)
+        self.infos = {}
+        self.formats = {}
+        self.samples = []
+        self._parse_header()
+
+    def _parse_header(self):
+        parser = _vcf_metadata_parser()
+        for line in self.lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('##INFO'):
+                key, value = parser.read_info(line)
+                self.infos[key] = value
+            elif line.startswith('##FORMAT'):
+                key, value = parser.read_format(line)
+                self.formats[key] = value
+            elif not line.startswith('##'):
+                self.samples = line[1:].split('\t')[9:]
+                break
+
+    def __iter__(self):
+        for line in self.lines:
+            line = line.strip()
+            if line:
+                # The sample columns are split only when they are needed.
+                yield Record(self, line.split('\t', 9))
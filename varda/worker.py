@@ -10,5 +10,8 @@ Helper module for celery to run a worker.
 from . import celery, create_app
 
 
+# This module is imported by the main worker process, so the application (and
+# with it the reference genome) is created before the pool processes are
+# forked and shared by all of them.
 # Todo: Should we make it possible to use create_reverse_proxied_app here?
 create_app().app_context().push()